@@ -2,10 +2,12 @@ import hashlib
 import os
 import logging
 import traceback
+from collections import deque
 from aiogram import types
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from dotenv import load_dotenv
+from metrics import GENERATED_TOKENS, GENERATION_SECONDS, REGISTRY
 import asyncio  
 
 load_dotenv()
@@ -24,6 +26,12 @@ class AdminPanel:
         self.admin_password = os.getenv("ADMIN_PASSWORD")
         self.active_sessions = set()   
         self.login_attempts = {}         
+        # Оповещения получают вошедшие администраторы и чаты из ADMIN_ALERT_CHAT_IDS;
+        # если получателей нет, оповещения ждут ближайшего входа
+        self.alert_chat_ids = {
+            int(chat_id) for chat_id in os.getenv("ADMIN_ALERT_CHAT_IDS", "").split(",") if chat_id.strip()
+        }
+        self.pending_alerts = deque(maxlen=100)
 
 
     async def handle_admin_command(self, message: types.Message, state: FSMContext) -> bool:
@@ -48,9 +56,15 @@ class AdminPanel:
         if command == "/get_report":
             await self._handle_get_report(message.chat.id)
             return True
+        elif command == "/rebuild_report":
+            await self._handle_get_report(message.chat.id, full=True)
+            return True
         elif command == "/run_survey":
             await self._handle_run_survey(message.chat.id)
             return True
+        elif command == "/stats":
+            await self._handle_stats(message.chat.id)
+            return True
         elif command == "/exit_admin":
             await self._handle_exit_admin(message, state)
             return True
@@ -71,12 +85,15 @@ class AdminPanel:
                 "✅ Успешная аутентификация!\n"
                 "Доступные команды:\n"
                 "/get_report — получить отчет\n"
+                "/rebuild_report — пересчитать отчет по всей истории\n"
                 "/run_survey — запустить опрос\n"
+                "/stats — метрики бота\n"
                 "/exit_admin — выйти из админ-панели",
                 reply_markup=self._get_admin_keyboard()
             )
             
             logger.info(f"Администратор {user_id} вошел в систему")
+            await self._send_pending_alerts(user_id)
             return True
         else:
             await self._handle_wrong_password(message.chat.id, user_id)
@@ -91,27 +108,37 @@ class AdminPanel:
         )
 
 
-    async def _handle_get_report(self, chat_id: int):
+    async def _handle_get_report(self, chat_id: int, full: bool = False):
         try:
 
-            success = await asyncio.to_thread(self.data_processor.process_all_data)
+            success = await asyncio.to_thread(self.data_processor.process_all_data, full)
             
             if not success:
                 await self.bot.send_message(chat_id, "⚠️ Ошибка формирования отчёта")
                 return
                 
-            if not os.path.exists("analysis_results.csv"):
+            if not os.path.exists(self.data_processor.results_path):
                 await self.bot.send_message(chat_id, "⚠️ Файл не найден")
                 return
                 
             await self.bot.send_document(
                 chat_id,
-                types.FSInputFile("analysis_results.csv"),
+                types.FSInputFile(self.data_processor.results_path),
                 caption="📊 Отчёт готов"
             )
         except Exception as e:
             await self.bot.send_message(chat_id, f"⚠️ Ошибка: {str(e)}")
 
+    async def _handle_stats(self, chat_id: int):
+        lines = REGISTRY.summary()
+        generation_seconds = GENERATION_SECONDS.total()
+        if generation_seconds:
+            lines.insert(0, f"Скорость генерации: {GENERATED_TOKENS.total() / generation_seconds:.1f} ток/с")
+        text = "📈 Метрики\n" + ("\n".join(lines) if lines else "Данных пока нет")
+        # Лимит Telegram — 4096 символов на сообщение
+        for start in range(0, len(text), 4000):
+            await self.bot.send_message(chat_id, text[start:start + 4000])
+
     async def _handle_exit_admin(self, message: types.Message, state: FSMContext):
         user_id = message.from_user.id
         await state.clear()
@@ -124,18 +151,54 @@ class AdminPanel:
 
     async def _handle_run_survey(self, chat_id: int):
         try:
-            success = await self.survey_manager.run_scheduled_survey()
-            msg = "✅ Опрос запущен для всех пользователей!" if success else "⚠️ Ошибка запуска"
+            await self.bot.send_message(chat_id, "🚀 Рассылка опроса начата, отчёт придёт по завершении")
             logger.info(f"Администратор {chat_id} запустил опрос")
+            report = await self.survey_manager.run_scheduled_survey()
+            if report is None or not report["delivered"]:
+                msg = "⚠️ Ошибка запуска"
+            else:
+                msg = (
+                    f"✅ Опрос запущен: доставлено {report['delivered']} из {report['total']}\n"
+                    f"Заблокировали бота: {report['blocked']}, ошибок: {report['failed']}, "
+                    f"не отправлено: {report['pending']}\n"
+                    f"Время рассылки: {report['seconds']} с"
+                )
         except Exception as e:
             msg = f"💥 Критическая ошибка: {str(e)}"
             logger.error(f"Ошибка запуска опроса: {traceback.format_exc()}")   
         await self.bot.send_message(chat_id, msg)
 
+    async def run_alert_dispatcher(self):
+        while True:
+            alert = await self.survey_manager.alerts.get()
+            recipients = self.active_sessions | self.alert_chat_ids
+            if not recipients:
+                self.pending_alerts.append(alert)
+                logger.warning(f"Нет администраторов в сети, оповещение по {alert['user_id']} отложено")
+                continue
+            for chat_id in recipients:
+                await self._send_alert(chat_id, alert)
+
+    async def _send_pending_alerts(self, chat_id: int):
+        while self.pending_alerts:
+            await self._send_alert(chat_id, self.pending_alerts.popleft())
+
+    async def _send_alert(self, chat_id: int, alert: dict):
+        try:
+            await self.bot.send_message(
+                chat_id,
+                f"🚨 Возможная аномалия в анкете пользователя {alert['user_id']}\n"
+                f"Ошибка реконструкции {alert['error']:.4f} при пороге {alert['threshold']:.4f} "
+                f"(когорта {alert['cohort']})"
+            )
+        except Exception as e:
+            logger.error(f"Не удалось отправить оповещение администратору {chat_id}: {str(e)}")
+
     def _get_admin_keyboard(self):
         return types.ReplyKeyboardMarkup(
             keyboard=[
                 [types.KeyboardButton(text="/get_report"), types.KeyboardButton(text="/run_survey")],
+                [types.KeyboardButton(text="/rebuild_report"), types.KeyboardButton(text="/stats")],
                 [types.KeyboardButton(text="/exit_admin")]
             ],
             resize_keyboard=True,
@@ -1,6 +1,8 @@
 from aiogram import Bot
-from aiogram.types import ReplyKeyboardRemove
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message, ReplyKeyboardRemove
 import aiohttp
+import asyncio
 import os
 import logging
 from dotenv import load_dotenv
@@ -21,7 +23,7 @@ class BotFunctions(Bot):
                 text=text,
                 **kwargs
             )
-            logger.info(f"Сообщение отправлено в {chat_id}")
+            logger.info("Сообщение отправлено в %s", chat_id)
             return True
         except Exception as e:
             logger.error(f"Ошибка отправки сообщения: {str(e)}")
@@ -33,7 +35,7 @@ class BotFunctions(Bot):
                 chat_id=chat_id,
                 document=document
             )
-            logger.info(f"Документ отправлен в {chat_id}")
+            logger.info("Документ отправлен в %s", chat_id)
             return True
         except Exception as e:
             logger.error(f"Ошибка отправки документа: {str(e)}")
@@ -41,4 +43,78 @@ class BotFunctions(Bot):
 
     async def close(self):
         await self.session.close()
-        await super().close()
\ No newline at end of file
+        await super().close()
+
+
+class MessageStreamer:
+    def __init__(self, message: Message, min_interval: float = None):
+        self.message = message
+        self.min_interval = min_interval or float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+        self.latest = ""
+        self.shown = message.text or ""
+        self.last_edit = 0.0
+        self.finished = False
+        self._task = None
+
+    def update(self, text: str):
+        self.latest = text
+        if self.finished:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush())
+
+    async def finish(self, text: str):
+        self.finished = True
+        if self._task is not None:
+            self._task.cancel()
+        # Итоговую правку нельзя потерять: после RetryAfter ждём и повторяем, а если не вышло —
+        # убираем заглушку с частичным ответом и отправляем ответ новым сообщением
+        for attempt in range(2):
+            try:
+                await self._edit(text, final=True)
+                return
+            except TelegramRetryAfter as e:
+                logger.warning("Лимит редактирования в %s, пауза %s с", self.message.chat.id, e.retry_after)
+                if attempt == 0:
+                    await asyncio.sleep(e.retry_after)
+            except TelegramBadRequest as e:
+                logger.warning("Итоговая правка в %s не прошла: %s", self.message.chat.id, e)
+                break
+        try:
+            await self.message.delete()
+        except TelegramAPIError as e:
+            logger.debug("Заглушка не удалена: %s", e)
+        await self.message.answer(text)
+
+    async def discard(self):
+        self.finished = True
+        if self._task is not None:
+            self._task.cancel()
+        try:
+            await self.message.delete()
+        except TelegramBadRequest as e:
+            logger.debug("Сообщение не удалено: %s", e)
+
+    async def _flush(self):
+        delay = self.last_edit + self.min_interval - asyncio.get_running_loop().time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await self._edit(self.latest)
+
+    async def _edit(self, text: str, final: bool = False):
+        # Промежуточные правки можно пропускать; итоговая (final) пробрасывает ошибки в finish
+        if not text or text == self.shown:
+            return
+        try:
+            await self.message.edit_text(text)
+            self.shown = text
+        except TelegramRetryAfter as e:
+            if final:
+                raise
+            logger.warning("Лимит редактирования в %s, пауза %s с", self.message.chat.id, e.retry_after)
+        except TelegramBadRequest as e:
+            if final and "message is not modified" not in str(e):
+                raise
+            logger.debug("Сообщение не обновлено: %s", e)
+        finally:
+            self.last_edit = asyncio.get_running_loop().time()
@@ -0,0 +1,151 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+)
+from dotenv import load_dotenv
+from metrics import BROADCAST_DELIVERIES, BROADCAST_RETRIES
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        # RetryAfter от Telegram — лимит на весь бот, поэтому останавливаются все отправители
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self, tokens: float = 1):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+
+class Broadcaster:
+    # Рассылка по списку из SurveyStore: общий лимит сообщений в секунду, пауза между сообщениями
+    # в один чат, ограниченное число одновременных отправок и повторы с экспоненциальной паузой.
+    # Итог по каждому пользователю пишется в базу, поэтому прерванная рассылка продолжается с места остановки.
+    # Перед отправкой доставка захватывается в базе, так что одну рассылку могут одновременно вести
+    # несколько запусков или процессов, и никто не получит сообщения дважды
+    def __init__(self, store, rate: float = None, concurrency: int = None, max_retries: int = None,
+                 chat_interval: float = None, lease_seconds: float = None):
+        self.store = store
+        self.bucket = TokenBucket(rate or float(os.getenv("BROADCAST_RATE", "30")))
+        self.concurrency = concurrency or int(os.getenv("BROADCAST_CONCURRENCY", "10"))
+        self.max_retries = max_retries or int(os.getenv("BROADCAST_MAX_RETRIES", "5"))
+        self.chat_interval = chat_interval or float(os.getenv("BROADCAST_CHAT_INTERVAL", "1.0"))
+        # Захват без отчёта дольше lease_seconds считается брошенным упавшим процессом
+        self.lease_seconds = lease_seconds or float(os.getenv("BROADCAST_LEASE_S", "600"))
+        self.last_sent = {}
+        self.done = 0
+
+    async def run(self, broadcast_id: str, steps: list) -> dict:
+        # steps — корутины step(user_id), каждая отправляет одно сообщение; после каждой шаг
+        # фиксируется в базе, и повтор (в том числе после перезапуска) продолжает со следующей
+        started = time.monotonic()
+        user_ids = await asyncio.to_thread(self.store.pending_deliveries, broadcast_id, self.lease_seconds)
+        logger.info(f"Рассылка {broadcast_id}: к отправке {len(user_ids)}")
+
+        queue = asyncio.Queue()
+        for user_id in user_ids:
+            queue.put_nowait(user_id)
+        workers = [
+            asyncio.create_task(self._worker(broadcast_id, queue, steps, len(user_ids)))
+            for _ in range(min(self.concurrency, len(user_ids)))
+        ]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+        counts = await asyncio.to_thread(self.store.broadcast_report, broadcast_id)
+        # Доставки, которые ещё отправляет другой процесс, остаются за ним: рассылку закрывает последний
+        if not counts.get("pending") and not counts.get("sending"):
+            await asyncio.to_thread(self.store.finish_broadcast, broadcast_id)
+        report = {
+            "broadcast_id": broadcast_id,
+            "total": sum(counts.values()),
+            "delivered": counts.get("delivered", 0),
+            "blocked": counts.get("blocked", 0),
+            "failed": counts.get("failed", 0),
+            "pending": counts.get("pending", 0) + counts.get("sending", 0),
+            "seconds": round(time.monotonic() - started, 1)
+        }
+        logger.info(f"Рассылка {broadcast_id} завершена: {report}")
+        return report
+
+    async def _worker(self, broadcast_id: str, queue: asyncio.Queue, steps: list, total: int):
+        while not queue.empty():
+            user_id = queue.get_nowait()
+            step = await asyncio.to_thread(self.store.claim_delivery, broadcast_id, user_id, self.lease_seconds)
+            if step is None:
+                logger.debug("Доставку %s в рассылке %s уже ведёт другой запуск", user_id, broadcast_id)
+                continue
+            status, attempts, error = await self._deliver(broadcast_id, user_id, steps, step)
+            self.store.record_delivery(broadcast_id, user_id, status, attempts, error)
+            BROADCAST_DELIVERIES.inc(status=status)
+            self.done += 1
+            if self.done % 100 == 0 or self.done == total:
+                logger.info("Рассылка %s: обработано %d/%d", broadcast_id, self.done, total)
+
+    async def _deliver(self, broadcast_id: str, user_id: int, steps: list, step: int):
+        error = None
+        for attempt in range(1, self.max_retries + 2):
+            # Пауза между чатами — перед каждой попыткой, сообщения одной доставки идут подряд
+            await self._pace(user_id)
+            try:
+                while step < len(steps):
+                    await self.bucket.acquire()
+                    await steps[step](user_id)
+                    step += 1
+                    await asyncio.wrap_future(self.store.record_step(broadcast_id, user_id, step))
+                return "delivered", attempt, None
+            except TelegramRetryAfter as e:
+                error = str(e)
+                logger.warning("Лимит Telegram при отправке %s, пауза %s с", user_id, e.retry_after)
+                self.bucket.pause(e.retry_after)
+                BROADCAST_RETRIES.inc(reason="retry_after")
+                self.last_sent[user_id] = time.monotonic() + e.retry_after
+            except TelegramForbiddenError as e:
+                # Бот заблокирован или пользователь удалён — повторять бессмысленно
+                return "blocked", attempt, str(e)
+            except TelegramBadRequest as e:
+                return "failed", attempt, str(e)
+            except (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError) as e:
+                error = str(e)
+                BROADCAST_RETRIES.inc(reason="network")
+                delay = min(30.0, 2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+                logger.warning("Сбой отправки %s (попытка %d), повтор через %.1f с: %s", user_id, attempt, delay, error)
+                self.last_sent[user_id] = time.monotonic() + delay
+            except Exception as e:
+                logger.error("Ошибка отправки %s: %s", user_id, e)
+                return "failed", attempt, str(e)
+        return "failed", self.max_retries + 1, error
+
+    async def _pace(self, chat_id: int):
+        wait = self.last_sent.get(chat_id, 0.0) + self.chat_interval - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        self.last_sent[chat_id] = time.monotonic()
@@ -1,24 +1,69 @@
-from transformers import AutoModelForCausalLM, AutoTokenizer, StoppingCriteria, StoppingCriteriaList
+from transformers import AutoModelForCausalLM, AutoTokenizer, LogitsProcessor, LogitsProcessorList
+from transformers.pytorch_utils import Conv1D
 import torch
+import asyncio
 import logging
 import os
 import re
+import time
 from dotenv import load_dotenv
+from metrics import CHAT_RESPONSE_SECONDS, GENERATED_TOKENS, GENERATION_BATCH_SIZE, GENERATION_SECONDS
+from resource_usage import current_rss_mb, peak_rss_mb
+from inference_scheduler import GenerationCancelled, GenerationTimeout, InferenceScheduler
+from conversation_memory import ConversationStore
+from response_cache import ResponseCache
+from safety_router import CLARIFY_RESPONSE, HOTLINE_RESPONSE
+from speculative import SpeculativeDecoder
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-class StopOnEOS(StoppingCriteria):
-    def __call__(self, input_ids, scores, **kwargs):
-        return input_ids[0][-1] == self.eos_token_id
+BUSY_RESPONSE = "Сейчас много обращений. Напиши, пожалуйста, ещё раз через минуту."
+# Служебные ответы вместо генерации не кэшируются: иначе они вытеснят настоящие варианты ответа
+UNCACHEABLE_RESPONSES = (BUSY_RESPONSE, HOTLINE_RESPONSE, CLARIFY_RESPONSE)
+
+class SentenceStop(LogitsProcessor):
+    # Следит за каждой строкой пакета: отдаёт частичный текст слушателю и форсирует EOS для строки,
+    # как только выполнено правило конца предложения из _postprocess_response, запрос отменён
+    # новым сообщением пользователя или истёк его срок
+    def __init__(self, tokenizer, prompt_length: int, jobs: list, is_complete, preview):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.jobs = jobs
+        self.is_complete = is_complete
+        self.preview = preview
+        self.finished = [False] * len(jobs)
+
+    def __call__(self, input_ids, scores):
+        eos_token_id = self.tokenizer.eos_token_id
+        for row, job in enumerate(self.jobs):
+            generated = input_ids[row, self.prompt_length:]
+            if not self.finished[row] and job.abandoned:
+                self.finished[row] = True
+            elif not self.finished[row] and len(generated):
+                if (generated == eos_token_id).any():
+                    self.finished[row] = True
+                    continue
+
+                text = self.tokenizer.decode(generated, skip_special_tokens=True)
+                if job.listener is not None:
+                    preview = self.preview(text)
+                    if preview:
+                        job.listener(preview)
+                self.finished[row] = self.is_complete(text)
+
+            if self.finished[row]:
+                scores[row, :] = -float("inf")
+                scores[row, eos_token_id] = 0
+        return scores
 
-    def __init__(self, eos_token_id):
-        self.eos_token_id = eos_token_id
 
 class ChatModel:
     def __init__(self):
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        # CHAT_BACKEND: auto — GPU при наличии (fp16/bf16), cpu — fp32, cpu-int8 — динамическое int8-квантование
+        self.backend = os.getenv("CHAT_BACKEND", "auto")
+        self.device = "cuda" if torch.cuda.is_available() and self.backend == "auto" else "cpu"
         self.model_name = os.getenv("CHAT_MODEL_NAME", "ai-forever/rugpt3large_based_on_gpt2")
         
         self.tokenizer = AutoTokenizer.from_pretrained(
@@ -28,15 +73,25 @@ class ChatModel:
         )
         self.tokenizer.add_special_tokens({'pad_token': '[PAD]'})
         
-        self.model = AutoModelForCausalLM.from_pretrained(
-            self.model_name,
-            torch_dtype=torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16,
-            device_map="auto"
-        ).eval()
+        rss_before = current_rss_mb()
+        self.model = self._load_model(self.model_name)
+        logger.info(
+            f"Модель {self.model_name} загружена (backend={self.backend}, device={self.device}): "
+            f"+{current_rss_mb() - rss_before:.0f} МБ RSS, {self.memory_report()}"
+        )
 
-        self.stopping_criteria = StoppingCriteriaList([
-            StopOnEOS(self.tokenizer.eos_token_id)
-        ])
+        # CHAT_DRAFT_MODEL_NAME: небольшая модель с тем же словарём (например, rugpt3small_based_on_gpt2)
+        # включает спекулятивное декодирование
+        self.speculative = None
+        self.draft_model_name = os.getenv("CHAT_DRAFT_MODEL_NAME")
+        if self.draft_model_name:
+            self.speculative = SpeculativeDecoder(
+                self.model,
+                self._load_model(self.draft_model_name),
+                self.tokenizer.eos_token_id,
+                int(os.getenv("CHAT_SPECULATIVE_TOKENS", "4"))
+            )
+            logger.info(f"Спекулятивное декодирование с черновой моделью {self.draft_model_name}")
 
         self.generation_config = {
             "max_new_tokens": 200,  
@@ -46,58 +101,339 @@ class ChatModel:
             "temperature": 0.6,  
             "repetition_penalty": 1.3,
             "no_repeat_ngram_size": 3,
-            "stopping_criteria": self.stopping_criteria
+            "pad_token_id": self.tokenizer.pad_token_id,
+            # generate сам завершает строку на EOS и останавливается, когда завершены все строки пакета
+            "eos_token_id": self.tokenizer.eos_token_id
         }
 
-    async def generate_response(self, prompt: str, user_id: int) -> str:
+        self.max_prompt_length = 1024
+        self.history_token_budget = int(os.getenv("HISTORY_TOKEN_BUDGET", "512"))
+        self.summary_token_budget = int(os.getenv("HISTORY_SUMMARY_TOKENS", "64"))
+        self.memory = ConversationStore()
+        self.response_cache = ResponseCache()
+        self._build_prefix_cache()
+
+        self.scheduler = InferenceScheduler(self._generate_batch)
+
+    def _load_model(self, model_name: str):
+        if self.device == "cuda":
+            model = AutoModelForCausalLM.from_pretrained(
+                model_name,
+                torch_dtype=torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16,
+                device_map="auto"
+            ).eval()
+            # [PAD] добавлен поверх словаря модели: без расширения эмбеддингов паддинг в пакете ломает lookup
+            model.resize_token_embeddings(len(self.tokenizer))
+            return model
+
+        self._configure_cpu_threads()
+        model = AutoModelForCausalLM.from_pretrained(
+            model_name,
+            torch_dtype=torch.float32,
+            low_cpu_mem_usage=True
+        ).eval()
+        model.resize_token_embeddings(len(self.tokenizer))
+
+        if self.backend == "cpu-int8":
+            model = self._quantize_int8(model)
+        return model
+
+    def _configure_cpu_threads(self):
+        threads = int(os.getenv("CHAT_CPU_THREADS", "0")) or os.cpu_count() or 1
+        torch.set_num_threads(threads)
         try:
-            formatted_prompt = self._format_prompt(prompt)
-            
-            inputs = self.tokenizer(
-                formatted_prompt,
-                return_tensors="pt",
-                truncation=True,
-                max_length=1024
-            ).to(self.device)
-
-            with torch.inference_mode():
-                outputs = self.model.generate(
-                    **inputs,
-                    **self.generation_config
-                )
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # Меняется только до первого параллельного вызова torch в процессе
+            pass
+        logger.info(f"CPU-инференс: {torch.get_num_threads()} потоков intra-op")
 
-            full_response = self.tokenizer.decode(
-                outputs[0][inputs.input_ids.shape[-1]:], 
-                skip_special_tokens=True
-            )
-            
-            return self._postprocess_response(full_response)
-        
+    def _quantize_int8(self, model):
+        # GPT-2 хранит проекции в transformers Conv1D (x @ W + b); quantize_dynamic понимает только
+        # nn.Linear, поэтому сначала переводим их в Linear с транспонированными весами
+        for module in list(model.modules()):
+            for name, child in list(module.named_children()):
+                if isinstance(child, Conv1D):
+                    linear = torch.nn.Linear(child.weight.shape[0], child.weight.shape[1])
+                    linear.weight.data = child.weight.data.t().contiguous()
+                    linear.bias.data = child.bias.data
+                    setattr(module, name, linear)
+
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    @property
+    def queue_depth(self) -> int:
+        return self.scheduler.depth
+
+    def memory_report(self) -> dict:
+        report = {"rss_mb": round(current_rss_mb(), 1), "peak_rss_mb": round(peak_rss_mb(), 1)}
+        if self.device == "cuda":
+            report["cuda_allocated_mb"] = round(torch.cuda.memory_allocated() / 1024 / 1024, 1)
+        return report
+
+    async def generate_response(self, prompt: str, user_id: int, on_partial=None) -> str:
+        # on_partial(text) вызывается в event loop с очищенным частичным ответом по мере генерации
+        started = time.perf_counter()
+        try:
+            # Кэш подходит только для первого вопроса: продолжение диалога зависит от истории
+            cacheable = not self.memory.has_history(user_id)
+            if cacheable:
+                cached_response = self.response_cache.lookup(prompt)
+                if cached_response is not None:
+                    await asyncio.get_running_loop().run_in_executor(
+                        self.scheduler.executor,
+                        self._remember_turn,
+                        prompt, user_id, cached_response
+                    )
+                    CHAT_RESPONSE_SECONDS.observe(time.perf_counter() - started, source="cache")
+                    return cached_response
+
+            listener = None
+            if on_partial is not None:
+                loop = asyncio.get_running_loop()
+                listener = lambda text: loop.call_soon_threadsafe(on_partial, text)
+            response = await self.scheduler.submit(prompt, user_id, listener)
+
+            if cacheable and response not in UNCACHEABLE_RESPONSES:
+                self.response_cache.add(prompt, response)
+            CHAT_RESPONSE_SECONDS.observe(time.perf_counter() - started, source="model")
+            return response
+        except GenerationCancelled:
+            raise
+        except GenerationTimeout:
+            return BUSY_RESPONSE
         except Exception as e:
             logger.error(f"Generation error: {str(e)}")
             return "Извините, произошла ошибка обработки. Попробуйте переформулировать вопрос."
 
-    def _format_prompt(self, prompt: str) -> str:
+    def _generate_batch(self, jobs: list, overrides: dict) -> list:
+        # Спекулятивное декодирование работает построчно: принятая длина у каждой строки своя
+        if self.speculative is not None and len(jobs) > 1:
+            return [result for job in jobs for result in self._generate_batch([job], overrides)]
+
+        conversations = [self.memory.get(job.user_id) for job in jobs]
+        question_ids = [self._encode_question(job.prompt, conversation) for job, conversation in zip(jobs, conversations)]
+        input_ids, attention_mask, cached_past, cached_width = self._build_inputs(conversations, question_ids)
+        sentence_stop = SentenceStop(
+            self.tokenizer,
+            input_ids.shape[-1],
+            jobs,
+            self._is_complete,
+            self._preview_response
+        )
+
+        started = time.perf_counter()
+        with torch.inference_mode():
+            prefilled_past = self._prefill(input_ids, attention_mask, cached_past, cached_width)
+            past_key_values = prefilled_past if prefilled_past is not None else cached_past
+            if self.speculative is not None:
+                outputs = self._generate_speculative(jobs[0], input_ids, past_key_values, overrides)
+            else:
+                outputs = self.model.generate(
+                    input_ids=input_ids,
+                    attention_mask=attention_mask,
+                    past_key_values=past_key_values,
+                    logits_processor=LogitsProcessorList([sentence_stop]),
+                    **{**self.generation_config, **overrides}
+                )
+
+        GENERATION_SECONDS.observe(time.perf_counter() - started)
+        GENERATION_BATCH_SIZE.observe(len(jobs))
+
+        prompt_length = input_ids.shape[-1]
+        pad = self.tokenizer.pad_token_id
+        GENERATED_TOKENS.inc(sum(int((output[prompt_length:] != pad).sum()) for output in outputs))
+        results, completed = [], []
+        for row, (job, conversation, ids, output) in enumerate(zip(jobs, conversations, question_ids, outputs)):
+            text = self.tokenizer.decode(output[prompt_length:], skip_special_tokens=True)
+            # Отменённые и оборванные по сроку ответы пользователю не уходят и в историю не пишутся
+            if job.cancelled:
+                results.append(GenerationCancelled())
+                continue
+            if job.abandoned and not self._is_complete(text):
+                results.append(GenerationTimeout())
+                continue
+
+            response = self._postprocess_response(text)
+            completed.append(row)
+            results.append(response)
+
+        if prefilled_past is not None:
+            self._store_states(conversations, question_ids, prefilled_past, attention_mask, completed)
+
+        for row in completed:
+            conversation = conversations[row]
+            conversation.add_turn(jobs[row].prompt, results[row], question_ids[row] + self._encode(f" {results[row]}\n"))
+            self.memory.commit(jobs[row].user_id, conversation)
+        return results
+
+    def _generate_speculative(self, job, input_ids, past_key_values, overrides: dict):
+        def should_stop(generated) -> bool:
+            if job.abandoned:
+                return True
+            text = self.tokenizer.decode(generated, skip_special_tokens=True)
+            if job.listener is not None:
+                preview = self._preview_response(text)
+                if preview:
+                    job.listener(preview)
+            return self._is_complete(text)
+
+        return self.speculative.generate(
+            input_ids,
+            past_key_values,
+            {**self.generation_config, **overrides},
+            should_stop
+        )
+
+    def _remember_turn(self, prompt: str, user_id: int, response: str):
+        # Выполняется в потоке генерации, чтобы не пересекаться с обработкой истории пользователя
+        conversation = self.memory.get(user_id)
+        ids = self._encode_question(prompt, conversation)
+        conversation.add_turn(prompt, response, ids + self._encode(f" {response}\n"))
+        self.memory.commit(user_id, conversation)
+
+    def _encode(self, text: str) -> list:
+        return self.tokenizer(text, add_special_tokens=False).input_ids
+
+    def _encode_question(self, prompt: str, conversation) -> list:
+        # Вопрос обрезается слева, как раньше весь промпт; под историю остаётся то, что не занял вопрос
+        available = self.max_prompt_length - len(self.prefix_ids)
+        ids = self._encode(self._format_question(prompt))[-available:]
+        conversation.fit_to_budget(
+            min(self.history_token_budget, available - len(ids)),
+            self._encode,
+            self.summary_token_budget
+        )
+        return ids
+
+    def _build_prefix_cache(self):
+        self.prefix_ids = self._encode(self._system_prompt())
+
+        with torch.inference_mode():
+            self.prefix_past = self.model(
+                torch.tensor([self.prefix_ids], device=self.device),
+                use_cache=True
+            ).past_key_values
+
+        logger.info(f"Кэш системного промпта построен: {len(self.prefix_ids)} токенов")
+
+    def _build_inputs(self, conversations: list, question_ids: list):
+        # Строка пакета: [паддинг][закэшированный контекст][паддинг][новые токены].
+        # Закэшированная часть — общий системный промпт либо сохранённое состояние диалога
+        rows = []
+        for conversation, ids in zip(conversations, question_ids):
+            history = conversation.history_ids
+            if conversation.past_key_values is not None:
+                past, cached = conversation.past_key_values, conversation.cached_length
+            else:
+                past, cached = self.prefix_past, 0
+            rows.append((past, self.prefix_ids + history[:cached], history[cached:] + ids))
+
+        cached_width = max(len(cached_ids) for _, cached_ids, _ in rows)
+        new_width = max(len(new_ids) for _, _, new_ids in rows)
+        pad = self.tokenizer.pad_token_id
+
+        input_ids, attention_mask = [], []
+        for _, cached_ids, new_ids in rows:
+            cached_pad = cached_width - len(cached_ids)
+            new_pad = new_width - len(new_ids)
+            input_ids.append([pad] * cached_pad + cached_ids + [pad] * new_pad + new_ids)
+            attention_mask.append([0] * cached_pad + [1] * len(cached_ids) + [0] * new_pad + [1] * len(new_ids))
+
+        return (
+            torch.tensor(input_ids, device=self.device),
+            torch.tensor(attention_mask, device=self.device),
+            self._merge_past([past for past, _, _ in rows], cached_width),
+            cached_width
+        )
+
+    def _merge_past(self, pasts: list, width: int):
+        if all(past is self.prefix_past for past in pasts):
+            return tuple(
+                tuple(tensor.expand(len(pasts), -1, -1, -1) for tensor in layer)
+                for layer in self.prefix_past
+            )
+
+        return tuple(
+            tuple(
+                torch.cat([
+                    torch.nn.functional.pad(past[layer][i], (0, 0, width - past[layer][i].shape[-2], 0))
+                    for past in pasts
+                ])
+                for i in range(len(pasts[0][layer]))
+            )
+            for layer in range(len(pasts[0]))
+        )
+
+    def _prefill(self, input_ids, attention_mask, past_key_values, cached_width: int):
+        # Прогоняем только новые токены поверх кэша, кроме последнего:
+        # generate с past_key_values сам подаёт в модель последний токен
+        if input_ids.shape[-1] - 1 <= cached_width:
+            return None
+
+        mask = attention_mask[:, :-1]
+        position_ids = mask.long().cumsum(-1) - 1
+        position_ids.masked_fill_(mask == 0, 1)
+
+        return self.model(
+            input_ids=input_ids[:, cached_width:-1],
+            attention_mask=mask,
+            position_ids=position_ids[:, cached_width:],
+            past_key_values=past_key_values,
+            use_cache=True
+        ).past_key_values
+
+    def _store_states(self, conversations: list, question_ids: list, past_key_values, attention_mask, rows: list):
+        # Состояние после префилла покрывает промпт без последнего токена — его и сохраняем за пользователем
+        for row in rows:
+            conversation, ids = conversations[row], question_ids[row]
+            keep = attention_mask[row, :-1].nonzero(as_tuple=True)[0]
+            past = tuple(
+                tuple(tensor[row:row + 1, :, keep, :] for tensor in layer)
+                for layer in past_key_values
+            )
+            nbytes = sum(tensor.numel() * tensor.element_size() for layer in past for tensor in layer)
+            conversation.set_past(past, conversation.history_length + len(ids) - 1, nbytes)
+
+    def close(self):
+        self.scheduler.close()
+
+    def _system_prompt(self) -> str:
         return (
             "Ты — психологический помощник для школьников. Отвечай подробно 3-5 предложениями. "
             "Используй техники КПТ и mindfulness. Примеры ответов:\n"
             "1. 'Сделай дыхательное упражнение 4-7-8: вдох 4 сек, задержка 7 сек, выдох 8 сек.'\n"
             "2. 'Составь список дел по приоритетам. Начни с самых важных.'\n"
-            f"Вопрос: {prompt}\nОтвет:"
         )
+
+    def _format_question(self, prompt: str) -> str:
+        return f"Вопрос: {prompt}\nОтвет:"
     
+    def _clean_response(self, text: str) -> str:
+        return re.sub(r'(Пользователь:|Ассистент:|Вопрос:|Ответ:|\\n)', '', text)
+
+    def _is_complete(self, text: str) -> bool:
+        return re.search(r'[.!?…]', self._clean_response(text)) is not None
+
+    def _is_blacklisted(self, text: str) -> bool:
+        blacklist = ["жизнь", "смысл", "религия", "политика", "суицид"]
+        return any(word in text.lower() for word in blacklist)
+
+    def _preview_response(self, text: str) -> str:
+        text = self._clean_response(text).strip()
+        return "" if self._is_blacklisted(text) else text
+
     def _postprocess_response(self, text: str) -> str:
-        text = re.sub(r'(Пользователь:|Ассистент:|Вопрос:|Ответ:|\\n)', '', text)
+        text = self._clean_response(text)
         
         match = re.search(r'[.!?…]', text)
         if match:
             text = text[:match.end()]
         
-        blacklist = ["жизнь", "смысл", "религия", "политика", "суицид"]
-        if any(word in text.lower() for word in blacklist):
-            return "Обратись к школьному психологу или позвони на горячую линию: 8-800-2000-122."
+        if self._is_blacklisted(text):
+            return HOTLINE_RESPONSE
         
         if len(text) < 15:
-            return "Уточни, пожалуйста, свой вопрос."
+            return CLARIFY_RESPONSE
         
         return text.strip()
\ No newline at end of file
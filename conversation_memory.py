@@ -0,0 +1,132 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class Conversation:
+    def __init__(self):
+        self.turns = []
+        self.summary = []
+        self.summary_ids = []
+        # KV-кэш покрывает системный промпт и первые cached_length токенов истории
+        self.past_key_values = None
+        self.cached_length = 0
+        self.past_nbytes = 0
+        self.updated_at = time.monotonic()
+
+    @property
+    def history_ids(self) -> list:
+        ids = list(self.summary_ids)
+        for turn in self.turns:
+            ids.extend(turn["ids"])
+        return ids
+
+    @property
+    def history_length(self) -> int:
+        return len(self.summary_ids) + sum(len(turn["ids"]) for turn in self.turns)
+
+    def add_turn(self, question: str, answer: str, ids: list):
+        self.turns.append({"question": question, "answer": answer, "ids": ids})
+        self.updated_at = time.monotonic()
+
+    def set_past(self, past_key_values, cached_length: int, nbytes: int):
+        self.past_key_values = past_key_values
+        self.cached_length = cached_length
+        self.past_nbytes = nbytes
+
+    def drop_past(self):
+        self.set_past(None, 0, 0)
+
+    def fit_to_budget(self, budget: int, encode, summary_budget: int):
+        # Старые реплики не обрезаются по токенам, а сворачиваются в краткую сводку вопросов
+        dropped = False
+        while self.turns and self.history_length > budget:
+            self.summary.append(self.turns.pop(0)["question"][:80])
+            dropped = True
+
+        if dropped:
+            self.summary_ids = []
+            limit = min(summary_budget, budget - self.history_length)
+            while self.summary:
+                summary_ids = encode(f"Ранее обсуждали: {'; '.join(self.summary)}\n")
+                if len(summary_ids) <= limit:
+                    self.summary_ids = summary_ids
+                    break
+                self.summary.pop(0)
+            self.drop_past()
+
+        if self.history_length > budget:
+            self.summary, self.summary_ids = [], []
+            self.drop_past()
+
+
+class ConversationStore:
+    def __init__(self, max_users: int = None, max_cache_mb: float = None, ttl_seconds: float = None):
+        self.max_users = max_users or int(os.getenv("CONVERSATION_MAX_USERS", "10000"))
+        self.max_cache_bytes = (max_cache_mb or float(os.getenv("CONVERSATION_CACHE_MB", "1024"))) * 1024 * 1024
+        self.ttl = ttl_seconds or float(os.getenv("CONVERSATION_TTL_SECONDS", "1800"))
+        self.conversations = OrderedDict()
+        self.cache_sizes = {}
+        self.cache_bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, user_id: int) -> Conversation:
+        with self.lock:
+            self._evict_expired()
+            conversation = self.conversations.get(user_id)
+            return conversation if conversation is not None else Conversation()
+
+    def has_history(self, user_id: int) -> bool:
+        with self.lock:
+            conversation = self.conversations.get(user_id)
+            return conversation is not None and bool(conversation.turns or conversation.summary)
+
+    def commit(self, user_id: int, conversation: Conversation):
+        with self.lock:
+            self._forget(user_id)
+            conversation.updated_at = time.monotonic()
+            self.conversations[user_id] = conversation
+            self.cache_sizes[user_id] = conversation.past_nbytes
+            self.cache_bytes += conversation.past_nbytes
+            self._evict()
+
+    def reset(self, user_id: int):
+        with self.lock:
+            self._forget(user_id)
+
+    def _forget(self, user_id: int):
+        self.conversations.pop(user_id, None)
+        self.cache_bytes -= self.cache_sizes.pop(user_id, 0)
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        while self.conversations:
+            user_id, conversation = next(iter(self.conversations.items()))
+            if now - conversation.updated_at < self.ttl:
+                break
+            self._forget(user_id)
+
+    def _evict(self):
+        self._evict_expired()
+
+        while len(self.conversations) > self.max_users:
+            self._forget(next(iter(self.conversations)))
+
+        # При нехватке памяти у самых старых диалогов сбрасывается только KV-кэш, история остаётся
+        for user_id, conversation in self.conversations.items():
+            if self.cache_bytes <= self.max_cache_bytes:
+                break
+            self.cache_bytes -= self.cache_sizes.pop(user_id, 0)
+            conversation.drop_past()
+
+        logger.debug(
+            "Диалогов в памяти: %d, KV-кэш: %.1f МБ",
+            len(self.conversations), self.cache_bytes / 1024 / 1024
+        )
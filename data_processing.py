@@ -1,51 +1,62 @@
 import pandas as pd
 import numpy as np
+import json
 import logging
-import traceback
-from sklearn.preprocessing import MinMaxScaler, OneHotEncoder
-from sklearn.compose import ColumnTransformer
-from joblib import load
-from tensorflow.keras.models import load_model
 import os
+import threading
+import time
+import traceback
+from dotenv import load_dotenv
+from metrics import JOB_PHASE_SECONDS, JOB_ROWS, JOB_RUNS
+from quantile_sketch import AnomalyThresholds
+from resource_usage import current_rss_mb, peak_rss_mb
+from survey_storage import SurveyStore
+
+load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-class DataProcessor:
-    def _update_users_file(self, user_id: int):
-        try:
-            users_file = "users.csv"
-            
-            if not os.path.exists(users_file):
-                pd.DataFrame(columns=["user_id"]).to_csv(users_file, index=False)
-            
-            users_df = pd.read_csv(users_file)
-            if user_id not in users_df["user_id"].values:
-                users_df = pd.concat([users_df, pd.DataFrame({"user_id": [user_id]})], ignore_index=True)
-                users_df.to_csv(users_file, index=False)
-                logger.info(f"Пользователь {user_id} добавлен в users.csv")
-                
-        except Exception as e:
-            logger.error(f"Ошибка обновления users.csv: {str(e)}")
+TIME_COLUMNS = ['Время засыпания', 'Время пробуждения']
 
-    def save_response(self, user_id: int, answers: dict):
-        try:
-            response_data = pd.DataFrame([answers])
-            response_data["user_id"] = user_id
-            response_data["timestamp"] = pd.Timestamp.now()
+class DataProcessor:
+    def register_user(self, user_id: int):
+        # Возвращает Future записи: регистрация подтверждается только после фиксации
+        future = self.store.add_user(user_id)
+        logger.info("Пользователь %s добавлен в очередь записи", user_id)
+        return future
 
-            if not os.path.exists("survey_data.csv"):
-                response_data.to_csv("survey_data.csv", index=False)
-            else:
-                response_data.to_csv("survey_data.csv", mode='a', header=False, index=False)
+    def get_user_ids(self) -> list:
+        return self.store.get_user_ids()
 
-            logger.info(f"Ответы пользователя {user_id} сохранены")
-        except Exception as e:
-            logger.error(f"Ошибка сохранения ответов: {str(e)}")
-            raise
+    def save_response(self, user_id: int, answers: dict):
+        # Возвращает Future, который завершается после фиксации анкеты в базе
+        return self.store.save_response(user_id, answers, pd.Timestamp.now())
 
     def __init__(self):
-        self.preprocessor = load('preprocessor.joblib')
-        self.autoencoder = load_model('model.h5')
+        # Препроцессор и автоэнкодер грузятся по требованию в load_models,
+        # чтобы сохранение анкет работало без тяжёлых импортов
+        self.preprocessor = None
+        self.autoencoder = None
+        self.keras_model = False
+        # SCORING_BACKEND: auto — NumPy-артефакт, если он выгружен, иначе Keras; numpy / keras — принудительно
+        self.scoring_backend = os.getenv("SCORING_BACKEND", "auto")
+        self.scoring_model_path = os.getenv("SCORING_MODEL_PATH", "scoring_model.npz")
+        self._models_lock = threading.Lock()
+        self.store = SurveyStore()
+        self.results_path = 'analysis_results.csv'
+        self.scored_path = f"{self.results_path}.scored"
+        self._process_lock = threading.Lock()
+        # Скетчи порогов хранятся рядом с моделью и переживают перезапуск
+        self.thresholds_path = os.getenv("ANOMALY_THRESHOLDS_PATH", "anomaly_thresholds.json")
+        self.thresholds = AnomalyThresholds()
+        self.thresholds.load(self.thresholds_path)
+        # Медианы времени сна с прошлого отчёта — для заполнения пропусков в одиночной анкете
+        self.fill_values = json.loads(self.store.get_meta("anomaly_scoring", "{}")).get("fill_values")
+        # Отчёт строится порциями: размер порции подбирается так, чтобы её обработка
+        # укладывалась в REPORT_MEMORY_LIMIT_MB
+        self.memory_limit_mb = float(os.getenv("REPORT_MEMORY_LIMIT_MB", "256"))
+        self.probe_rows = 1000
+        self.chunk_rows = self.probe_rows
         self.required_columns = [
             'Шаги', 'Время активности', 'Средний пульс', 'Длительность сна',
             'Качество сна', 'Время засыпания', 'Время пробуждения', 
@@ -57,39 +68,85 @@ class DataProcessor:
             'unknown': 'unknown'
         }
 
-    def _preprocess_data(self, data: pd.DataFrame) -> pd.DataFrame:
+    def load_models(self):
+        with self._models_lock:
+            if self.autoencoder is None:
+                if self.scoring_backend != "keras" and os.path.exists(self.scoring_model_path):
+                    # NumPy-артефакт из tools/export_scoring_model.py: без импорта TensorFlow и sklearn
+                    from scoring_engine import load_scoring_model
+                    self.preprocessor, self.autoencoder = load_scoring_model(self.scoring_model_path)
+                elif self.scoring_backend == "numpy":
+                    raise FileNotFoundError(f"Не найден {self.scoring_model_path}, выгрузите его tools/export_scoring_model.py")
+                else:
+                    from joblib import load
+                    from tensorflow.keras.models import load_model
+
+                    self.preprocessor = load('preprocessor.joblib')
+                    self.autoencoder = load_model('model.h5')
+                    self.keras_model = True
+                    if self.scoring_backend != "keras":
+                        logger.warning(
+                            "Не найден %s: анкеты оцениваются через TensorFlow, это в разы медленнее. "
+                            "Выгрузите модель tools/export_scoring_model.py", self.scoring_model_path
+                        )
+                logger.info(f"Модель оценки анкет загружена ({type(self.autoencoder).__name__})")
+        return self
+
+    def _preprocess_data(self, data: pd.DataFrame, fill_values: dict = None) -> pd.DataFrame:
+        # Время сна заполняется медианой, поэтому порция, где его не указал никто, не ошибка
+        for column in TIME_COLUMNS:
+            if column not in data.columns:
+                data[column] = np.nan
         missing = [col for col in self.required_columns if col not in data.columns]
         if missing:
             raise ValueError(f"Отсутствуют столбцы: {missing}")
 
-        data['Время засыпания'] = data['Время засыпания'].apply(self._convert_time)
-        data['Время пробуждения'] = data['Время пробуждения'].apply(self._convert_time)
+        data['Время засыпания'] = self._convert_time(data['Время засыпания'])
+        data['Время пробуждения'] = self._convert_time(data['Время пробуждения'])
 
-        data['Время засыпания'] = data['Время засыпания'].fillna(data['Время засыпания'].median())
-        data['Время пробуждения'] = data['Время пробуждения'].fillna(data['Время пробуждения'].median())
+        # При обработке порциями медианы считаются заранее по всем строкам, а не по порции
+        fill_values = fill_values or {column: data[column].median() for column in TIME_COLUMNS}
+        for column in TIME_COLUMNS:
+            data[column] = data[column].fillna(fill_values[column])
 
-        data['Качество сна'] = (
-            data['Качество сна']
-            .astype(str).str.lower()
-            .replace(self.sleep_mapping)
-            .fillna('unknown')
+        data['Качество сна'] = self._map_unique(
+            data['Качество сна'].astype(str),
+            lambda x: self.sleep_mapping.get(x.lower(), x.lower())
         )
         
-        data['Стресс'] = data['Стресс'].apply(lambda x: 'Да' if str(x).lower() != 'нет' else 'Нет')
-        data['Пол'] = (
-            data['Пол']
-            .str.strip().str.lower()
-            .replace({'мужской': 'мужской', 'женский': 'женский'})
-            .fillna('unknown')
+        data['Стресс'] = self._map_unique(
+            data['Стресс'].astype(str),
+            lambda x: 'Да' if x.lower() != 'нет' else 'Нет'
+        )
+        data['Пол'] = self._map_unique(
+            data['Пол'],
+            lambda x: x.strip().lower() if isinstance(x, str) else 'unknown'
         )
 
-        data['Количество уроков'] = data['Количество уроков'].apply(self._process_lessons)
+        data['Количество уроков'] = self._map_unique(
+            data['Количество уроков'].astype(str), self._process_lessons, float
+        )
         
         return data
 
-    def _convert_time(self, time_str: str) -> int:
+    def _map_unique(self, column: pd.Series, convert, dtype=object) -> np.ndarray:
+        # Ответы сильно повторяются (время, число уроков, кнопки): каждое уникальное значение
+        # разбирается один раз, а результат раскладывается по строкам через коды factorize.
+        # Пропуски получают код -1 и попадают на последний элемент — convert(NaN)
+        codes, uniques = pd.factorize(column)
+        values = [convert(value) for value in uniques]
+        if (codes < 0).any():
+            values.append(convert(np.nan))
+        return np.array(values, dtype=dtype)[codes]
+
+    def _convert_time(self, column: pd.Series) -> pd.Series:
+        minutes = pd.Series(self._map_unique(column.astype(str), self._parse_time, float), index=column.index)
+        # Как и при построчном apply: без пропусков столбец остаётся целочисленным
+        return minutes if minutes.isna().any() else minutes.astype('int64')
+
+    def _parse_time(self, time_str: str) -> int:
         try:
-            time_str = str(time_str).replace('.', ':').replace(',', ':')
+            time_str = time_str.replace('.', ':').replace(',', ':')
             h, m = map(int, time_str.split(':'))
             return h * 60 + m
         except:
@@ -108,27 +165,243 @@ class DataProcessor:
             except:
                 return 0.0
 
-    def process_all_data(self) -> bool:
-        try:
-            if not os.path.exists('survey_data.csv'):
-                pd.DataFrame(columns=self.required_columns).to_csv('survey_data.csv', index=False)
-                logger.info("Создан пустой файл данных")
-            
-            new_data = pd.read_csv('survey_data.csv', encoding='utf-8')
-            new_data = self._preprocess_data(new_data)
+    def process_all_data(self, full: bool = False) -> bool:
+        # По умолчанию оцениваются только анкеты, пришедшие после прошлого запуска (водяной знак
+        # в таблице meta), и дописываются в отчёт; full=True пересчитывает всю историю заново
+        with self._process_lock:
+            rss_before = current_rss_mb()
+            started = time.perf_counter()
+            try:
+                self.load_models()
+                # Без отчёта или без скетчей порогов дописывать не к чему — считаем с нуля
+                if not os.path.exists(self.results_path) or not self.thresholds.count:
+                    full = True
+
+                # Анкеты, ещё стоящие в очереди записи, тоже должны попасть в отчёт
+                self.store.flush()
+                state = self._load_scoring_state(full)
+                # Оба прохода идут до одного и того же id: анкета, пришедшая между ними, дождётся
+                # следующего запуска, а не попадёт в оценку мимо счётчиков времени
+                until_id = self.store.max_response_id()
+                # Скетчи пополняются в копии и подменяют рабочие только после успешной записи отчёта:
+                # score_response в это время читает прежние пороги
+                thresholds = AnomalyThresholds()
+                if not full:
+                    thresholds.load(self.thresholds_path)
+
+                # Проход 1: медианы времени сна для заполнения пропусков. Счётчики значений копятся
+                # в meta между запусками, поэтому медиана — по всей истории, а не по новой порции
+                with JOB_PHASE_SECONDS.time(phase="medians"):
+                    time_counts = self._time_counts(state["watermark"], until_id, state.get("time_counts"))
+                if time_counts is None:
+                    JOB_RUNS.inc(result="empty")
+                    if self.thresholds.count:
+                        logger.info("Новых анкет нет, отчёт актуален")
+                        return True
+                    logger.info("Нет данных для анализа")
+                    return False
+
+                fill_values = {
+                    column: self._median_from_counts(column_counts) for column, column_counts in time_counts.items()
+                }
+                # Проход 2: оценка порциями во временный файл; проход 3: флаги по итоговым порогам
+                scored = self._score_chunks(state["watermark"], until_id, fill_values, thresholds)
+                with JOB_PHASE_SECONDS.time(phase="report"):
+                    self._write_results(thresholds, append=not full)
+
+                thresholds.save(self.thresholds_path)
+                self.thresholds = thresholds
+                self.fill_values = fill_values
+                state["watermark"] = until_id
+                state["fill_values"] = fill_values
+                state["time_counts"] = {
+                    column: {str(value): int(count) for value, count in column_counts.items()}
+                    for column, column_counts in time_counts.items()
+                }
+                self.store.set_meta("anomaly_scoring", json.dumps(state))
+                JOB_PHASE_SECONDS.observe(time.perf_counter() - started, phase="total")
+                JOB_ROWS.inc(scored)
+                JOB_RUNS.inc(result="ok")
 
-            processed_data = self.preprocessor.transform(new_data)
+                logger.info(
+                    f"Отчет успешно сформирован: {'полный пересчёт' if full else 'дописано'} "
+                    f"{scored} анкет порциями по {self.chunk_rows}, порог {self.thresholds.threshold():.4f}; "
+                    f"RSS {rss_before:.0f} → {current_rss_mb():.0f} МБ, пик процесса {peak_rss_mb():.0f} МБ"
+                )
+                return True
+            except Exception as e:
+                logger.error(f"Ошибка обработки: {traceback.format_exc()}")
+                JOB_RUNS.inc(result="error")
+                for path in (self.scored_path, f"{self.results_path}.tmp"):
+                    if os.path.exists(path):
+                        os.remove(path)
+                return False
 
-            reconstructions = self.autoencoder.predict(processed_data)
+    def _load_scoring_state(self, full: bool) -> dict:
+        stored = None if full else self.store.get_meta("anomaly_scoring")
+        if stored is None:
+            return {"watermark": 0}
+        return json.loads(stored)
+
+    def _cohorts(self, data: pd.DataFrame) -> pd.Series:
+        # Когорта — возрастная группа и пол: профили ошибок у них заметно различаются
+        ages = pd.to_numeric(data['Возраст'], errors='coerce').to_numpy(dtype=float)
+        age_bands = np.select(
+            [(ages > 0) & (ages <= 10), (ages > 10) & (ages <= 14), (ages > 14) & (ages <= 17), (ages > 17) & (ages <= 200)],
+            ['7-10', '11-14', '15-17', '18+'],
+            default='nan'
+        )
+        return pd.Series(age_bands, index=data.index, dtype=object) + '|' + data['Пол'].astype(str)
+
+    def _iter_responses(self, after_id: int, until_id: int):
+        # Первая порция — пробная (probe_rows), дальше размер задаёт _fit_chunk_rows
+        self.chunk_rows = self.probe_rows
+        while True:
+            chunk = self.store.load_responses(after_id=after_id, limit=self.chunk_rows, until_id=until_id)
+            if chunk.empty:
+                return
+            yield chunk
+            after_id = int(chunk.index[-1])
+
+    def _fit_chunk_rows(self, chunk: pd.DataFrame, n_features: int = 0):
+        # Сырые строки живут в двух копиях (исходник и предобработка), матрица признаков —
+        # в четырёх float64 (признаки, реконструкция, разность, квадрат)
+        row_bytes = 2 * chunk.memory_usage(deep=True).sum() / len(chunk) + 4 * 8 * n_features
+        self.chunk_rows = max(100, int(self.memory_limit_mb * 1024 * 1024 / row_bytes))
+
+    def _time_counts(self, after_id: int, until_id: int, stored: dict = None):
+        # Счётчики значений времени (в минутах) по новым анкетам, сложенные с сохранёнными с прошлых запусков:
+        # точная медиана из них дешёвая, время принимает немного различных значений
+        stored = stored or {}
+        counts = {
+            column: pd.Series(
+                list(stored.get(column, {}).values()),
+                index=[float(value) for value in stored.get(column, {})],
+                dtype=float
+            )
+            for column in TIME_COLUMNS
+        }
+        rows = 0
+        for chunk in self._iter_responses(after_id, until_id):
+            if not rows:
+                self._fit_chunk_rows(chunk)
+            rows += len(chunk)
+            for column in counts:
+                if column in chunk:
+                    counts[column] = counts[column].add(
+                        self._convert_time(chunk[column]).value_counts(), fill_value=0
+                    )
+        if not rows:
+            return None
+        return counts
+
+    def _median_from_counts(self, counts: pd.Series) -> float:
+        counts = counts.sort_index()
+        total = int(counts.sum())
+        if not total:
+            return np.nan
+        positions = counts.cumsum().to_numpy()
+        values = counts.index.to_numpy(dtype=float)
+        lower = values[np.searchsorted(positions, (total - 1) // 2, side='right')]
+        upper = values[np.searchsorted(positions, total // 2, side='right')]
+        return (lower + upper) / 2
+
+    def _score_chunks(self, after_id: int, until_id: int, fill_values: dict, thresholds: AnomalyThresholds):
+        scored, columns = 0, None
+        phases = {"preprocess": 0.0, "predict": 0.0, "thresholds": 0.0, "write": 0.0}
+        for chunk in self._iter_responses(after_id, until_id):
+            first = columns is None
+            if first:
+                raw_chunk = chunk.copy()
+            started = time.perf_counter()
+            chunk = self._preprocess_data(chunk, fill_values)
+            processed_data = self.preprocessor.transform(chunk)
+            phases["preprocess"] += time.perf_counter() - started
+
+            started = time.perf_counter()
+            reconstructions = self.autoencoder.predict(processed_data, verbose=0)
             mse = np.mean(np.power(processed_data - reconstructions, 2), axis=1)
-            threshold = np.percentile(mse, 95)
-            
-            new_data['Reconstruction_Error'] = mse
-            new_data['Anomaly'] = (mse > threshold).astype(int)
-            new_data.to_csv('analysis_results.csv', index=False)
-            
-            logger.info("Отчет успешно сформирован")
-            return True
-        except Exception as e:
-            logger.error(f"Ошибка обработки: {traceback.format_exc()}")
-            return False
\ No newline at end of file
+            phases["predict"] += time.perf_counter() - started
+            if first:
+                self._fit_chunk_rows(raw_chunk, processed_data.shape[1])
+                del raw_chunk
+
+            started = time.perf_counter()
+            cohorts = self._cohorts(chunk)
+            days = pd.to_datetime(chunk['timestamp']).dt.strftime('%Y-%m-%d')
+            # NaN ломает упорядочивание в KLL-скетчах: такие анкеты в пороги не попадают
+            finite = np.isfinite(mse)
+            if not finite.all():
+                logger.warning("Анкет с нечисловой ошибкой реконструкции: %d, в пороги не учтены", int((~finite).sum()))
+            thresholds.update_many(mse[finite], cohorts[finite], days[finite])
+            phases["thresholds"] += time.perf_counter() - started
+
+            chunk['Reconstruction_Error'] = mse
+            chunk['Cohort'] = cohorts
+            # Набор вопросов мог смениться внутри истории — столбцы выравниваются по первой порции
+            columns = chunk.columns if first else columns
+            started = time.perf_counter()
+            chunk.reindex(columns=columns).to_csv(self.scored_path, mode='w' if first else 'a', header=first)
+            phases["write"] += time.perf_counter() - started
+            scored += len(chunk)
+        for phase, seconds in phases.items():
+            JOB_PHASE_SECONDS.observe(seconds, phase=phase)
+        return scored
+
+    def _write_results(self, thresholds: AnomalyThresholds, append: bool):
+        # Флаги ставятся по порогам после учёта всех новых анкет; в полном режиме отчёт
+        # собирается во временный файл и подменяет старый целиком
+        target = self.results_path if append else f"{self.results_path}.tmp"
+        columns = pd.read_csv(self.results_path, index_col=0, nrows=0).columns if append else None
+        cohort_thresholds = {}
+        for i, chunk in enumerate(pd.read_csv(self.scored_path, index_col=0, chunksize=self.chunk_rows)):
+            cohorts = chunk['Cohort'].astype(str)
+            for cohort in cohorts.unique():
+                if cohort not in cohort_thresholds:
+                    cohort_thresholds[cohort] = thresholds.threshold(cohort)
+            row_thresholds = cohorts.map(cohort_thresholds).to_numpy(dtype=float)
+            chunk['Threshold'] = row_thresholds
+            chunk['Anomaly'] = (chunk['Reconstruction_Error'].to_numpy() > row_thresholds).astype(int)
+
+            if append:
+                chunk.reindex(columns=columns).to_csv(target, mode='a', header=False)
+            else:
+                chunk.to_csv(target, mode='w' if i == 0 else 'a', header=i == 0)
+
+        if not append:
+            os.replace(target, self.results_path)
+        os.remove(self.scored_path)
+
+    def score_response(self, user_id: int, answers: dict) -> dict:
+        # Оценка одной анкеты сразу после опроса той же предобработкой и моделью, что и в отчёте.
+        # Пороги берутся из накопленных скетчей; пополняет их только process_all_data
+        started = time.perf_counter()
+        self.load_models()
+        data = self._preprocess_data(pd.DataFrame([answers]), self.fill_values)
+        processed_data = self.preprocessor.transform(data)
+        if self.keras_model:
+            # predict() на одной строке собирает tf.data-конвейер и стоит десятки миллисекунд,
+            # прямой вызов модели — доли миллисекунды
+            reconstruction = self.autoencoder(processed_data, training=False).numpy()
+        else:
+            reconstruction = self.autoencoder.predict(processed_data, verbose=0)
+        error = float(np.mean(np.power(processed_data - reconstruction, 2)))
+
+        cohort = self._cohorts(data).iloc[0]
+        thresholds = self.thresholds
+        threshold = thresholds.threshold(cohort) if thresholds.count else float('nan')
+        result = {
+            "user_id": user_id,
+            "error": error,
+            "threshold": threshold,
+            "cohort": cohort,
+            "anomaly": bool(error > threshold)
+        }
+        logger.debug(
+            "Анкета %s оценена за %.1f мс: ошибка %.4f, порог %.4f",
+            user_id, (time.perf_counter() - started) * 1000, error, threshold
+        )
+        return result
+
+    def close(self):
+        self.store.close()
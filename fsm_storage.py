@@ -0,0 +1,166 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm_states (
+    key TEXT PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    state TEXT,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states (updated_at);
+"""
+
+
+class SQLiteStorage(BaseStorage):
+    # FSM-хранилище, переживающее перезапуск. Чтение идёт из кэша в памяти, запись — сразу в кэш,
+    # а в SQLite раз в flush_interval: несколько изменений одного ключа за это время сливаются
+    # в одну строку. Ключи без изменений дольше ttl (брошенные анкеты) удаляются
+    def __init__(self, path: str = None, ttl_hours: float = None, flush_interval_ms: float = None):
+        self.path = path or os.getenv("FSM_DB_PATH", os.getenv("DB_PATH", "bot.sqlite3"))
+        self.ttl = (ttl_hours or float(os.getenv("FSM_TTL_HOURS", "24"))) * 3600
+        self.flush_interval = (flush_interval_ms or float(os.getenv("FSM_FLUSH_INTERVAL_MS", "500"))) / 1000
+
+        # Данные в кэше лежат уже сериализованными: то, что видит бот, совпадает с тем,
+        # что он прочитает после перезапуска, и вызывающий не может испортить кэш изменением словаря
+        self._cache = {}
+        self._dirty = {}
+        self._lock = threading.Lock()
+        with closing(self._connect()) as connection, connection:
+            connection.executescript(SCHEMA)
+            connection.execute("DELETE FROM fsm_states WHERE updated_at < ?", (time.time() - self.ttl,))
+            for key, chat_id, state, data, updated_at in connection.execute("SELECT * FROM fsm_states"):
+                self._cache[key] = (chat_id, state, data, updated_at)
+        logger.info(f"Восстановлено FSM-состояний: {len(self._cache)}")
+
+        self._stop = threading.Event()
+        self._writer = threading.Thread(target=self._write_loop, name="fsm-storage", daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _key(self, key: StorageKey) -> str:
+        return ":".join(str(part) for part in (
+            key.bot_id, key.chat_id, key.user_id, getattr(key, "thread_id", None), getattr(key, "destiny", "default")
+        ))
+
+    def _get(self, key: str) -> tuple:
+        record = self._cache.get(key)
+        if record is not None and record[3] < time.time() - self.ttl:
+            self._put(key, None)
+            return None
+        return record
+
+    def _put(self, key: str, record: tuple):
+        with self._lock:
+            if record is None:
+                self._cache.pop(key, None)
+            else:
+                self._cache[key] = record
+            self._dirty[key] = record
+
+    def _write(self, key: StorageKey, state=..., data=...):
+        name = self._key(key)
+        record = self._get(name)
+        state = (record[1] if record else None) if state is ... else state
+        data = (record[2] if record else "{}") if data is ... else data
+        if state is None and data == "{}":
+            self._put(name, None)
+        else:
+            self._put(name, (key.chat_id, state, data, time.time()))
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        self._write(key, state=state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> str:
+        record = self._get(self._key(key))
+        return record[1] if record else None
+
+    async def set_data(self, key: StorageKey, data: dict) -> None:
+        self._write(key, data=json.dumps(data, ensure_ascii=False))
+
+    async def get_data(self, key: StorageKey) -> dict:
+        record = self._get(self._key(key))
+        return json.loads(record[2]) if record else {}
+
+    async def update_data(self, key: StorageKey, data: dict) -> dict:
+        current = await self.get_data(key)
+        current.update(data)
+        await self.set_data(key, current)
+        return current
+
+    def chats_in_state(self, state) -> set:
+        state = state.state if isinstance(state, State) else state
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            return {
+                chat_id for chat_id, record_state, _, updated_at in self._cache.values()
+                if record_state == state and updated_at >= cutoff
+            }
+
+    async def close(self) -> None:
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._writer.join(timeout=5)
+
+    def _write_loop(self):
+        connection = self._connect()
+        purged = time.monotonic()
+        while not self._stop.wait(self.flush_interval):
+            self._flush(connection)
+            if time.monotonic() - purged > 60:
+                self._purge()
+                purged = time.monotonic()
+        self._flush(connection)
+        connection.close()
+
+    def _flush(self, connection):
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        if not dirty:
+            return
+        try:
+            with connection:
+                connection.executemany(
+                    "DELETE FROM fsm_states WHERE key = ?",
+                    [(key,) for key, record in dirty.items() if record is None]
+                )
+                connection.executemany(
+                    "INSERT OR REPLACE INTO fsm_states (key, chat_id, state, data, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    [(key, *record) for key, record in dirty.items() if record is not None]
+                )
+            logger.debug("Записано FSM-состояний: %d", len(dirty))
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка записи FSM-состояний в {self.path}: {str(e)}")
+            # Не записанное возвращается в очередь, если ключ с тех пор не менялся
+            with self._lock:
+                for key, record in dirty.items():
+                    self._dirty.setdefault(key, record)
+
+    def _purge(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            expired = [key for key, record in self._cache.items() if record[3] < cutoff]
+            for key in expired:
+                del self._cache[key]
+                self._dirty[key] = None
+        if expired:
+            logger.info(f"Удалено брошенных FSM-состояний: {len(expired)}")
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationCancelled(Exception):
+    pass
+
+
+class GenerationTimeout(Exception):
+    pass
+
+
+@dataclass
+class InferenceJob:
+    prompt: str
+    user_id: int
+    listener: object
+    future: asyncio.Future
+    deadline: float
+    cancelled: bool = False
+    submitted_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def abandoned(self) -> bool:
+        # Читается из потока генерации: строку пакета можно досрочно завершить
+        return self.cancelled or time.monotonic() > self.deadline
+
+
+class InferenceScheduler:
+    def __init__(self, generate_batch, max_batch_size: int = None, batch_window_ms: float = None):
+        # generate_batch(jobs: list[InferenceJob], overrides: dict) -> list[str | Exception]
+        # выполняется в отдельном потоке; исключение в списке завершает future своей строки
+        self.generate_batch = generate_batch
+        self.max_batch_size = max_batch_size or int(os.getenv("INFERENCE_MAX_BATCH", "8"))
+        self.batch_window = (batch_window_ms or float(os.getenv("INFERENCE_BATCH_WINDOW_MS", "50"))) / 1000
+        self.deadline = float(os.getenv("INFERENCE_DEADLINE_S", "30"))
+        self.latency_target = float(os.getenv("INFERENCE_LATENCY_TARGET_S", "8"))
+        self.busy_depth = int(os.getenv("INFERENCE_BUSY_DEPTH", str(self.max_batch_size)))
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+        self.queue = None
+        self.latency = 0.0
+        self._active = {}
+        self._deferred = []
+        self._worker = None
+
+    @property
+    def depth(self) -> int:
+        return (self.queue.qsize() if self.queue else 0) + len(self._deferred)
+
+    async def submit(self, prompt: str, user_id: int, listener=None) -> str:
+        self._ensure_worker()
+        # Новое сообщение пользователя делает его предыдущий запрос неактуальным
+        previous = self._active.get(user_id)
+        if previous is not None:
+            self._cancel(previous)
+
+        loop = asyncio.get_running_loop()
+        job = InferenceJob(prompt, user_id, listener, loop.create_future(), time.monotonic() + self.deadline)
+        self._active[user_id] = job
+        try:
+            await self.queue.put(job)
+            return await job.future
+        except asyncio.CancelledError:
+            # Ждавший ответа ушёл (бот отключился от сервера моделей, обработчик снят) — строка пакета
+            # завершается досрочно, как при замене запроса новым сообщением
+            job.cancelled = True
+            raise
+        finally:
+            if self._active.get(user_id) is job:
+                del self._active[user_id]
+
+    def _cancel(self, job: InferenceJob):
+        job.cancelled = True
+        if not job.future.done():
+            job.future.set_exception(GenerationCancelled())
+        logger.info("Запрос пользователя %s отменён новым сообщением", job.user_id)
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self.queue = self.queue or asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    def _overrides(self) -> dict:
+        # Под нагрузкой сокращаем бюджет токенов и отключаем no_repeat_ngram (он считается на Python на каждом шаге)
+        depth = self.depth
+        if depth >= 2 * self.busy_depth or self.latency > 2 * self.latency_target:
+            return {"max_new_tokens": 60, "no_repeat_ngram_size": 0}
+        if depth >= self.busy_depth or self.latency > self.latency_target:
+            return {"max_new_tokens": 120, "no_repeat_ngram_size": 0}
+        return {}
+
+    def _expire(self, job: InferenceJob) -> bool:
+        if job.future.done():
+            return True
+        if time.monotonic() > job.deadline:
+            job.future.set_exception(GenerationTimeout())
+            logger.warning("Запрос пользователя %s не дождался генерации", job.user_id)
+            return True
+        return False
+
+    async def _collect_batch(self) -> list:
+        # Два запроса одного пользователя не попадают в один пакет: второй зависит от истории первого
+        pending, self._deferred = self._deferred, []
+        if not pending:
+            pending.append(await self.queue.get())
+        deadline = asyncio.get_running_loop().time() + self.batch_window
+
+        batch, users = [], set()
+        for job in pending:
+            if self._expire(job):
+                continue
+            if job.user_id in users or len(batch) >= self.max_batch_size:
+                self._deferred.append(job)
+            else:
+                batch.append(job)
+                users.add(job.user_id)
+
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                job = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if self._expire(job):
+                continue
+            if job.user_id in users:
+                self._deferred.append(job)
+            else:
+                batch.append(job)
+                users.add(job.user_id)
+
+        return [job for job in batch if not job.future.done()]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect_batch()
+            if not batch:
+                continue
+
+            overrides = self._overrides()
+            logger.debug(
+                "Пакет генерации: %d запрос(ов), в очереди %d, задержка %.1f с, настройки %s",
+                len(batch), self.depth, self.latency, overrides or 'по умолчанию'
+            )
+            started = time.monotonic()
+            try:
+                results = await loop.run_in_executor(self.executor, self.generate_batch, batch, overrides)
+            except Exception as e:
+                logger.error("Ошибка пакетной генерации: %s", e)
+                for job in batch:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                continue
+            finally:
+                elapsed = time.monotonic() - started
+                self.latency = elapsed if not self.latency else 0.8 * self.latency + 0.2 * elapsed
+
+            for job, result in zip(batch, results):
+                if job.future.done():
+                    continue
+                if isinstance(result, Exception):
+                    job.future.set_exception(result)
+                else:
+                    job.future.set_result(result)
+
+    def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
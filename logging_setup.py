@@ -0,0 +1,121 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    # Не больше per_second записей в секунду на один шаблон сообщения уровня ниже WARNING.
+    # Шаблон — это record.msg до подстановки аргументов, поэтому логи на каждое сообщение
+    # пользователя пишутся с %-аргументами, а не f-строкой. Логируют event loop, потоки записи
+    # и asyncio.to_thread, поэтому корзины под блокировкой. Число пропущенных записей кладётся
+    # в атрибут skipped_similar, а в текст его дописывает NonBlockingQueueHandler в своей копии записи
+    def __init__(self, per_second: float, max_keys: int = 10000):
+        super().__init__()
+        self.per_second = per_second
+        self.max_keys = max_keys
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= self.max_keys:
+                    self.buckets.clear()
+                bucket = self.buckets[key] = [self.per_second, now, 0]
+            bucket[0] = min(self.per_second, bucket[0] + (now - bucket[1]) * self.per_second)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            skipped, bucket[2] = bucket[2], 0
+        if skipped:
+            record.skipped_similar = skipped
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    # Текст сообщения подставляется здесь, в копии записи: аргументы (словари, DataFrame, данные FSM)
+    # вызывающий может изменить раньше, чем до записи доберётся поток слушателя. Сюда доходят только
+    # записи, прошедшие проверку уровня и выборку; оформление и ввод-вывод остаются слушателю.
+    # Если диск не успевает и очередь полна, запись теряется, а не тормозит event loop
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        message = record.getMessage()
+        skipped = getattr(record, "skipped_similar", 0)
+        if skipped:
+            message = f"{message} (похожих пропущено: {skipped})"
+        record = copy.copy(record)
+        record.msg = message
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging() -> QueueListener:
+    level = os.getenv("LOG_LEVEL", "DEBUG").upper()
+    formatter = JsonFormatter() if os.getenv("LOG_FORMAT", "text") == "json" else logging.Formatter(TEXT_FORMAT)
+
+    file_handler = RotatingFileHandler(
+        os.getenv("LOG_FILE", "bot.log"),
+        maxBytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+        backupCount=int(os.getenv("LOG_BACKUP_COUNT", "5")),
+        encoding="utf-8"
+    )
+    stream_handler = logging.StreamHandler()
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    per_second = float(os.getenv("LOG_SAMPLE_PER_SECOND", "20"))
+    if per_second > 0:
+        queue_handler.addFilter(SamplingFilter(per_second))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
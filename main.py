@@ -3,53 +3,103 @@ import asyncio
 import sys
 import os
 from aiogram import Bot, Dispatcher, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.base import StorageKey
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from pytz import timezone
-from bot_functions import BotFunctions
+from bot_functions import BotFunctions, MessageStreamer
 from admin_panel import AdminPanel
 from survey_module import SurveyManager, SurveyStates
 from data_processing import DataProcessor
-from chat_model import ChatModel
+from model_client import ModelClient, RemoteChatModel, RemoteDataProcessor
+from inference_scheduler import GenerationCancelled
+from model_loader import ModelWarmup
+from safety_router import SafetyRouter
+from fsm_storage import SQLiteStorage
+from webhook_server import WebhookServer
+from update_recorder import UpdateRecorder
+from logging_setup import setup_logging
+from metrics import ALERTS_QUEUE, INFERENCE_QUEUE, LOG_RECORDS_DROPPED, SURVEYS_IN_PROGRESS, HandlerTimer, start_metrics_server
 from dotenv import load_dotenv
 from aiogram import F
 from admin_panel import AdminStates 
 
 load_dotenv()
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("bot.log", encoding="utf-8"), 
-        logging.StreamHandler()
-    ]
-)
+setup_logging()
 
 logger = logging.getLogger(__name__)
 
-logging.basicConfig(level=logging.DEBUG) 
-
 class MentalHealthBot:
     def __init__(self):
-        self.storage = MemoryStorage() 
-        self.bot = Bot(token=os.getenv("BOT_TOKEN"))
+        self.storage = SQLiteStorage()
+        # TELEGRAM_API_URL — собственный сервер Bot API или tools/fake_bot_api.py для нагрузочных тестов
+        api_url = os.getenv("TELEGRAM_API_URL")
+        session = AiohttpSession(api=TelegramAPIServer.from_base(api_url)) if api_url else None
+        self.bot = Bot(token=os.getenv("BOT_TOKEN"), session=session)
         self.dp = Dispatcher(storage=self.storage)
         self.scheduler = AsyncIOScheduler(timezone=timezone(os.getenv("TZ")))
-        self.data_processor = DataProcessor()
+        # MODEL_SERVER_SOCKET: ChatModel и оценка анкет в общем процессе model_server.py,
+        # без него модели грузятся в процессе бота
+        self.model_client = ModelClient() if os.getenv("MODEL_SERVER_SOCKET") else None
+        if self.model_client is not None:
+            self.data_processor = RemoteDataProcessor(self.model_client)
+        else:
+            self.data_processor = DataProcessor()
         self.survey_manager = SurveyManager(
             data_processor=self.data_processor,
             bot=self.bot,
             storage=self.storage  
         )
         self.admin_panel = AdminPanel(self.bot, self.data_processor, self.survey_manager)
-        self.chat_model = ChatModel()
+        self.safety_router = SafetyRouter()
+        self.streaming = os.getenv("CHAT_STREAMING", "1") == "1"
+        # STARTUP_MODE=lazy: опрос Telegram стартует сразу, тяжёлые модели грузятся параллельно в фоне;
+        # eager — как раньше, поллинг только после загрузки всех моделей
+        self.startup_mode = os.getenv("STARTUP_MODE", "lazy")
+        # BOT_MODE=webhook: обновления приходят на aiohttp-сервер за обратным прокси (см. webhook_server.py)
+        self.bot_mode = os.getenv("BOT_MODE", "polling")
+        self.models = ModelWarmup({
+            "chat_model": self._load_chat_model,
+            "autoencoder": self.data_processor.load_models,
+            "router_classifier": self.safety_router.load_classifier
+        })
         self._register_handlers()
         self._schedule_jobs()
+        self._register_metrics()
+        # RECORD_UPDATES_PATH: обработанные сообщения пишутся в JSONL для tools/replay.py
+        record_path = os.getenv("RECORD_UPDATES_PATH")
+        self.recorder = UpdateRecorder(
+            record_path, answer_placeholder=self.survey_manager.placeholder_answer
+        ) if record_path else None
+        if self.recorder is not None:
+            self.dp.message.middleware(self.recorder)
+
+    @property
+    def chat_model(self):
+        return self.models.get("chat_model")
+
+    def _load_chat_model(self):
+        if self.model_client is not None:
+            return RemoteChatModel(self.model_client)
+        # Импорт torch/transformers откладывается до фоновой загрузки
+        from chat_model import ChatModel
+        return ChatModel()
 
 
+    def _register_metrics(self):
+        # Время каждого обработчика; датчики очередей считаются в момент опроса /metrics или /stats
+        self.dp.message.middleware(HandlerTimer())
+        INFERENCE_QUEUE.set_function(lambda: self.chat_model.queue_depth if self.chat_model is not None else 0)
+        SURVEYS_IN_PROGRESS.set_function(lambda: len(self.storage.chats_in_state(SurveyStates.IN_PROGRESS)))
+        ALERTS_QUEUE.set_function(lambda: self.survey_manager.alerts.qsize())
+        LOG_RECORDS_DROPPED.set_function(
+            lambda: sum(getattr(handler, "dropped", 0) for handler in logging.getLogger().handlers)
+        )
+
     def _register_handlers(self):
         self.dp.message.register(
             self.admin_panel.handle_admin_command, 
@@ -63,7 +113,7 @@ class MentalHealthBot:
 
         self.dp.message.register(
             self.admin_panel.handle_admin_command,
-            F.text.startswith(("/get_report", "/run_survey", "/exit_admin")),
+            F.text.startswith(("/get_report", "/rebuild_report", "/run_survey", "/stats", "/exit_admin")),
             AdminStates.AUTHENTICATED   
         )
 
@@ -95,12 +145,27 @@ class MentalHealthBot:
 
     async def _start_handler(self, message: types.Message, state: FSMContext):  
         try:
-            logger.info(f"🔄 /start от {message.from_user.id} (chat_id: {message.chat.id})")
+            logger.info("🔄 /start от %s (chat_id: %s)", message.from_user.id, message.chat.id)
             await self.survey_manager.send_consent_request(message.chat.id, state)
         except Exception as e:
-            logger.error(f"Ошибка в /start: {e}")
+            logger.error("Ошибка в /start: %s", e)
             await message.answer("⚠️ Ошибка. Попробуйте позже.")
 
+    async def _is_priority_update(self, update: types.Update) -> bool:
+        # В очередь чата с моделью идёт только свободный текст вне опроса, согласия и админки
+        message = update.message
+        if message is None or message.text is None or message.text.startswith("/"):
+            return True
+        state = await self.storage.get_state(StorageKey(
+            bot_id=self.bot.id,
+            chat_id=message.chat.id,
+            user_id=message.from_user.id
+        ))
+        if state is not None:
+            return True
+        reply = message.reply_to_message
+        return reply is not None and "пароль администратора" in (reply.text or "")
+
     async def _admin_handler(self, message: types.Message):
         await self.admin_panel.handle_admin_command(message)
 
@@ -115,26 +180,83 @@ class MentalHealthBot:
             if await state.get_state() == AdminStates.AUTHENTICATED:
                 return
 
-            if await self.survey_manager.is_survey_in_progress(message.chat.id):
+            if await self.survey_manager.is_survey_in_progress(state):
                 logger.info("Опрос активен, сообщение игнорируется.")
                 return
 
-            logger.debug(f"Запрос: {message.text}")
-            response = await self.chat_model.generate_response(message.text, message.chat.id)
-            logger.info(f"Ответ для отправки: {response}")
-            await message.answer(response)
+            logger.debug("Запрос: %s", message.text)
+            route, canned_response = self.safety_router.route(message.text)
+            if canned_response is not None:
+                logger.info("Ответ без генерации (маршрут %s)", route)
+                await message.answer(canned_response)
+                return
+
+            if not self.models.is_ready("chat_model"):
+                await message.answer("⏳ Минутку, я только просыпаюсь. Отвечу, как только буду готов.")
+                await self.models.wait("chat_model")
+
+            if not self.streaming:
+                response = await self.chat_model.generate_response(message.text, message.chat.id)
+                if route == "llm_hotline":
+                    response = self.safety_router.with_hotline(response)
+                logger.info("Ответ для отправки: %s", response)
+                await message.answer(response)
+                return
+
+            streamer = MessageStreamer(await message.answer("…"))
+            try:
+                response = await self.chat_model.generate_response(
+                    message.text,
+                    message.chat.id,
+                    on_partial=streamer.update
+                )
+            except GenerationCancelled:
+                await streamer.discard()
+                raise
+            if route == "llm_hotline":
+                response = self.safety_router.with_hotline(response)
+            logger.info("Ответ для отправки: %s", response)
+            await streamer.finish(response)
 
+        except GenerationCancelled:
+            logger.info("Запрос %s заменён более новым сообщением", message.chat.id)
         except Exception as e:
-            logger.error(f"Ошибка: {e}", exc_info=True)
+            logger.error("Ошибка: %s", e, exc_info=True)
             await message.answer("⚠️ Ошибка обработки.")
 
     async def run(self):
+        if self.model_client is not None:
+            await self.model_client.start()
+        self.models.start()
+        if self.startup_mode == "eager":
+            await self.models.wait_all()
+            if self.models.errors:
+                raise next(iter(self.models.errors.values()))
         self.scheduler.start()
+        alerts = asyncio.create_task(self.admin_panel.run_alert_dispatcher())
+        resumed_survey = asyncio.create_task(self.survey_manager.resume_scheduled_survey())
+        metrics_server = await start_metrics_server()
         try:
-            await self.dp.start_polling(self.bot)
+            if self.bot_mode == "webhook":
+                await WebhookServer(self.bot, self.dp, self._is_priority_update).run()
+            else:
+                await self.dp.start_polling(self.bot)
         finally:
+            alerts.cancel()
+            resumed_survey.cancel()
+            if metrics_server is not None:
+                await metrics_server.cleanup()
             await self.bot.session.close()
             self.scheduler.shutdown()
+            if self.chat_model is not None:
+                self.chat_model.close()
+            self.models.close()
+            await self.storage.close()
+            self.data_processor.close()
+            if self.model_client is not None:
+                await self.model_client.close()
+            if self.recorder is not None:
+                self.recorder.close()
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,283 @@
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Метрики процесса в текстовом формате Prometheus без внешних зависимостей. Запись идёт
+# из event loop и из рабочих потоков (генерация, ночной отчёт), поэтому у каждой метрики свой замок
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{_labels(labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> list:
+        # Короткая сводка для /stats: счётчики и датчики как есть, гистограммы — число, среднее и квантили
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.describe())
+        return lines
+
+
+REGISTRY = Registry()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        registry.register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"Метрика {self.name} ожидает метки {self.labels}, получено {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _items(self) -> list:
+        with self._lock:
+            return [(dict(zip(self.labels, key)), value) for key, value in sorted(self._values.items())]
+
+    def samples(self):
+        for labels, value in self._items():
+            yield "", labels, value
+
+    def describe(self) -> list:
+        return [f"{self.name}{_labels(labels)}: {value:g}" for labels, value in self._items()]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def total(self) -> float:
+        with self._lock:
+            return sum(self._values.values())
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._function = None
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function):
+        # Значение считается в момент опроса: function() возвращает число, а для метрики
+        # с метками — словарь {кортеж значений меток: число}
+        self._function = function
+
+    def _items(self) -> list:
+        if self._function is None:
+            return super()._items()
+        try:
+            values = self._function()
+        except Exception:
+            return []
+        if not self.labels:
+            return [({}, values)]
+        return [(dict(zip(self.labels, key)), value) for key, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS,
+                 registry: Registry = REGISTRY):
+        super().__init__(name, help, labels, registry)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        # NaN не попадает ни в одну корзину и навсегда портит _sum — такие наблюдения отбрасываются
+        if not math.isfinite(value):
+            return
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def total(self, **labels) -> float:
+        # Сумма наблюдений; с метками — только по этому набору меток
+        with self._lock:
+            if labels:
+                state = self._values.get(self._key(labels))
+                return state[1] if state else 0.0
+            return sum(total for _, total, _ in self._values.values())
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _items(self) -> list:
+        with self._lock:
+            return [
+                (dict(zip(self.labels, key)), (list(counts), total, count))
+                for key, (counts, total, count) in sorted(self._values.items())
+            ]
+
+    def samples(self):
+        for labels, (counts, total, count) in self._items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield "_bucket", {**labels, "le": _number(bound if bound == math.inf else float(bound))}, cumulative
+            yield "_sum", labels, total
+            yield "_count", labels, count
+
+    def _quantile(self, counts: list, count: int, q: float) -> float:
+        # Линейная интерполяция внутри корзины, как histogram_quantile в Prometheus
+        target, cumulative, lower = q * count, 0, 0.0
+        for bound, bucket_count in zip(self.buckets, counts):
+            if cumulative + bucket_count >= target and bucket_count:
+                if bound == math.inf:
+                    return lower
+                return lower + (bound - lower) * (target - cumulative) / bucket_count
+            cumulative += bucket_count
+            lower = bound if bound != math.inf else lower
+        return lower
+
+    def describe(self) -> list:
+        return [
+            f"{self.name}{_labels(labels)}: {count} шт., среднее {total / count:.3g}, "
+            f"p50 ≈ {self._quantile(counts, count, 0.5):.3g}, p95 ≈ {self._quantile(counts, count, 0.95):.3g}"
+            for labels, (counts, total, count) in self._items() if count
+        ]
+
+
+class HandlerTimer:
+    # Внутренний middleware aiogram: вызывается только для сработавшего обработчика,
+    # имя которого берётся из data["handler"]
+    async def __call__(self, handler, event, data: dict):
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, handler=name)
+
+
+async def start_metrics_server(host: str = None, port: int = None):
+    # Возвращает AppRunner (его нужно остановить через cleanup) или None, если METRICS_PORT=0
+    # или порт занят — например, другим процессом бота с тем же METRICS_PORT: метрики не повод не стартовать
+    host = host or os.getenv("METRICS_HOST", "127.0.0.1")
+    port = port if port is not None else int(os.getenv("METRICS_PORT", "9102"))
+    if not port:
+        return None
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        logger.error("Сервер метрик не запущен на %s:%s: %s; задайте свой METRICS_PORT каждому процессу", host, port, e)
+        await runner.cleanup()
+        return None
+    return runner
+
+
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Время обработчиков aiogram", ("handler",))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Исключения в обработчиках aiogram", ("handler",))
+
+CHAT_RESPONSE_SECONDS = Histogram(
+    "bot_chat_response_seconds", "Время ответа модели с учётом очереди", ("source",)
+)
+GENERATION_SECONDS = Histogram("bot_generation_batch_seconds", "Время генерации одного пакета")
+GENERATION_BATCH_SIZE = Histogram(
+    "bot_generation_batch_size", "Запросов в пакете генерации", buckets=(1, 2, 4, 8, 16, 32)
+)
+GENERATED_TOKENS = Counter("bot_generated_tokens_total", "Сгенерировано токенов")
+INFERENCE_QUEUE = Gauge("bot_inference_queue_depth", "Запросов в очереди генерации")
+
+SURVEY_STEPS = Counter("bot_survey_steps_total", "Шаги опроса", ("step",))
+SURVEY_SECONDS = Histogram(
+    "bot_survey_duration_seconds", "Время от начала опроса до последнего ответа",
+    buckets=(30, 60, 120, 300, 600, 1800, 3600, 4 * 3600, 24 * 3600)
+)
+SURVEYS_IN_PROGRESS = Gauge("bot_surveys_in_progress", "Опросов в процессе прохождения")
+ALERTS_QUEUE = Gauge("bot_alerts_queue_depth", "Оповещений об аномалиях в очереди")
+
+BROADCAST_DELIVERIES = Counter("bot_broadcast_deliveries_total", "Итоги доставки рассылок", ("status",))
+BROADCAST_RETRIES = Counter("bot_broadcast_retries_total", "Повторы отправки в рассылках", ("reason",))
+
+JOB_PHASE_SECONDS = Histogram(
+    "bot_job_phase_seconds", "Этапы ночного отчёта за один запуск", ("phase",),
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 1800, 3600)
+)
+JOB_ROWS = Counter("bot_job_rows_total", "Анкет оценено ночным отчётом")
+JOB_RUNS = Counter("bot_job_runs_total", "Запуски ночного отчёта", ("result",))
+
+WEBHOOK_QUEUE = Gauge("bot_webhook_queue_depth", "Обновлений в очереди вебхука", ("queue",))
+LOG_RECORDS_DROPPED = Gauge("bot_log_records_dropped", "Записей лога, потерянных из-за переполненной очереди")
@@ -0,0 +1,152 @@
+import asyncio
+import itertools
+import logging
+import os
+from dotenv import load_dotenv
+from data_processing import DataProcessor
+from inference_scheduler import GenerationCancelled
+from model_server import encode_frame, read_frame
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+ERROR_RESPONSE = "Извините, произошла ошибка обработки. Попробуйте переформулировать вопрос."
+
+
+class ModelServerError(Exception):
+    pass
+
+
+class ModelClient:
+    # Одно соединение с model_server.py на процесс бота; запросы идут по нему параллельно
+    # и сопоставляются с ответами по id. После обрыва следующий запрос переподключается
+    def __init__(self, path: str = None, timeout: float = None):
+        self.path = path or os.getenv("MODEL_SERVER_SOCKET")
+        self.timeout = timeout or float(os.getenv("MODEL_SERVER_TIMEOUT", "120"))
+        self.loop = None
+        self.ids = itertools.count(1)
+        self.pending = {}
+        self._writer = None
+        self._reader_task = None
+        self._connect_lock = asyncio.Lock()
+
+    async def start(self):
+        # Вызывается из работающего event loop: синхронные вызовы из потоков идут через него
+        self.loop = asyncio.get_running_loop()
+        try:
+            health = await self.call("health")
+            logger.info(f"Сервер моделей {self.path}: {health['models']}, pid {health['pid']}")
+        except (OSError, ModelServerError) as e:
+            logger.warning(f"Сервер моделей {self.path} пока недоступен: {str(e)}")
+
+    async def _connect(self):
+        async with self._connect_lock:
+            if self._writer is None or self._writer.is_closing():
+                reader, self._writer = await asyncio.open_unix_connection(self.path)
+                self._reader_task = asyncio.create_task(self._read_loop(reader))
+            return self._writer
+
+    async def _read_loop(self, reader: asyncio.StreamReader):
+        error = ConnectionError("Соединение с сервером моделей закрыто")
+        try:
+            while True:
+                message = await read_frame(reader)
+                if message is None:
+                    break
+                future, on_partial = self.pending.get(message.get("id"), (None, None))
+                if future is None or future.done():
+                    continue
+                if "partial" in message:
+                    if on_partial is not None:
+                        on_partial(message["partial"])
+                elif "error" in message:
+                    future.set_exception(self._exception(message["error"]))
+                else:
+                    future.set_result(message["result"])
+        except (ConnectionError, ValueError) as e:
+            error = ConnectionError(f"Соединение с сервером моделей разорвано: {str(e)}")
+        finally:
+            self._writer = None
+            for future, _ in self.pending.values():
+                if not future.done():
+                    future.set_exception(error)
+
+    def _exception(self, error: dict) -> Exception:
+        if error["type"] == "cancelled":
+            return GenerationCancelled()
+        return ModelServerError(f"{error['type']}: {error['message']}")
+
+    async def call(self, method: str, params: dict = None, on_partial=None, timeout: float = -1):
+        # timeout=-1 — значение по умолчанию MODEL_SERVER_TIMEOUT, None — без ограничения
+        writer = await self._connect()
+        request_id = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = (future, on_partial)
+        try:
+            writer.write(encode_frame({"id": request_id, "method": method, "params": params or {}}))
+            await writer.drain()
+            return await asyncio.wait_for(future, self.timeout if timeout == -1 else timeout)
+        finally:
+            del self.pending[request_id]
+
+    def call_sync(self, method: str, params: dict = None, timeout: float = -1):
+        # Для синхронного кода в рабочих потоках (asyncio.to_thread, задания APScheduler)
+        if self.loop is None:
+            raise ModelServerError("ModelClient.start() ещё не вызван")
+        return asyncio.run_coroutine_threadsafe(self.call(method, params, timeout=timeout), self.loop).result()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self.pending)
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        if self._reader_task is not None:
+            await asyncio.gather(self._reader_task, return_exceptions=True)
+
+
+class RemoteChatModel:
+    # Заменяет ChatModel в процессе бота: тот же generate_response, генерация — на сервере моделей
+    def __init__(self, client: ModelClient):
+        self.client = client
+
+    @property
+    def queue_depth(self) -> int:
+        return self.client.in_flight
+
+    async def generate_response(self, prompt: str, user_id: int, on_partial=None) -> str:
+        try:
+            return await self.client.call(
+                "generate",
+                {"prompt": prompt, "user_id": user_id, "stream": on_partial is not None},
+                on_partial=on_partial
+            )
+        except GenerationCancelled:
+            raise
+        except Exception as e:
+            logger.error(f"Generation error: {str(e)}")
+            return ERROR_RESPONSE
+
+    def close(self):
+        pass
+
+
+class RemoteDataProcessor(DataProcessor):
+    # Анкеты и пользователи по-прежнему в общей SQLite-базе; модель оценки и ночной отчёт —
+    # на сервере моделей, поэтому пороги аномалий у всех ботов одни и те же
+    def __init__(self, client: ModelClient):
+        super().__init__()
+        self.client = client
+
+    def load_models(self):
+        return self
+
+    def score_response(self, user_id: int, answers: dict) -> dict:
+        return self.client.call_sync("score_response", {"user_id": user_id, "answers": answers})
+
+    def process_all_data(self, full: bool = False) -> bool:
+        result = self.client.call_sync("process_all_data", {"full": full}, timeout=None)
+        self.results_path = result["results_path"]
+        return result["success"]
@@ -0,0 +1,64 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class ModelWarmup:
+    def __init__(self, factories: dict):
+        # factories: имя -> функция без аргументов, возвращающая загруженную модель
+        self.factories = factories
+        self.executor = ThreadPoolExecutor(max_workers=max(len(factories), 1), thread_name_prefix="warmup")
+        self.futures = {}
+        self.models = {}
+        self.errors = {}
+
+    def start(self):
+        # Все модели грузятся параллельно в фоновых потоках; вызывать из работающего event loop
+        if self.futures:
+            return
+        for name, factory in self.factories.items():
+            future = asyncio.wrap_future(self.executor.submit(self._load, name, factory))
+            future.add_done_callback(lambda done, name=name: self._on_loaded(name, done))
+            self.futures[name] = future
+
+    def _load(self, name: str, factory):
+        started = time.monotonic()
+        logger.info(f"Загрузка {name} начата")
+        model = factory()
+        logger.info(f"{name} загружен за {time.monotonic() - started:.1f} с")
+        return model
+
+    def _on_loaded(self, name: str, future):
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            self.errors[name] = future.exception()
+            logger.error(f"Ошибка загрузки {name}: {future.exception()}")
+        else:
+            self.models[name] = future.result()
+
+    def is_ready(self, name: str) -> bool:
+        return name in self.models
+
+    def get(self, name: str):
+        return self.models.get(name)
+
+    async def wait(self, name: str):
+        if name in self.models:
+            return self.models[name]
+        return await asyncio.shield(self.futures[name])
+
+    async def wait_all(self):
+        await asyncio.gather(*self.futures.values(), return_exceptions=True)
+
+    def status(self) -> dict:
+        return {
+            name: "ready" if name in self.models else "failed" if name in self.errors else "loading"
+            for name in self.factories
+        }
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
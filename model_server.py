@@ -0,0 +1,220 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import struct
+import sys
+import time
+from dotenv import load_dotenv
+from data_processing import DataProcessor
+from inference_scheduler import GenerationCancelled
+from logging_setup import setup_logging
+from metrics import INFERENCE_QUEUE, start_metrics_server
+from model_loader import ModelWarmup
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Кадр протокола — 4 байта длины (big-endian) и JSON. Запрос {"id", "method", "params"},
+# ответ {"id", "result"} или {"id", "error": {"type", "message"}}; во время генерации с stream
+# сервер шлёт промежуточные {"id", "partial"}. Ответы приходят в порядке готовности, поэтому
+# по одному соединению идёт сколько угодно запросов сразу
+HEADER = struct.Struct(">I")
+MAX_FRAME = 16 * 1024 * 1024
+
+
+def encode_frame(message: dict) -> bytes:
+    payload = json.dumps(message, ensure_ascii=False, default=str).encode("utf-8")
+    return HEADER.pack(len(payload)) + payload
+
+
+async def read_frame(reader: asyncio.StreamReader) -> dict:
+    # None — соединение закрыто другой стороной
+    try:
+        header = await reader.readexactly(HEADER.size)
+        (length,) = HEADER.unpack(header)
+        if length > MAX_FRAME:
+            raise ValueError(f"Кадр {length} байт больше допустимого")
+        return json.loads(await reader.readexactly(length))
+    except asyncio.IncompleteReadError:
+        return None
+
+
+class ModelServer:
+    # Отдельный процесс с ChatModel и оценкой анкет DataProcessor: боты (MODEL_SERVER_SOCKET)
+    # подключаются к нему через Unix-сокет и могут перезапускаться без перезагрузки весов.
+    # Пакетирование запросов разных ботов делает общий InferenceScheduler модели
+    def __init__(self, path: str = None):
+        self.path = path or os.getenv("MODEL_SERVER_SOCKET", "model_server.sock")
+        self.data_processor = DataProcessor()
+        self.models = ModelWarmup({
+            "chat_model": self._load_chat_model,
+            "autoencoder": self.data_processor.load_models
+        })
+        self.started = time.monotonic()
+        self.connections = set()
+        self.methods = {
+            "health": self._health,
+            "generate": self._generate,
+            "score_response": self._score_response,
+            "process_all_data": self._process_all_data
+        }
+
+    def _load_chat_model(self):
+        from chat_model import ChatModel
+        return ChatModel()
+
+    async def _health(self, params: dict, send) -> dict:
+        chat_model = self.models.get("chat_model")
+        return {
+            "status": "degraded" if self.models.errors else "ok",
+            "models": self.models.status(),
+            "inference_queue": chat_model.queue_depth if chat_model is not None else 0,
+            "connections": len(self.connections),
+            "uptime_s": round(time.monotonic() - self.started, 1),
+            "pid": os.getpid()
+        }
+
+    async def _generate(self, params: dict, send) -> str:
+        chat_model = await self.models.wait("chat_model")
+        on_partial = None
+        if params.get("stream"):
+            on_partial = lambda text: send({"partial": text})
+        return await chat_model.generate_response(params["prompt"], params["user_id"], on_partial=on_partial)
+
+    async def _score_response(self, params: dict, send) -> dict:
+        await self.models.wait("autoencoder")
+        return await asyncio.to_thread(self.data_processor.score_response, params["user_id"], params["answers"])
+
+    async def _process_all_data(self, params: dict, send) -> dict:
+        success = await asyncio.to_thread(self.data_processor.process_all_data, params.get("full", False))
+        return {"success": success, "results_path": os.path.abspath(self.data_processor.results_path)}
+
+    async def _handle(self, request: dict, writer: asyncio.StreamWriter):
+        request_id = request.get("id")
+
+        def send(message: dict):
+            if not writer.is_closing():
+                writer.write(encode_frame({"id": request_id, **message}))
+
+        try:
+            method = self.methods.get(request.get("method"))
+            if method is None:
+                raise ValueError(f"Неизвестный метод {request.get('method')}")
+            send({"result": await method(request.get("params") or {}, send)})
+        except GenerationCancelled:
+            send({"error": {"type": "cancelled", "message": "Запрос заменён более новым сообщением"}})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка запроса {request.get('method')}: {str(e)}", exc_info=True)
+            send({"error": {"type": type(e).__name__, "message": str(e)}})
+        if not writer.is_closing():
+            await writer.drain()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        tasks = set()
+        self.connections.add(writer)
+        logger.info("Подключение к серверу моделей, всего %s", len(self.connections))
+        try:
+            while True:
+                request = await read_frame(reader)
+                if request is None:
+                    break
+                task = asyncio.create_task(self._handle(request, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (ConnectionError, ValueError) as e:
+            logger.warning(f"Соединение с сервером моделей разорвано: {str(e)}")
+        finally:
+            # Бот отключился — его незавершённые запросы больше некому получать
+            for task in tasks:
+                task.cancel()
+            self.connections.discard(writer)
+            writer.close()
+
+    async def _remove_stale_socket(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            _, writer = await asyncio.open_unix_connection(self.path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.unlink(self.path)
+            return
+        writer.close()
+        raise RuntimeError(f"Сервер моделей уже слушает {self.path}")
+
+    async def run(self):
+        self.models.start()
+        await self._remove_stale_socket()
+        server = await asyncio.start_unix_server(self._serve, self.path, limit=MAX_FRAME)
+        os.chmod(self.path, 0o660)
+        INFERENCE_QUEUE.set_function(
+            lambda: self.models.get("chat_model").queue_depth if self.models.is_ready("chat_model") else 0
+        )
+        metrics_server = await start_metrics_server(port=int(os.getenv("MODEL_SERVER_METRICS_PORT", "9104")))
+        logger.info(f"Сервер моделей слушает {self.path}")
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:
+                pass
+        try:
+            await stop.wait()
+        finally:
+            server.close()
+            for writer in list(self.connections):
+                writer.close()
+            await server.wait_closed()
+            if metrics_server is not None:
+                await metrics_server.cleanup()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            if self.models.get("chat_model") is not None:
+                self.models.get("chat_model").close()
+            self.models.close()
+            self.data_processor.close()
+
+
+async def check(path: str, timeout: float) -> int:
+    # Проверка живости для systemd/docker: код возврата 0 — все модели загружены
+    from model_client import ModelClient, ModelServerError
+
+    client = ModelClient(path)
+    try:
+        health = await asyncio.wait_for(client.call("health"), timeout)
+        ready = all(status == "ready" for status in health["models"].values())
+    except (OSError, asyncio.TimeoutError) as e:
+        print(f"Сервер моделей недоступен: {e}")
+        return 2
+    except (ModelServerError, KeyError, TypeError, AttributeError) as e:
+        print(f"Сервер моделей вернул некорректный ответ на health: {e!r}")
+        return 2
+    finally:
+        await client.close()
+    print(json.dumps(health, ensure_ascii=False))
+    return 0 if ready else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сервер моделей для нескольких процессов бота")
+    parser.add_argument("--socket", help="путь Unix-сокета, по умолчанию MODEL_SERVER_SOCKET")
+    parser.add_argument("--check", action="store_true", help="запросить health у запущенного сервера")
+    parser.add_argument("--timeout", type=float, default=5)
+    args = parser.parse_args()
+    path = args.socket or os.getenv("MODEL_SERVER_SOCKET", "model_server.sock")
+
+    if args.check:
+        sys.exit(asyncio.run(check(path, args.timeout)))
+    setup_logging()
+    try:
+        asyncio.run(ModelServer(path).run())
+    except Exception as e:
+        logger.error(f"Ошибка запуска сервера моделей: {str(e)}")
+        sys.exit(1)
@@ -0,0 +1,175 @@
+import json
+import math
+import os
+import random
+import pandas as pd
+
+
+class KLLSketch:
+    # Поток значений сжимается в уровни-компакторы: элемент уровня h весит 2^h. Когда уровень
+    # переполняется, он сортируется и в следующий уходит каждый второй элемент со случайным сдвигом.
+    # Память O(k log(n/k)), ошибка ранга ~1.7% при k=200; два скетча можно слить без потери гарантий
+    def __init__(self, k: int = 200, c: float = 2 / 3):
+        self.k = k
+        self.c = c
+        self.count = 0
+        self.compactors = [[]]
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.compactors) - level - 1
+        return int(math.ceil(self.k * self.c ** depth)) + 1
+
+    def _size(self) -> int:
+        return sum(len(compactor) for compactor in self.compactors)
+
+    def _max_size(self) -> int:
+        return sum(self._capacity(level) for level in range(len(self.compactors)))
+
+    def update(self, value: float):
+        self.compactors[0].append(float(value))
+        self.count += 1
+        if self._size() >= self._max_size():
+            self._compress()
+
+    def update_many(self, values):
+        for value in values:
+            self.update(value)
+
+    def merge(self, other: "KLLSketch") -> "KLLSketch":
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append([])
+        for level, compactor in enumerate(other.compactors):
+            self.compactors[level].extend(compactor)
+        self.count += other.count
+        while self._size() >= self._max_size():
+            self._compress()
+        return self
+
+    def _compress(self):
+        for level in range(len(self.compactors)):
+            compactor = self.compactors[level]
+            if len(compactor) < self._capacity(level):
+                continue
+            if level + 1 == len(self.compactors):
+                self.compactors.append([])
+            compactor.sort()
+            keep = [compactor.pop()] if len(compactor) % 2 else []
+            self.compactors[level + 1].extend(compactor[random.randint(0, 1)::2])
+            self.compactors[level] = keep
+            if self._size() < self._max_size():
+                break
+
+    def quantile(self, q: float) -> float:
+        items = sorted(
+            (value, 2 ** level)
+            for level, compactor in enumerate(self.compactors)
+            for value in compactor
+        )
+        if not items:
+            return float("nan")
+        target = q * sum(weight for _, weight in items)
+        cumulative = 0
+        for value, weight in items:
+            cumulative += weight
+            if cumulative >= target:
+                return value
+        return items[-1][0]
+
+    def to_dict(self) -> dict:
+        return {"k": self.k, "c": self.c, "count": self.count, "compactors": self.compactors}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "KLLSketch":
+        sketch = cls(data["k"], data["c"])
+        sketch.count = data["count"]
+        sketch.compactors = [list(compactor) for compactor in data["compactors"]]
+        return sketch
+
+
+class AnomalyThresholds:
+    # Скетчи ошибок реконструкции: общий, по когортам (возрастная группа + пол) за всё время
+    # и по дням за последние window_days для скользящего окна
+    def __init__(self, quantile: float = None, window_days: int = None, min_cohort_size: int = None,
+                 use_window: bool = None, k: int = 200):
+        self.quantile = quantile or float(os.getenv("ANOMALY_QUANTILE", "0.95"))
+        self.window_days = window_days or int(os.getenv("ANOMALY_WINDOW_DAYS", "30"))
+        self.min_cohort_size = min_cohort_size or int(os.getenv("ANOMALY_MIN_COHORT", "50"))
+        self.use_window = use_window if use_window is not None else os.getenv("ANOMALY_USE_WINDOW", "0") == "1"
+        self.k = k
+        self.total = KLLSketch(k)
+        self.cohorts = {}
+        self.days = {}
+
+    @property
+    def count(self) -> int:
+        return self.total.count
+
+    def update(self, error: float, cohort: str, day: str):
+        self.total.update(error)
+        self.cohorts.setdefault(cohort, KLLSketch(self.k)).update(error)
+        self.days.setdefault(day, {}).setdefault(cohort, KLLSketch(self.k)).update(error)
+
+    def update_many(self, errors, cohorts, days):
+        for error, cohort, day in zip(errors, cohorts, days):
+            self.update(error, cohort, day)
+        self._prune_days()
+
+    def _prune_days(self):
+        oldest = (pd.Timestamp.now().normalize() - pd.Timedelta(days=self.window_days)).strftime("%Y-%m-%d")
+        for day in [day for day in self.days if day < oldest]:
+            del self.days[day]
+
+    def threshold(self, cohort: str = None) -> float:
+        # Когорта с малым числом наблюдений получает общий порог
+        if self.use_window:
+            window = [sketches for day, sketches in sorted(self.days.items())]
+            cohort_sketch = self._merged(sketches.get(cohort) for sketches in window)
+            total_sketch = self._merged(sketch for sketches in window for sketch in sketches.values())
+        else:
+            cohort_sketch = self.cohorts.get(cohort)
+            total_sketch = self.total
+
+        if cohort_sketch is not None and cohort_sketch.count >= self.min_cohort_size:
+            return cohort_sketch.quantile(self.quantile)
+        return total_sketch.quantile(self.quantile)
+
+    def _merged(self, sketches) -> KLLSketch:
+        merged = KLLSketch(self.k)
+        for sketch in sketches:
+            if sketch is not None:
+                merged.merge(sketch)
+        return merged
+
+    def save(self, path: str):
+        data = {
+            "quantile": self.quantile,
+            "total": self.total.to_dict(),
+            "cohorts": {cohort: sketch.to_dict() for cohort, sketch in self.cohorts.items()},
+            "days": {
+                day: {cohort: sketch.to_dict() for cohort, sketch in sketches.items()}
+                for day, sketches in self.days.items()
+            }
+        }
+        # Запись через временный файл, чтобы сбой не оставил обрезанный JSON
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str) -> bool:
+        if not os.path.exists(path):
+            return False
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        self.total = KLLSketch.from_dict(data["total"])
+        self.cohorts = {cohort: KLLSketch.from_dict(sketch) for cohort, sketch in data["cohorts"].items()}
+        self.days = {
+            day: {cohort: KLLSketch.from_dict(sketch) for cohort, sketch in sketches.items()}
+            for day, sketches in data["days"].items()
+        }
+        return True
+
+    def reset(self):
+        self.total = KLLSketch(self.k)
+        self.cohorts = {}
+        self.days = {}
@@ -0,0 +1,157 @@
+import logging
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Близкий по n-граммам вопрос засчитывается, только если совпадают отрицания: «мне нравится учитель»
+# и «мне не нравится учитель» почти одинаковы посимвольно, но не по смыслу. Остальное решает косинус
+NEGATIONS = frozenset(("не", "нет", "ни", "нельзя", "никогда", "ничего", "никто", "not", "no"))
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = None, ttl_seconds: float = None,
+                 threshold: float = None, variants: int = None, dimensions: int = 2048):
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+        self.ttl = ttl_seconds or float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "86400"))
+        self.threshold = threshold or float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.9"))
+        self.variants = variants or int(os.getenv("RESPONSE_CACHE_VARIANTS", "3"))
+        self.dimensions = dimensions
+
+        # Ключ — нормализованный вопрос; в строке slot матрицы лежит его хэшированный n-граммный вектор,
+        # а в записи — набор его отрицаний
+        self.entries = OrderedDict()
+        self.slots = {}
+        self.vectors = np.zeros((max(self.max_entries, 1), dimensions), dtype=np.float32)
+        self.live = np.zeros(max(self.max_entries, 1), dtype=bool)
+        self.free_slots = list(range(self.max_entries))
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def lookup(self, prompt: str):
+        if not self.enabled:
+            return None
+
+        key = self._normalize(prompt)
+        with self.lock:
+            self._evict_expired()
+            entry = self.entries.get(key)
+            near = False
+            if entry is None:
+                entry = self._nearest(key, self._vectorize(key))
+                near = entry is not None
+
+            # Пока вариантов меньше нужного, запрос уходит в модель и пополняет запись
+            if entry is None or len(entry["responses"]) < self.variants:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(entry["key"])
+            self.hits += 1
+            self.near_hits += near
+            return random.choice(entry["responses"])
+
+    def add(self, prompt: str, response: str):
+        if not self.enabled:
+            return
+
+        key = self._normalize(prompt)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                vector = self._vectorize(key)
+                entry = self._nearest(key, vector)
+                if entry is None:
+                    entry = self._insert(key, vector)
+
+            if response not in entry["responses"] and len(entry["responses"]) < self.variants:
+                entry["responses"].append(response)
+            self.entries.move_to_end(entry["key"])
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+    def _insert(self, key: str, vector):
+        if not self.free_slots:
+            self._remove(next(iter(self.entries)))
+
+        slot = self.free_slots.pop()
+        self.vectors[slot] = vector
+        self.live[slot] = True
+        entry = {
+            "key": key,
+            "slot": slot,
+            "negations": self._negations(key),
+            "responses": [],
+            "created_at": time.monotonic()
+        }
+        self.entries[key] = entry
+        self.slots[slot] = key
+        return entry
+
+    def _remove(self, key: str):
+        entry = self.entries.pop(key)
+        del self.slots[entry["slot"]]
+        self.live[entry["slot"]] = False
+        self.free_slots.append(entry["slot"])
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        expired = [key for key, entry in self.entries.items() if now - entry["created_at"] >= self.ttl]
+        for key in expired:
+            self._remove(key)
+
+    def _nearest(self, key: str, vector):
+        if not self.entries or not vector.any():
+            return None
+
+        similarity = self.vectors @ vector
+        similarity[~self.live] = -1.0
+        candidates = np.flatnonzero(similarity >= self.threshold)
+        if not len(candidates):
+            return None
+        negations = self._negations(key)
+        for slot in candidates[np.argsort(-similarity[candidates])]:
+            entry = self.entries[self.slots[int(slot)]]
+            if entry["negations"] == negations:
+                return entry
+        return None
+
+    def _negations(self, text: str) -> frozenset:
+        return frozenset(word for word in text.split() if word in NEGATIONS)
+
+    def _normalize(self, prompt: str) -> str:
+        prompt = prompt.lower().replace("ё", "е")
+        return " ".join(re.findall(r"[а-яa-z0-9]+", prompt))
+
+    def _vectorize(self, text: str):
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for word in text.split():
+            padded = f" {word} "
+            for i in range(len(padded) - 2):
+                vector[zlib.crc32(padded[i:i + 3].encode()) % self.dimensions] += 1.0
+
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
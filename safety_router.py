@@ -0,0 +1,175 @@
+import logging
+import os
+import re
+from collections import Counter
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+HOTLINE_RESPONSE = "Обратись к школьному психологу или позвони на горячую линию: 8-800-2000-122."
+OFF_TOPIC_RESPONSE = (
+    "Я помогаю только с учёбой, стрессом, сном и настроением. "
+    "Расскажи, что тебя беспокоит?"
+)
+GREETING_RESPONSE = "Я здесь. Расскажи, что тебя беспокоит, и я постараюсь помочь."
+CLARIFY_RESPONSE = "Уточни, пожалуйста, свой вопрос."
+
+CRISIS_PHRASES = [
+    "суицид", "самоубийств", "покончить с собой", "покончу с собой", "убить себя", "убью себя",
+    "не хочу жить", "не хочется жить", "незачем жить", "хочу умереть", "лучше бы умер",
+    "порезать себя", "режу себя", "вскрыть вен", "повеситься", "повешусь",
+    "выпить все таблетк", "спрыгнуть с крыш", "прыгнуть с крыш", "смысл жизни"
+]
+# Только явная просьба о мнении или выборе: вопросы по истории религий или обществознанию — учебные,
+# их отдаём модели, а сомнительное решает классификатор
+OFF_TOPIC_PHRASES = [
+    "какая религия", "какой религия", "какую религию", "правильная религия", "истинная религия",
+    "есть ли бог", "бог существует", "бог существовать",
+    "за кого голосовать", "кого выбрать президентом", "думаешь о президенте", "думать о президент",
+    "пойти на митинг", "идти на митинг"
+]
+TRIVIAL_PHRASES = {
+    "привет", "здравствуй", "здравствуйте", "добрый день", "добрый вечер", "hi", "hello",
+    "спасибо", "ок", "ok", "ясно", "понятно", "хорошо", "пока"
+}
+
+# Небольшая обучающая выборка на случай, если обученный классификатор (ROUTER_MODEL_PATH) не выложен
+SEED_EXAMPLES = {
+    "crisis": [
+        "я больше не хочу жить", "мне незачем жить дальше", "думаю о том чтобы покончить со всем",
+        "я хочу исчезнуть навсегда", "никому не буду нужен если умру", "я причиняю себе боль",
+        "всё бессмысленно и я устал жить", "хочу чтобы всё закончилось навсегда",
+        "я думаю о смерти каждый день", "мне кажется всем будет лучше без меня"
+    ],
+    "off_topic": [
+        "за кого голосовать на выборах", "что ты думаешь о президенте", "есть ли бог",
+        "какая религия правильная", "расскажи анекдот", "реши мне задачу по алгебре",
+        "какая погода завтра", "кто выиграет чемпионат по футболу", "напиши сочинение за меня",
+        "сколько стоит биткоин"
+    ],
+    "llm": [
+        "не могу уснуть перед контрольной", "у меня стресс перед экзаменом", "поссорился с другом",
+        "как перестать волноваться", "мне грустно после школы", "не успеваю делать домашку",
+        "родители на меня кричат", "как лучше готовиться к огэ", "я устаю на уроках",
+        "мне трудно сосредоточиться", "боюсь отвечать у доски", "как справиться с тревогой"
+    ]
+}
+
+
+class SafetyRouter:
+    def __init__(self):
+        self.crisis_pattern = self._compile(CRISIS_PHRASES)
+        self.off_topic_pattern = self._compile(OFF_TOPIC_PHRASES)
+        self.min_letters = int(os.getenv("ROUTER_MIN_LETTERS", "4"))
+        self.thresholds = {
+            "crisis": float(os.getenv("ROUTER_CRISIS_THRESHOLD", "0.6")),
+            "off_topic": float(os.getenv("ROUTER_OFF_TOPIC_THRESHOLD", "0.8"))
+        }
+        self.responses = {
+            "crisis": HOTLINE_RESPONSE,
+            "off_topic": OFF_TOPIC_RESPONSE,
+            "greeting": GREETING_RESPONSE,
+            "short": CLARIFY_RESPONSE
+        }
+        self.route_counts = Counter()
+        self.morph = self._load_morph()
+        # Классификатор (sklearn) подгружается load_classifier в фоне; до этого работает только сопоставление фраз
+        self.classifier = None
+
+    def route(self, text: str) -> tuple:
+        # Возвращает (маршрут, готовый ответ); для маршрутов "llm" и "llm_hotline" ответ None,
+        # к ответу модели на "llm_hotline" добавляется with_hotline
+        route = self._classify(text or "")
+        self.route_counts[route] += 1
+        logger.debug("Маршрут сообщения: %s", route)
+        return route, self.responses.get(route)
+
+    def with_hotline(self, response: str) -> str:
+        if HOTLINE_RESPONSE in response:
+            return response
+        return f"{response}\n\n{HOTLINE_RESPONSE}"
+
+    def stats(self) -> dict:
+        return dict(self.route_counts)
+
+    def _classify(self, text: str) -> str:
+        normalized = self._normalize(text)
+        letters = sum(char.isalpha() for char in normalized)
+        if normalized in TRIVIAL_PHRASES:
+            return "greeting"
+        if letters < self.min_letters:
+            return "short"
+
+        lemmas = self._lemmatize(normalized)
+        if self.crisis_pattern.search(normalized) or self.crisis_pattern.search(lemmas):
+            return "crisis"
+        if self.off_topic_pattern.search(normalized) or self.off_topic_pattern.search(lemmas):
+            return "off_topic"
+
+        if self.classifier is not None:
+            probabilities = self.classifier.predict_proba([lemmas])[0]
+            label, probability = max(zip(self.classifier.classes_, probabilities), key=lambda item: item[1])
+            # Кризис решает только словарь: классификатор на небольшой выборке ошибается
+            # («хочу чтобы каникулы не заканчивались»), поэтому он лишь добавляет телефон
+            # горячей линии к обычному ответу модели
+            if label == "crisis" and probability >= self.thresholds["crisis"]:
+                return "llm_hotline"
+            if label == "off_topic" and probability >= self.thresholds["off_topic"]:
+                return label
+        return "llm"
+
+    def _normalize(self, text: str) -> str:
+        text = text.lower().replace("ё", "е")
+        return " ".join(re.findall(r"[а-яa-z0-9]+", text))
+
+    def _lemmatize(self, text: str) -> str:
+        if self.morph is None:
+            return text
+        return " ".join(self.morph.parse(word)[0].normal_form for word in text.split())
+
+    def _compile(self, phrases: list):
+        # Одно регулярное выражение на все фразы; каждое слово фразы — префикс словоформы
+        alternatives = [
+            r"\s+".join(rf"{re.escape(word)}\w*" for word in phrase.split())
+            for phrase in phrases
+        ]
+        return re.compile(rf"\b(?:{'|'.join(alternatives)})")
+
+    def _load_morph(self):
+        try:
+            import pymorphy3
+            return pymorphy3.MorphAnalyzer()
+        except ImportError:
+            logger.warning("pymorphy3 не установлен, маршрутизатор работает только по префиксам словоформ")
+            return None
+
+    def load_classifier(self):
+        self.classifier = self._load_classifier()
+        return self
+
+    def _load_classifier(self):
+        try:
+            from joblib import load
+            from sklearn.feature_extraction.text import TfidfVectorizer
+            from sklearn.linear_model import LogisticRegression
+            from sklearn.pipeline import make_pipeline
+
+            model_path = os.getenv("ROUTER_MODEL_PATH", "router.joblib")
+            if os.path.exists(model_path):
+                return load(model_path)
+
+            texts, labels = [], []
+            for label, examples in SEED_EXAMPLES.items():
+                texts.extend(self._lemmatize(self._normalize(example)) for example in examples)
+                labels.extend([label] * len(examples))
+
+            classifier = make_pipeline(
+                TfidfVectorizer(analyzer="char_wb", ngram_range=(2, 4)),
+                LogisticRegression(C=10.0, max_iter=1000)
+            )
+            return classifier.fit(texts, labels)
+        except Exception as e:
+            logger.error(f"Классификатор маршрутизатора недоступен: {str(e)}")
+            return None
@@ -0,0 +1,136 @@
+import json
+import numpy as np
+import pandas as pd
+
+# Инференс препроцессора (ColumnTransformer) и автоэнкодера на чистом NumPy по артефакту
+# из tools/export_scoring_model.py: ни sklearn, ни TensorFlow в процесс бота не грузятся
+
+
+class NumpyPreprocessor:
+    def __init__(self, spec: dict, arrays):
+        self.columns = spec["columns"]
+        self.transformers = spec["transformers"]
+        self.arrays = arrays
+        # Индексы категорий строятся один раз: на одиночной анкете их создание заметнее самого расчёта
+        self.indexes = {
+            id(step): [pd.Index(categories) for categories in step["categories"]]
+            for transformer in self.transformers
+            for step in transformer["steps"]
+            if "categories" in step
+        }
+
+    def transform(self, data: pd.DataFrame) -> np.ndarray:
+        missing = [column for column in self.columns if column not in data.columns]
+        if missing:
+            raise ValueError(f"Отсутствуют столбцы: {missing}")
+
+        blocks = []
+        for transformer in self.transformers:
+            values = data[transformer["columns"]].to_numpy()
+            for step in transformer["steps"]:
+                values = self._apply(step, values)
+            blocks.append(np.asarray(values, dtype=float))
+        return np.hstack(blocks) if blocks else np.empty((len(data), 0))
+
+    def _array(self, key):
+        return None if key is None else self.arrays[key]
+
+    def _apply(self, step: dict, values: np.ndarray) -> np.ndarray:
+        kind = step["type"]
+        if kind == "passthrough":
+            return values
+        if kind == "standard":
+            values = values.astype(float)
+            if step["mean"] is not None:
+                values = values - self._array(step["mean"])
+            if step["scale"] is not None:
+                values = values / self._array(step["scale"])
+            return values
+        if kind == "robust":
+            values = values.astype(float)
+            if step["center"] is not None:
+                values = values - self._array(step["center"])
+            if step["scale"] is not None:
+                values = values / self._array(step["scale"])
+            return values
+        if kind == "minmax":
+            values = values.astype(float) * self._array(step["scale"]) + self._array(step["min"])
+            return np.clip(values, *step["feature_range"]) if step["clip"] else values
+        if kind == "impute":
+            # Как SimpleImputer с missing_values=np.nan: пропуск — это значение, не равное самому себе
+            values = values.astype(float) if step["numeric"] else values.copy()
+            for i, fill in enumerate(step["fill"]):
+                column = values[:, i]
+                column[column != column] = fill
+            return values
+        if kind == "onehot":
+            return self._one_hot(step, values)
+        if kind == "ordinal":
+            return self._ordinal(step, values)
+        raise ValueError(f"Неизвестный шаг препроцессора: {kind}")
+
+    def _codes(self, index: pd.Index, column: np.ndarray, handle_unknown: str) -> np.ndarray:
+        codes = index.get_indexer(column)
+        if handle_unknown == "error" and (codes < 0).any():
+            unknown = sorted({str(value) for value in column[codes < 0]})
+            raise ValueError(f"Неизвестные категории: {unknown}")
+        return codes
+
+    def _one_hot(self, step: dict, values: np.ndarray) -> np.ndarray:
+        blocks = []
+        for i, index in enumerate(self.indexes[id(step)]):
+            codes = self._codes(index, values[:, i], step["handle_unknown"])
+            block = np.zeros((len(values), len(index)))
+            known = codes >= 0
+            block[np.flatnonzero(known), codes[known]] = 1.0
+            if step["drop"][i] is not None:
+                block = np.delete(block, step["drop"][i], axis=1)
+            blocks.append(block)
+        return np.hstack(blocks) if blocks else np.empty((len(values), 0))
+
+    def _ordinal(self, step: dict, values: np.ndarray) -> np.ndarray:
+        encoded = np.empty(values.shape)
+        for i, index in enumerate(self.indexes[id(step)]):
+            codes = self._codes(index, values[:, i], step["handle_unknown"])
+            encoded[:, i] = np.where(codes >= 0, codes, step["unknown_value"])
+        return encoded
+
+
+class NumpyAutoencoder:
+    ACTIVATIONS = {
+        "linear": lambda x: x,
+        "relu": lambda x: np.maximum(x, 0),
+        "sigmoid": lambda x: 1 / (1 + np.exp(-x)),
+        "tanh": np.tanh,
+        "elu": lambda x: np.where(x > 0, x, np.expm1(x)),
+        "selu": lambda x: 1.0507009873554805 * np.where(x > 0, x, 1.6732632423543772 * np.expm1(x)),
+        "softplus": lambda x: np.logaddexp(x, 0),
+        "softsign": lambda x: x / (1 + np.abs(x)),
+        "swish": lambda x: x / (1 + np.exp(-x))
+    }
+
+    def __init__(self, spec: dict, arrays):
+        self.layers = spec["layers"]
+        self.arrays = arrays
+
+    def predict(self, data: np.ndarray, verbose: int = 0) -> np.ndarray:
+        # Keras считает в float32 — так же и здесь, чтобы ошибки реконструкции совпадали
+        values = np.asarray(data, dtype=np.float32)
+        for layer in self.layers:
+            if layer["type"] == "dense":
+                values = values @ self.arrays[layer["kernel"]]
+                if layer["bias"] is not None:
+                    values = values + self.arrays[layer["bias"]]
+            elif layer["type"] == "affine":
+                values = values * self.arrays[layer["scale"]] + self.arrays[layer["shift"]]
+            elif layer["type"] != "activation":
+                raise ValueError(f"Неизвестный слой: {layer['type']}")
+            values = self.ACTIVATIONS[layer["activation"]](values).astype(np.float32, copy=False)
+        return values
+
+
+def load_scoring_model(path: str):
+    with np.load(path, allow_pickle=False) as archive:
+        arrays = {key: archive[key] for key in archive.files if key != "spec"}
+        spec = json.loads(str(archive["spec"]))
+    return NumpyPreprocessor(spec, arrays), NumpyAutoencoder(spec, arrays)
@@ -0,0 +1,141 @@
+import logging
+import threading
+import torch
+from transformers import (
+    LogitsProcessorList, NoRepeatNGramLogitsProcessor, RepetitionPenaltyLogitsProcessor,
+    TemperatureLogitsWarper, TopKLogitsWarper, TopPLogitsWarper
+)
+
+logger = logging.getLogger(__name__)
+
+
+class SpeculativeDecoder:
+    # Спекулятивное сэмплирование: черновая модель предлагает num_draft_tokens токенов, основная
+    # проверяет их одним прямым проходом. Токен принимается с вероятностью min(1, p/q), при отказе
+    # берётся из нормированного max(0, p - q), поэтому итоговое распределение совпадает с сэмплированием
+    # основной моделью при тех же repetition_penalty / no_repeat_ngram / temperature / top_k / top_p
+    def __init__(self, target, draft, eos_token_id: int, num_draft_tokens: int = 4):
+        self.target = target
+        self.draft = draft
+        self.eos_token_id = eos_token_id
+        self.num_draft_tokens = num_draft_tokens
+        self.proposed = 0
+        self.accepted = 0
+        self.lock = threading.Lock()
+
+    @property
+    def acceptance_rate(self) -> float:
+        return self.accepted / self.proposed if self.proposed else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "proposed": self.proposed,
+            "accepted": self.accepted,
+            "acceptance_rate": round(self.acceptance_rate, 3)
+        }
+
+    def generate(self, input_ids, target_past, config: dict, should_stop):
+        # input_ids: [1, L]; target_past покрывает input_ids[:, :-1]
+        processors, warpers = self._build_warpers(config)
+        max_new_tokens = config["max_new_tokens"]
+        prompt_length = input_ids.shape[-1]
+        ids = input_ids
+        draft_past = self.draft(ids[:, :-1], use_cache=True).past_key_values if prompt_length > 1 else None
+        proposed = accepted = 0
+
+        while ids.shape[-1] - prompt_length < max_new_tokens:
+            k = min(self.num_draft_tokens, max_new_tokens - (ids.shape[-1] - prompt_length))
+            draft_tokens, draft_probs, draft_past = self._propose(ids, draft_past, k, processors, warpers)
+
+            candidate = torch.cat([ids, draft_tokens], dim=-1)
+            logits = self.target(
+                candidate[:, ids.shape[-1] - 1:],
+                past_key_values=target_past,
+                use_cache=True
+            )
+            target_past = logits.past_key_values
+
+            new_tokens = []
+            for j in range(k):
+                p = self._probs(candidate[:, :ids.shape[-1] + j], logits.logits[:, j], processors, warpers)
+                q = draft_probs[j]
+                token = draft_tokens[0, j]
+                if torch.rand(1, device=p.device) < torch.clamp(p[0, token] / q[0, token], max=1.0):
+                    new_tokens.append(token)
+                    continue
+                residual = torch.clamp(p - q, min=0)
+                residual = residual if residual.sum() > 0 else p
+                accepted += len(new_tokens)
+                new_tokens.append(torch.multinomial(residual / residual.sum(), 1)[0, 0])
+                break
+            else:
+                accepted += k
+                p = self._probs(candidate, logits.logits[:, k], processors, warpers)
+                new_tokens.append(torch.multinomial(p, 1)[0, 0])
+
+            proposed += k
+            ids = torch.cat([ids, torch.stack(new_tokens).view(1, -1)], dim=-1)
+
+            # Кэши обрезаются до подтверждённой последовательности без последнего токена
+            target_past = self._crop(target_past, ids.shape[-1] - 1)
+            draft_past = self._crop(draft_past, min(draft_past[0][0].shape[-2], ids.shape[-1] - 1))
+
+            generated = ids[0, prompt_length:]
+            eos = (generated == self.eos_token_id).nonzero()
+            if len(eos):
+                ids = ids[:, :prompt_length + int(eos[0, 0]) + 1]
+                break
+            if should_stop(generated):
+                break
+
+        ids = ids[:, :prompt_length + max_new_tokens]
+        with self.lock:
+            self.proposed += proposed
+            self.accepted += accepted
+        logger.debug(
+            "Спекулятивное декодирование: принято %d/%d, накопленная доля %.2f",
+            accepted, proposed, self.acceptance_rate
+        )
+        return ids
+
+    def _propose(self, ids, draft_past, k: int, processors, warpers):
+        # Черновая модель дописывает недостающие в её кэше токены и предлагает k новых
+        cached = draft_past[0][0].shape[-2] if draft_past is not None else 0
+        step_input = ids[:, cached:]
+        sequence = ids
+        tokens, probs = [], []
+        for _ in range(k):
+            output = self.draft(step_input, past_key_values=draft_past, use_cache=True)
+            draft_past = output.past_key_values
+            q = self._probs(sequence, output.logits[:, -1], processors, warpers)
+            token = torch.multinomial(q, 1)
+            tokens.append(token)
+            probs.append(q)
+            sequence = torch.cat([sequence, token], dim=-1)
+            step_input = token
+        return torch.cat(tokens, dim=-1), probs, draft_past
+
+    def _probs(self, sequence, logits, processors, warpers):
+        # Процессоры меняют scores на месте, а logits — срез общего выхода модели
+        scores = processors(sequence, logits.float().clone())
+        scores = warpers(sequence, scores)
+        return torch.softmax(scores, dim=-1)
+
+    def _crop(self, past, length: int):
+        return tuple(tuple(tensor[:, :, :length, :] for tensor in layer) for layer in past)
+
+    def _build_warpers(self, config: dict):
+        processors = LogitsProcessorList()
+        if config.get("repetition_penalty", 1.0) != 1.0:
+            processors.append(RepetitionPenaltyLogitsProcessor(config["repetition_penalty"]))
+        if config.get("no_repeat_ngram_size"):
+            processors.append(NoRepeatNGramLogitsProcessor(config["no_repeat_ngram_size"]))
+
+        warpers = LogitsProcessorList()
+        if config.get("temperature", 1.0) != 1.0:
+            warpers.append(TemperatureLogitsWarper(config["temperature"]))
+        if config.get("top_k"):
+            warpers.append(TopKLogitsWarper(top_k=config["top_k"]))
+        if config.get("top_p", 1.0) < 1.0:
+            warpers.append(TopPLogitsWarper(top_p=config["top_p"]))
+        return processors, warpers
@@ -1,4 +1,4 @@
-import os
+import asyncio
 import traceback
 from aiogram.fsm.state import State, StatesGroup
 from aiogram import types
@@ -8,6 +8,8 @@ import pandas as pd
 import re
 from dotenv import load_dotenv
 from aiogram.fsm.storage.base import StorageKey
+from broadcast import Broadcaster
+from metrics import SURVEY_SECONDS, SURVEY_STEPS
 
 load_dotenv()
 
@@ -103,7 +105,17 @@ class SurveyManager:
                 "max": 12
             }
         ]
-        self.active_surveys = {}
+        self._alerts = None
+        self._scoring_tasks = set()
+        self._survey_task = None
+
+    @property
+    def alerts(self) -> asyncio.Queue:
+        # Анкеты с аномальной ошибкой реконструкции; разбирает AdminPanel.run_alert_dispatcher.
+        # Очередь создаётся уже внутри работающего event loop
+        if self._alerts is None:
+            self._alerts = asyncio.Queue(maxsize=1000)
+        return self._alerts
 
     async def send_consent_request(self, chat_id: int, state: FSMContext):
         try:
@@ -120,34 +132,43 @@ class SurveyManager:
                 reply_markup=markup
             )
             await state.set_state(SurveyStates.CONSENT) 
-            logger.info(f"Состояние CONSENT установлено для {chat_id}")
+            logger.info("Состояние CONSENT установлено для %s", chat_id)
         except Exception as e:
-            logger.error(f"Ошибка отправки клавиатуры: {e}")
+            logger.error("Ошибка отправки клавиатуры: %s", e)
             await self.bot.send_message(chat_id, "⚠️ Ошибка. Попробуйте позже.")
 
     async def handle_consent(self, message: types.Message, state: FSMContext):
         if message.text == "Согласен":
-            self.data_processor._update_users_file(message.chat.id)
+            try:
+                await asyncio.wrap_future(self.data_processor.register_user(message.chat.id))
+            except Exception as e:
+                # Состояние CONSENT остаётся: ученик может подтвердить согласие ещё раз
+                logger.error("Ошибка регистрации %s: %s", message.chat.id, e)
+                await message.answer("⚠️ Ошибка. Попробуйте позже.")
+                return
             await message.answer("✅ Согласие принято. Добро пожаловать в ПсихоРитм! Что случилось?")
             await state.clear()
         else:
             await message.answer("❌ Согласие отклонено.")
             await state.clear()
 
-    async def _start_survey(self, chat_id: int, state: FSMContext):
+    async def _announce_survey(self, chat_id: int):
         await self.bot.send_message(
             chat_id,  
             "📝 Начинаем ежедневный опрос!",
             reply_markup=types.ReplyKeyboardRemove()
         )
-        self.active_surveys[chat_id] = True
+
+    async def _ask_first_question(self, chat_id: int, state: FSMContext):
+        # Данные FSM сохраняются в JSON, поэтому время — строкой ISO
         await state.set_data({
             'current_question': 0,
             'answers': {},
-            'start_time': pd.Timestamp.now()
+            'start_time': pd.Timestamp.now().isoformat()
         })
         await self._ask_question(chat_id, 0)
         await state.set_state(SurveyStates.IN_PROGRESS)
+        SURVEY_STEPS.inc(step="started")
 
     async def _ask_question(self, chat_id: int, question_num: int):
         question = self.questions[question_num]
@@ -172,14 +193,15 @@ class SurveyManager:
         question = self.questions[current_q]
         
         if not self._validate_answer(question, message.text):
+            SURVEY_STEPS.inc(step="invalid")
             await message.answer("⚠️ Пожалуйста, введите корректные данные")
             return
 
+        SURVEY_STEPS.inc(step="answered")
         data['answers'][question['column_name']] = message.text
-        await state.update_data(answers=data['answers'])
         
         if current_q + 1 < len(self.questions):
-            await state.update_data(current_question=current_q + 1)
+            await state.update_data(answers=data['answers'], current_question=current_q + 1)
             await self._ask_question(message.chat.id, current_q + 1)
         else:
             await self._complete_survey(message.chat.id, data, state)
@@ -210,58 +232,118 @@ class SurveyManager:
         
         return True
 
+    def placeholder_answer(self, question_num: int, answer: str) -> str:
+        # Для записи обновлений: ответ заменяется значением того же типа, которое проверка
+        # примет или отклонит так же, как исходное, — повтор проходит опрос тем же путём
+        question = self.questions[question_num]
+        if question['type'] == 'text' or not self._validate_answer(question, answer):
+            return "x" * len(answer)
+        if question['type'] == 'category':
+            return question['options'][0]
+        if question['type'] == 'time':
+            return "00:00"
+        return str(question['min'])
+
     async def _complete_survey(self, chat_id: int, data: dict, state: FSMContext):
         try:
-            self.data_processor.save_response(chat_id, data['answers'])
+            # Подтверждение уходит только после фиксации анкеты в базе
+            await asyncio.wrap_future(self.data_processor.save_response(chat_id, data['answers']))
+            logger.info("Ответы пользователя %s сохранены", chat_id)
+            SURVEY_STEPS.inc(step="completed")
+            SURVEY_SECONDS.observe((pd.Timestamp.now() - pd.Timestamp(data['start_time'])).total_seconds())
             await self.bot.send_message(
                 chat_id,
                 "📊 Спасибо за прохождение опроса! Ваши ответы сохранены.",
                 reply_markup=types.ReplyKeyboardRemove()
             )
+            task = asyncio.create_task(self._score_response(chat_id, data['answers']))
+            self._scoring_tasks.add(task)
+            task.add_done_callback(self._scoring_tasks.discard)
         except Exception as e:
-            logger.error(f"Ошибка сохранения данных: {e}")
+            logger.error("Ошибка сохранения данных: %s", e)
             await self.bot.send_message(chat_id, "⚠️ Ошибка сохранения данных")
         finally:
-            self.active_surveys[chat_id] = False  
             await state.clear()  
-            logger.info(f"Состояние пользователя {chat_id} сброшено")
+            logger.info("Состояние пользователя %s сброшено", chat_id)
 
-    async def is_survey_in_progress(self, chat_id: int) -> bool:
-        return self.active_surveys.get(chat_id, False)
+    async def _score_response(self, chat_id: int, answers: dict):
+        # Модель считает в отдельном потоке, чтобы не держать event loop
+        try:
+            result = await asyncio.to_thread(self.data_processor.score_response, chat_id, answers)
+        except Exception as e:
+            logger.error("Ошибка оценки анкеты %s: %s", chat_id, e)
+            return
 
-    async def run_scheduled_survey(self) -> bool:
+        if not result["anomaly"]:
+            return
+        logger.warning("Аномальная анкета %s: ошибка %.4f при пороге %.4f", chat_id, result['error'], result['threshold'])
+        try:
+            self.alerts.put_nowait(result)
+        except asyncio.QueueFull:
+            logger.error("Очередь оповещений переполнена, анкета %s не передана администраторам", chat_id)
+
+    async def is_survey_in_progress(self, state: FSMContext) -> bool:
+        return await state.get_state() == SurveyStates.IN_PROGRESS.state
+
+    async def run_scheduled_survey(self) -> dict:
+        # Повторный /run_survey или возобновление при старте во время идущей рассылки
+        # не начинают вторую, а ждут итога текущей
+        if self._survey_task is None or self._survey_task.done():
+            self._survey_task = asyncio.create_task(self._run_scheduled_survey())
+        return await asyncio.shield(self._survey_task)
+
+    async def _run_scheduled_survey(self) -> dict:
             try:
                 logger.info("=== ЗАПУСК ОПРОСА АДМИНИСТРАТОРОМ ===")
-                
-                if not os.path.exists("users.csv"):
-                    logger.error("❌ Файл users.csv не найден!")
-                    return False
+                store = self.data_processor.store
+
+                # Прерванная сегодняшняя рассылка продолжается, а не начинается заново
+                broadcast_id = await asyncio.to_thread(
+                    store.unfinished_broadcast, "survey", pd.Timestamp.now().normalize()
+                )
+                if broadcast_id is not None:
+                    logger.info(f"Продолжение прерванной рассылки {broadcast_id}")
+                else:
+                    user_ids = self.data_processor.get_user_ids()
+                    if not user_ids:
+                        logger.error("❌ В базе нет пользователей!")
+                        return None
 
-                user_ids = pd.read_csv("users.csv")['user_id'].astype(int).tolist()
-                admin_ids = [7687534894]  
-                user_ids = [uid for uid in user_ids if uid not in admin_ids]
-                logger.info(f"Найдено пользователей: {len(user_ids)}")
+                    admin_ids = [7687534894]  
+                    user_ids = [uid for uid in user_ids if uid not in admin_ids]
+                    logger.info(f"Найдено пользователей: {len(user_ids)}")
 
-                success = 0
-                for user_id in user_ids:
-                    try:
-                        storage_key = StorageKey(
-                            chat_id=user_id,
-                            user_id=user_id,
-                            bot_id=self.bot.id
-                        )
-                        user_state = FSMContext(storage=self.storage, key=storage_key) 
-                        
-                        await self._start_survey(user_id, user_state)
-                        success += 1
-                        logger.info(f"✅ Опрос запущен для {user_id}")
-                        
-                    except Exception as e:
-                        logger.error(f"❌ Ошибка для {user_id}: {traceback.format_exc()}")
-                
-                logger.info(f"Успешно запущено: {success}/{len(user_ids)}")
-                return success > 0
+                    # Другой процесс бота мог создать рассылку одновременно — тогда продолжаем его
+                    broadcast_id = await asyncio.to_thread(
+                        store.create_broadcast,
+                        f"survey-{pd.Timestamp.now():%Y%m%d-%H%M%S}",
+                        "survey",
+                        user_ids,
+                        pd.Timestamp.now().normalize()
+                    )
+
+                # Объявление и первый вопрос — отдельные шаги: повтор не шлёт объявление второй раз
+                report = await Broadcaster(store).run(broadcast_id, [self._announce_survey, self._deliver_survey])
+                logger.info(f"Успешно запущено: {report['delivered']}/{report['total']}")
+                return report
 
             except Exception as e:
                 logger.critical(f"💥 Критическая ошибка: {traceback.format_exc()}")
-                return False
\ No newline at end of file
+                return None
+
+    async def resume_scheduled_survey(self):
+        # При старте бота досылаем сегодняшнюю рассылку, если её прервал перезапуск
+        broadcast_id = await asyncio.to_thread(
+            self.data_processor.store.unfinished_broadcast, "survey", pd.Timestamp.now().normalize()
+        )
+        if broadcast_id is not None:
+            await self.run_scheduled_survey()
+
+    async def _deliver_survey(self, user_id: int):
+        storage_key = StorageKey(
+            chat_id=user_id,
+            user_id=user_id,
+            bot_id=self.bot.id
+        )
+        user_state = FSMContext(storage=self.storage, key=storage_key) 
+        await self._ask_first_question(user_id, user_state)
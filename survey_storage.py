@@ -0,0 +1,367 @@
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import closing
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Наибольший INTEGER PRIMARY KEY в SQLite
+MAX_ID = 2 ** 63 - 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    consented_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS responses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    timestamp TEXT NOT NULL,
+    answers TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_responses_user_time ON responses (user_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_responses_time ON responses (timestamp);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    finished_at TEXT
+);
+CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+    broadcast_id TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    step INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated_at TEXT,
+    PRIMARY KEY (broadcast_id, user_id)
+);
+"""
+
+
+class SurveyStore:
+    def __init__(self, path: str = None, batch_size: int = None, flush_interval_ms: float = None):
+        self.path = path or os.getenv("DB_PATH", "bot.sqlite3")
+        self.batch_size = batch_size or int(os.getenv("DB_BATCH_SIZE", "100"))
+        self.flush_interval = (flush_interval_ms or float(os.getenv("DB_FLUSH_INTERVAL_MS", "200"))) / 1000
+        self.max_attempts = int(os.getenv("DB_WRITE_ATTEMPTS", "3"))
+        self.retry_delay = float(os.getenv("DB_RETRY_DELAY_MS", "50")) / 1000
+
+        with closing(self._connect()) as connection:
+            connection.executescript(SCHEMA)
+            self._migrate_schema(connection)
+            self._migrate_csv(connection)
+
+        # Запись идёт через очередь в отдельный поток: вызов из event loop — только put в очередь,
+        # поток копит операции и фиксирует их одной транзакцией. Каждая операция возвращает
+        # Future, который завершается после фиксации или с исключением, если запись не удалась
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="survey-store", daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _enqueue(self, sql: str, params: tuple) -> Future:
+        future = Future()
+        self._queue.put((sql, params, future))
+        return future
+
+    def add_user(self, user_id: int) -> Future:
+        return self._enqueue(
+            "INSERT OR IGNORE INTO users (user_id, consented_at) VALUES (?, ?)",
+            (int(user_id), pd.Timestamp.now().isoformat())
+        )
+
+    def save_response(self, user_id: int, answers: dict, timestamp: pd.Timestamp = None) -> Future:
+        timestamp = timestamp if timestamp is not None else pd.Timestamp.now()
+        return self._enqueue(
+            "INSERT INTO responses (user_id, timestamp, answers) VALUES (?, ?, ?)",
+            (int(user_id), timestamp.isoformat(), json.dumps(answers, ensure_ascii=False))
+        )
+
+    def flush(self, timeout: float = None) -> bool:
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def get_user_ids(self) -> list:
+        with closing(self._connect()) as connection:
+            return [row[0] for row in connection.execute("SELECT user_id FROM users ORDER BY consented_at")]
+
+    def load_responses(self, after_id: int = 0, limit: int = None, until_id: int = None) -> pd.DataFrame:
+        # Постраничное чтение по ключу: следующая порция начинается после последнего id предыдущей;
+        # until_id — верхняя граница включительно, чтобы анкеты, пришедшие во время обхода, в него не попали
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT id, user_id, timestamp, answers FROM responses WHERE id > ? AND id <= ? ORDER BY id LIMIT ?",
+                (int(after_id), int(until_id) if until_id is not None else MAX_ID, int(limit) if limit else -1)
+            ).fetchall()
+        return self._to_frame(rows)
+
+    def load_recent_responses(self, limit: int) -> pd.DataFrame:
+        # Последние limit анкет в порядке id, без чтения всей истории
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT id, user_id, timestamp, answers FROM responses ORDER BY id DESC LIMIT ?",
+                (int(limit),)
+            ).fetchall()
+        return self._to_frame(rows[::-1])
+
+    def max_response_id(self) -> int:
+        with closing(self._connect()) as connection:
+            return connection.execute("SELECT COALESCE(MAX(id), 0) FROM responses").fetchone()[0]
+
+    def get_meta(self, key: str, default: str = None) -> str:
+        with closing(self._connect()) as connection:
+            row = connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key: str, value: str):
+        # Синхронно, мимо очереди: вызывающему нужно знать, что значение зафиксировано
+        with closing(self._connect()) as connection, connection:
+            connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _to_frame(self, rows: list) -> pd.DataFrame:
+        records = []
+        for response_id, user_id, timestamp, answers in rows:
+            record = json.loads(answers)
+            record["user_id"] = user_id
+            record["timestamp"] = timestamp
+            records.append(record)
+
+        return pd.DataFrame(records, index=pd.Index([row[0] for row in rows], name="id"))
+
+    def create_broadcast(self, broadcast_id: str, kind: str, user_ids: list, since: pd.Timestamp = None) -> str:
+        # Незавершённые рассылки того же вида закрываются: возобновляется только последняя.
+        # Если незавершённая рассылка начата после since (её мог только что создать другой процесс),
+        # возвращается её id и новая не создаётся
+        now = pd.Timestamp.now().isoformat()
+        with closing(self._connect()) as connection, connection:
+            connection.execute("BEGIN IMMEDIATE")
+            if since is not None:
+                row = connection.execute(
+                    "SELECT id FROM broadcasts WHERE kind = ? AND finished_at IS NULL AND created_at >= ? "
+                    "ORDER BY created_at DESC LIMIT 1",
+                    (kind, since.isoformat())
+                ).fetchone()
+                if row:
+                    return row[0]
+            connection.execute(
+                "UPDATE broadcasts SET finished_at = ? WHERE kind = ? AND finished_at IS NULL",
+                (now, kind)
+            )
+            connection.execute(
+                "INSERT INTO broadcasts (id, kind, created_at) VALUES (?, ?, ?)",
+                (broadcast_id, kind, now)
+            )
+            connection.executemany(
+                "INSERT OR IGNORE INTO broadcast_deliveries (broadcast_id, user_id, status, updated_at) "
+                "VALUES (?, ?, 'pending', ?)",
+                [(broadcast_id, int(user_id), now) for user_id in user_ids]
+            )
+        return broadcast_id
+
+    def unfinished_broadcast(self, kind: str, since: pd.Timestamp) -> str:
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                "SELECT id FROM broadcasts WHERE kind = ? AND finished_at IS NULL AND created_at >= ? "
+                "ORDER BY created_at DESC LIMIT 1",
+                (kind, since.isoformat())
+            ).fetchone()
+        return row[0] if row else None
+
+    def pending_deliveries(self, broadcast_id: str, lease_seconds: float) -> list:
+        # Вместе с ожидающими — доставки, захваченные процессом, который не отчитался за lease_seconds
+        stale = (pd.Timestamp.now() - pd.Timedelta(seconds=lease_seconds)).isoformat()
+        with closing(self._connect()) as connection:
+            return [row[0] for row in connection.execute(
+                "SELECT user_id FROM broadcast_deliveries WHERE broadcast_id = ? "
+                "AND (status = 'pending' OR (status = 'sending' AND updated_at < ?)) ORDER BY user_id",
+                (broadcast_id, stale)
+            )]
+
+    def claim_delivery(self, broadcast_id: str, user_id: int, lease_seconds: float) -> int:
+        # Атомарный захват доставки: её отправляет только тот, чей UPDATE изменил строку.
+        # Возвращает число уже отправленных сообщений или None, если доставку забрал другой
+        now = pd.Timestamp.now()
+        stale = (now - pd.Timedelta(seconds=lease_seconds)).isoformat()
+        with closing(self._connect()) as connection, connection:
+            cursor = connection.execute(
+                "UPDATE broadcast_deliveries SET status = 'sending', updated_at = ? "
+                "WHERE broadcast_id = ? AND user_id = ? "
+                "AND (status = 'pending' OR (status = 'sending' AND updated_at < ?))",
+                (now.isoformat(), broadcast_id, int(user_id), stale)
+            )
+            if cursor.rowcount != 1:
+                return None
+            return connection.execute(
+                "SELECT step FROM broadcast_deliveries WHERE broadcast_id = ? AND user_id = ?",
+                (broadcast_id, int(user_id))
+            ).fetchone()[0]
+
+    def record_step(self, broadcast_id: str, user_id: int, step: int) -> Future:
+        # Сколько сообщений доставки уже отправлено: повтор продолжает со следующего
+        return self._enqueue(
+            "UPDATE broadcast_deliveries SET step = ?, updated_at = ? WHERE broadcast_id = ? AND user_id = ?",
+            (step, pd.Timestamp.now().isoformat(), broadcast_id, int(user_id))
+        )
+
+    def record_delivery(self, broadcast_id: str, user_id: int, status: str, attempts: int, error: str = None) -> Future:
+        return self._enqueue(
+            "UPDATE broadcast_deliveries SET status = ?, attempts = ?, error = ?, updated_at = ? "
+            "WHERE broadcast_id = ? AND user_id = ?",
+            (status, attempts, error, pd.Timestamp.now().isoformat(), broadcast_id, int(user_id))
+        )
+
+    def finish_broadcast(self, broadcast_id: str):
+        self.flush()
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "UPDATE broadcasts SET finished_at = ? WHERE id = ?",
+                (pd.Timestamp.now().isoformat(), broadcast_id)
+            )
+
+    def broadcast_report(self, broadcast_id: str) -> dict:
+        self.flush()
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT status, COUNT(*) FROM broadcast_deliveries WHERE broadcast_id = ? GROUP BY status",
+                (broadcast_id,)
+            ).fetchall()
+        return dict(rows)
+
+    def close(self):
+        self.flush()
+        self._queue.put(None)
+        self._writer.join(timeout=5)
+
+    def _write_loop(self):
+        connection = self._connect()
+        stop = False
+        while not stop:
+            batch = [self._queue.get()]
+            stop = batch[0] is None
+            deadline = time.monotonic() + self.flush_interval
+            while not stop and len(batch) < self.batch_size and not isinstance(batch[-1], threading.Event):
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+                stop = batch[-1] is None
+
+            self._commit(connection, [item for item in batch if item is not None])
+        connection.close()
+
+    def _commit(self, connection, batch: list):
+        statements = [item for item in batch if not isinstance(item, threading.Event)]
+        try:
+            try:
+                with connection:
+                    for sql, params, _ in statements:
+                        connection.execute(sql, params)
+            except sqlite3.Error as e:
+                # Одна неудачная операция не должна терять весь пакет: повторяем по одной
+                logger.warning("Пакет из %d операций не записан (%s), повтор по одной", len(statements), e)
+                self._commit_each(connection, statements)
+                return
+            for _, _, future in statements:
+                future.set_result(None)
+            if statements:
+                logger.debug("Записано операций: %d", len(statements))
+        finally:
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+
+    def _commit_each(self, connection, statements: list):
+        # Повтор идёт здесь же, по порядку: операция не обгоняет более позднюю запись той же строки,
+        # а flush() не возвращается, пока пакет не разобран
+        for sql, params, future in statements:
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    with connection:
+                        connection.execute(sql, params)
+                except sqlite3.OperationalError as e:
+                    # Блокировка базы и подобные сбои проходят сами — повтор с нарастающей паузой
+                    if attempt < self.max_attempts:
+                        logger.warning("Операция не записана (%s), попытка %d из %d", e, attempt, self.max_attempts)
+                        time.sleep(self.retry_delay * attempt)
+                        continue
+                    error = e
+                except sqlite3.Error as e:
+                    # Ошибка самих данных повтором не исправится
+                    error = e
+                else:
+                    future.set_result(None)
+                    break
+                logger.error("Ошибка записи в %s: %s; операция: %s", self.path, error, sql)
+                future.set_exception(error)
+                break
+
+    def _migrate_schema(self, connection):
+        columns = {row[1] for row in connection.execute("PRAGMA table_info(broadcast_deliveries)")}
+        if "step" not in columns:
+            try:
+                with connection:
+                    connection.execute("ALTER TABLE broadcast_deliveries ADD COLUMN step INTEGER NOT NULL DEFAULT 0")
+            except sqlite3.OperationalError as e:
+                # Столбец успел добавить другой процесс, стартовавший одновременно
+                if "duplicate column" not in str(e):
+                    raise
+
+    def _migrate_csv(self, connection):
+        # Однократный перенос users.csv и survey_data.csv; сами файлы остаются на месте.
+        # BEGIN IMMEDIATE: из нескольких процессов, стартовавших одновременно, переносит только первый
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            if connection.execute("SELECT 1 FROM meta WHERE key = 'csv_migrated'").fetchone():
+                return
+
+            if os.path.exists("users.csv"):
+                user_ids = pd.read_csv("users.csv")["user_id"].dropna().astype(int).tolist()
+                now = pd.Timestamp.now().isoformat()
+                connection.executemany(
+                    "INSERT OR IGNORE INTO users (user_id, consented_at) VALUES (?, ?)",
+                    [(user_id, now) for user_id in user_ids]
+                )
+                logger.info(f"Перенесено пользователей из users.csv: {len(user_ids)}")
+
+            if os.path.exists("survey_data.csv"):
+                data = pd.read_csv("survey_data.csv", encoding="utf-8", on_bad_lines="warn")
+                answer_columns = [column for column in data.columns if column not in ("user_id", "timestamp")]
+                rows = []
+                for record in data.to_dict("records"):
+                    answers = {column: record[column] for column in answer_columns if not pd.isna(record[column])}
+                    rows.append((
+                        int(record["user_id"]) if "user_id" in record and not pd.isna(record["user_id"]) else 0,
+                        str(record.get("timestamp", pd.Timestamp.now().isoformat())),
+                        json.dumps(answers, ensure_ascii=False, default=str)
+                    ))
+                connection.executemany(
+                    "INSERT INTO responses (user_id, timestamp, answers) VALUES (?, ?, ?)",
+                    rows
+                )
+                logger.info(f"Перенесено анкет из survey_data.csv: {len(rows)}")
+
+            connection.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('csv_migrated', ?)", (pd.Timestamp.now().isoformat(),))
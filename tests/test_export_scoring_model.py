@@ -0,0 +1,59 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+
+pytest.importorskip("sklearn")
+tf = pytest.importorskip("tensorflow")
+
+from sklearn.compose import ColumnTransformer
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+from export_scoring_model import Exporter
+from scoring_engine import load_scoring_model
+
+
+def make_frame(rows: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "Шаги": rng.integers(0, 30000, size=rows).astype(float),
+        "Длительность сна": rng.uniform(3, 11, size=rows),
+        "Пол": rng.choice(["мужской", "женский", "unknown"], size=rows)
+    })
+
+
+def test_numpy_artifact_matches_sklearn_and_keras(tmp_path):
+    train = make_frame(200, seed=0)
+    preprocessor = ColumnTransformer([
+        ("numeric", StandardScaler(), ["Шаги", "Длительность сна"]),
+        ("categorical", OneHotEncoder(handle_unknown="ignore", sparse_output=False), ["Пол"])
+    ]).fit(train)
+    n_features = preprocessor.transform(train).shape[1]
+
+    tf.random.set_seed(0)
+    model = tf.keras.Sequential([
+        tf.keras.layers.Input(shape=(n_features,)),
+        tf.keras.layers.Dense(3, activation="relu"),
+        tf.keras.layers.Dense(n_features, activation="linear")
+    ])
+
+    exporter = Exporter()
+    spec = {"version": 1, **exporter.export_preprocessor(preprocessor), "layers": exporter.export_autoencoder(model)}
+    path = str(tmp_path / "scoring_model.npz")
+    exporter.save(path, spec)
+    numpy_preprocessor, numpy_autoencoder = load_scoring_model(path)
+
+    data = make_frame(50, seed=1)
+    expected = preprocessor.transform(data)
+    actual = numpy_preprocessor.transform(data)
+    np.testing.assert_allclose(actual, expected, rtol=1e-6, atol=1e-9)
+
+    np.testing.assert_allclose(
+        numpy_autoencoder.predict(actual),
+        model.predict(expected, verbose=0),
+        rtol=1e-4, atol=1e-6
+    )
@@ -0,0 +1,100 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PROMPTS = [
+    "Не могу уснуть перед контрольной, что делать?",
+    "У меня стресс перед экзаменом",
+    "Поссорился с другом и не знаю, как помириться",
+    "Как перестать волноваться перед ответом у доски?"
+]
+
+
+def run_worker(backend: str, new_tokens: int, repeats: int):
+    os.environ["CHAT_BACKEND"] = backend
+    import torch
+    from chat_model import ChatModel
+    from inference_scheduler import InferenceJob
+    from resource_usage import current_rss_mb, peak_rss_mb
+
+    started = time.perf_counter()
+    chat_model = ChatModel()
+    load_seconds = time.perf_counter() - started
+
+    # Чистая скорость декодирования: фиксированная длина ответа без сэмплирования
+    inputs = chat_model.tokenizer(PROMPTS[0], return_tensors="pt").to(chat_model.device)
+    decode_seconds = 0.0
+    with torch.inference_mode():
+        for _ in range(repeats):
+            started = time.perf_counter()
+            chat_model.model.generate(
+                **inputs,
+                max_new_tokens=new_tokens,
+                min_new_tokens=new_tokens,
+                do_sample=False,
+                pad_token_id=chat_model.tokenizer.pad_token_id
+            )
+            decode_seconds += time.perf_counter() - started
+
+    # Полный путь ответа: префикс-кэш, пакет, ранняя остановка на конце предложения
+    started = time.perf_counter()
+    for repeat in range(repeats):
+        jobs = [
+            InferenceJob(prompt, -1 - repeat * len(PROMPTS) - i, None, None, deadline=float("inf"))
+            for i, prompt in enumerate(PROMPTS)
+        ]
+        chat_model._generate_batch(jobs, {})
+    reply_seconds = (time.perf_counter() - started) / (repeats * len(PROMPTS))
+
+    chat_model.close()
+    print(json.dumps({
+        "backend": backend,
+        "load_s": round(load_seconds, 2),
+        "tokens_per_s": round(new_tokens * repeats / decode_seconds, 2),
+        "reply_latency_s": round(reply_seconds, 3),
+        "acceptance_rate": round(chat_model.speculative.acceptance_rate, 3) if chat_model.speculative else "-",
+        "rss_mb": round(current_rss_mb(), 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1)
+    }))
+
+
+def main():
+    # Спекулятивный режим сравнивается запуском с CHAT_DRAFT_MODEL_NAME в окружении
+    parser = argparse.ArgumentParser(description="Сравнение бэкендов ChatModel: токены/с и потребление памяти")
+    parser.add_argument("--backends", nargs="+", default=["auto", "cpu", "cpu-int8"])
+    parser.add_argument("--new-tokens", type=int, default=32)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.new_tokens, args.repeats)
+        return
+
+    # Каждый бэкенд — в отдельном процессе, иначе пиковый RSS одного исказит замер другого
+    results = []
+    for backend in args.backends:
+        output = subprocess.run(
+            [sys.executable, __file__, "--worker", backend,
+             "--new-tokens", str(args.new_tokens), "--repeats", str(args.repeats)],
+            capture_output=True, text=True
+        )
+        lines = [line for line in output.stdout.splitlines() if line.startswith("{")]
+        if output.returncode != 0 or not lines:
+            print(f"{backend}: ошибка\n{output.stderr[-2000:]}")
+            continue
+        results.append(json.loads(lines[-1]))
+
+    header = ["backend", "load_s", "tokens_per_s", "reply_latency_s", "acceptance_rate", "rss_mb", "peak_rss_mb"]
+    print(" | ".join(f"{column:>15}" for column in header))
+    for result in results:
+        print(" | ".join(f"{str(result[column]):>15}" for column in header))
+
+
+if __name__ == "__main__":
+    main()
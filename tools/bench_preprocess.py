@@ -0,0 +1,136 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Значения с реальными огрехами ввода: другие разделители, пробелы, диапазоны, пропуски, мусор
+TIMES = ["23:15", "7:05", "7.30", "6,45", " 8:00 ", "0:0", "24:61", "abc", "", "12", "1:2:3", np.nan]
+LESSONS = ["5", "6", " 7 ", "5-6", "4 - 6", "все", "Все", "ВСЕ ", "", "abc", "3.5", "nan", np.nan]
+STRESS = ["нет", "Нет", "НЕТ", "был экзамен", "поссорился с другом", "", np.nan]
+SLEEP = ["Отлично", "Хорошо", "Удовлетворительно", "Плохо", np.nan]
+GENDER = ["Мужской", "Женский", " мужской ", np.nan]
+
+
+def make_dataset(rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+
+    def pick(values):
+        return pd.Series(np.array(values, dtype=object)[rng.integers(len(values), size=rows)])
+
+    return pd.DataFrame({
+        'Шаги': rng.integers(0, 30000, size=rows).astype(str),
+        'Время активности': rng.integers(0, 300, size=rows).astype(str),
+        'Средний пульс': rng.integers(50, 140, size=rows).astype(str),
+        'Длительность сна': rng.uniform(3, 11, size=rows).round(1).astype(str),
+        'Качество сна': pick(SLEEP),
+        'Время засыпания': pick(TIMES),
+        'Время пробуждения': pick(TIMES),
+        'Оценка настроения': rng.integers(1, 11, size=rows).astype(str),
+        'Стресс': pick(STRESS),
+        'Возраст': rng.integers(7, 26, size=rows).astype(str),
+        'Пол': pick(GENDER),
+        'Количество уроков': pick(LESSONS)
+    })
+
+
+class LegacyPreprocessing:
+    # Построчная реализация, какой _preprocess_data был до векторизации
+    def __init__(self, processor):
+        self.required_columns = processor.required_columns
+        self.sleep_mapping = processor.sleep_mapping
+
+    def _preprocess_data(self, data: pd.DataFrame) -> pd.DataFrame:
+        missing = [col for col in self.required_columns if col not in data.columns]
+        if missing:
+            raise ValueError(f"Отсутствуют столбцы: {missing}")
+
+        data['Время засыпания'] = data['Время засыпания'].apply(self._convert_time)
+        data['Время пробуждения'] = data['Время пробуждения'].apply(self._convert_time)
+
+        data['Время засыпания'] = data['Время засыпания'].fillna(data['Время засыпания'].median())
+        data['Время пробуждения'] = data['Время пробуждения'].fillna(data['Время пробуждения'].median())
+
+        data['Качество сна'] = (
+            data['Качество сна']
+            .astype(str).str.lower()
+            .replace(self.sleep_mapping)
+            .fillna('unknown')
+        )
+
+        data['Стресс'] = data['Стресс'].apply(lambda x: 'Да' if str(x).lower() != 'нет' else 'Нет')
+        data['Пол'] = (
+            data['Пол']
+            .str.strip().str.lower()
+            .replace({'мужской': 'мужской', 'женский': 'женский'})
+            .fillna('unknown')
+        )
+
+        data['Количество уроков'] = data['Количество уроков'].apply(self._process_lessons)
+
+        return data
+
+    def _convert_time(self, time_str: str) -> int:
+        try:
+            time_str = str(time_str).replace('.', ':').replace(',', ':')
+            h, m = map(int, time_str.split(':'))
+            return h * 60 + m
+        except:
+            return np.nan
+
+    def _process_lessons(self, lessons: str) -> float:
+        lessons = str(lessons).strip()
+        if lessons.lower() == 'все':
+            return 8.0
+        elif '-' in lessons:
+            parts = lessons.split('-')
+            return (float(parts[0]) + float(parts[1])) / 2
+        else:
+            try:
+                return float(lessons)
+            except:
+                return 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение построчной и векторизованной предобработки анкет")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10 ** 5, 10 ** 6])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # DataProcessor создаёт базу и файл порогов в текущем каталоге — уводим их во временный
+    workdir = tempfile.mkdtemp(prefix="bench_preprocess_")
+    os.chdir(workdir)
+    os.environ["DB_PATH"] = os.path.join(workdir, "bench.sqlite3")
+    from data_processing import DataProcessor
+
+    processor = DataProcessor()
+    legacy = LegacyPreprocessing(processor)
+
+    print(f"{'строк':>10} {'построчно, с':>14} {'вектор, с':>10} {'ускорение':>10}")
+    for rows in args.sizes:
+        # Набор генерируется заново под каждый вариант вместо copy(): на 10^7 строк копии не влезают в память
+        data = make_dataset(rows, args.seed)
+        started = time.perf_counter()
+        expected = legacy._preprocess_data(data)
+        legacy_seconds = time.perf_counter() - started
+
+        data = make_dataset(rows, args.seed)
+        started = time.perf_counter()
+        actual = processor._preprocess_data(data)
+        vector_seconds = time.perf_counter() - started
+        del data
+
+        pd.testing.assert_frame_equal(actual, expected)
+        del actual, expected
+        print(f"{rows:>10} {legacy_seconds:>14.2f} {vector_seconds:>10.2f} {legacy_seconds / vector_seconds:>9.1f}x")
+
+    processor.close()
+
+
+if __name__ == "__main__":
+    main()
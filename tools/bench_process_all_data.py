@@ -0,0 +1,160 @@
+import argparse
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_preprocess import make_dataset
+
+# Микробенчмарк ночного отчёта: DataProcessor.process_all_data на синтетических базах растущего
+# размера — полный пересчёт и дописывание 1% новых анкет. Модель оценки — NumPy-артефакт
+# с препроцессором, обученным на тех же данных, и автоэнкодером со случайными весами
+
+PHASES = ["medians", "preprocess", "predict", "thresholds", "write", "report", "total"]
+NUMERIC = ['Шаги', 'Время активности', 'Средний пульс', 'Длительность сна', 'Время засыпания',
+           'Время пробуждения', 'Оценка настроения', 'Возраст', 'Количество уроков']
+CATEGORICAL = ['Качество сна', 'Стресс', 'Пол']
+
+
+def fill_database(path: str, rows: int, seed: int, first_id: int = 0):
+    data = make_dataset(rows, seed)
+    rng = np.random.default_rng(seed)
+    now = pd.Timestamp.now()
+    timestamps = now - pd.to_timedelta(rng.integers(0, 30 * 24 * 3600, size=rows), unit="s")
+    records = data.to_dict("records")
+    with sqlite3.connect(path) as connection:
+        connection.executemany(
+            "INSERT INTO responses (user_id, timestamp, answers) VALUES (?, ?, ?)",
+            (
+                (first_id + i, timestamp.isoformat(),
+                 json.dumps({key: value for key, value in record.items() if not pd.isna(value)}, ensure_ascii=False))
+                for i, (record, timestamp) in enumerate(zip(records, timestamps))
+            )
+        )
+
+
+def build_scoring_model(processor, path: str, seed: int):
+    from sklearn.compose import ColumnTransformer
+    from sklearn.preprocessing import OneHotEncoder, StandardScaler
+    from export_scoring_model import Exporter
+
+    sample = processor._preprocess_data(make_dataset(2000, seed))
+    preprocessor = ColumnTransformer([
+        ("numeric", StandardScaler(), NUMERIC),
+        ("categorical", OneHotEncoder(handle_unknown="ignore"), CATEGORICAL)
+    ]).fit(sample)
+    n_features = preprocessor.transform(sample).shape[1]
+
+    exporter = Exporter()
+    rng = np.random.default_rng(seed)
+    layers = []
+    for n_in, n_out, activation in [(n_features, 8, "relu"), (8, n_features, "linear")]:
+        layers.append({
+            "type": "dense",
+            "kernel": exporter._store(rng.normal(0, 0.3, (n_in, n_out)).astype(np.float32)),
+            "bias": exporter._store(np.zeros(n_out, dtype=np.float32)),
+            "activation": activation
+        })
+    exporter.save(path, {"version": 1, **exporter.export_preprocessor(preprocessor), "layers": layers})
+
+
+def run_worker(rows: int, seed: int):
+    # DataProcessor пишет отчёт и пороги в текущий каталог — работаем во временном
+    workdir = tempfile.mkdtemp(prefix="bench_process_")
+    os.chdir(workdir)
+    os.environ["DB_PATH"] = os.path.join(workdir, "bench.sqlite3")
+    os.environ["SCORING_BACKEND"] = "numpy"
+    os.environ["SCORING_MODEL_PATH"] = os.path.join(workdir, "scoring_model.npz")
+    from data_processing import DataProcessor
+    from metrics import JOB_PHASE_SECONDS
+    from resource_usage import peak_rss_mb
+
+    processor = DataProcessor()
+    build_scoring_model(processor, os.environ["SCORING_MODEL_PATH"], seed)
+    fill_database(os.environ["DB_PATH"], rows, seed)
+
+    started = time.perf_counter()
+    if not processor.process_all_data(full=True):
+        sys.exit("process_all_data(full=True) завершился ошибкой")
+    full_seconds = time.perf_counter() - started
+    phases = {phase: round(JOB_PHASE_SECONDS.total(phase=phase), 3) for phase in PHASES}
+
+    new_rows = max(1, rows // 100)
+    fill_database(os.environ["DB_PATH"], new_rows, seed + 1, first_id=rows)
+    started = time.perf_counter()
+    if not processor.process_all_data():
+        sys.exit("process_all_data() завершился ошибкой")
+    incremental_seconds = time.perf_counter() - started
+
+    processor.close()
+    print(json.dumps({
+        "rows": rows,
+        "full_s": round(full_seconds, 3),
+        "rows_per_s": round(rows / full_seconds),
+        "incremental_s": round(incremental_seconds, 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "phases": phases
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время и память DataProcessor.process_all_data на синтетических базах")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10 ** 4, 10 ** 5])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-baseline", help="записать результаты как эталон в JSON")
+    parser.add_argument("--baseline", help="сравнить с эталоном и завершиться с ошибкой при замедлении")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое замедление, доля")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.seed)
+        return
+
+    # Каждый размер — в отдельном процессе, чтобы пиковый RSS не наследовался от предыдущего
+    results = []
+    for rows in args.sizes:
+        output = subprocess.run(
+            [sys.executable, __file__, "--worker", str(rows), "--seed", str(args.seed)],
+            capture_output=True, text=True
+        )
+        lines = [line for line in output.stdout.splitlines() if line.startswith("{")]
+        if output.returncode != 0 or not lines:
+            print(f"{rows}: ошибка\n{output.stderr[-2000:]}")
+            sys.exit(1)
+        results.append(json.loads(lines[-1]))
+
+    print(f"{'строк':>10} {'полный, с':>10} {'строк/с':>9} {'+1%, с':>8} {'пик RSS, МБ':>12}  этапы, с")
+    for result in results:
+        phases = ", ".join(f"{phase} {seconds}" for phase, seconds in result["phases"].items())
+        print(f"{result['rows']:>10} {result['full_s']:>10} {result['rows_per_s']:>9} "
+              f"{result['incremental_s']:>8} {result['peak_rss_mb']:>12}  {phases}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump({str(result["rows"]): result for result in results}, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = []
+        for result in results:
+            expected = baseline.get(str(result["rows"]))
+            if expected and result["rows_per_s"] < expected["rows_per_s"] * (1 - args.tolerance):
+                regressions.append(f"{result['rows']} строк: {result['rows_per_s']} строк/с "
+                                   f"против {expected['rows_per_s']} в эталоне")
+        if regressions:
+            print("Замедление относительно эталона:\n" + "\n".join(regressions))
+            sys.exit(1)
+        print("Регрессий относительно эталона нет")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import argparse
+import json
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class Exporter:
+    # Переводит обученные ColumnTransformer и Keras-автоэнкодер в спецификацию JSON + массивы .npz
+    def __init__(self):
+        self.arrays = {}
+
+    def _store(self, array) -> str:
+        if array is None:
+            return None
+        key = f"a{len(self.arrays)}"
+        self.arrays[key] = np.asarray(array)
+        return key
+
+    def export_preprocessor(self, preprocessor) -> dict:
+        from sklearn.compose import ColumnTransformer
+
+        if not isinstance(preprocessor, ColumnTransformer):
+            raise ValueError(f"Ожидался ColumnTransformer, получен {type(preprocessor).__name__}")
+        if not hasattr(preprocessor, "feature_names_in_"):
+            raise ValueError("Препроцессор обучен без имён столбцов — выгрузка невозможна")
+
+        names = list(preprocessor.feature_names_in_)
+        transformers = []
+        for name, transformer, columns in preprocessor.transformers_:
+            if transformer == "drop":
+                continue
+            columns = self._column_names(columns, names)
+            if not columns:
+                continue
+            transformers.append({"name": name, "columns": columns, "steps": self._steps(transformer)})
+        return {"columns": names, "transformers": transformers}
+
+    def _column_names(self, columns, names: list) -> list:
+        if isinstance(columns, str):
+            return [columns]
+        if isinstance(columns, slice):
+            return names[columns]
+        columns = list(columns)
+        if columns and isinstance(columns[0], (bool, np.bool_)):
+            return [name for name, selected in zip(names, columns) if selected]
+        return [names[column] if isinstance(column, (int, np.integer)) else column for column in columns]
+
+    def _steps(self, transformer) -> list:
+        from sklearn.pipeline import Pipeline
+
+        if transformer == "passthrough":
+            return [{"type": "passthrough"}]
+        if isinstance(transformer, Pipeline):
+            return [step for _, inner in transformer.steps if inner != "passthrough" for step in self._steps(inner)]
+        return [self._step(transformer)]
+
+    def _step(self, transformer) -> dict:
+        from sklearn.impute import SimpleImputer
+        from sklearn.preprocessing import MinMaxScaler, OneHotEncoder, OrdinalEncoder, RobustScaler, StandardScaler
+
+        if isinstance(transformer, StandardScaler):
+            return {"type": "standard", "mean": self._store(transformer.mean_), "scale": self._store(transformer.scale_)}
+        if isinstance(transformer, RobustScaler):
+            return {"type": "robust", "center": self._store(transformer.center_), "scale": self._store(transformer.scale_)}
+        if isinstance(transformer, MinMaxScaler):
+            return {
+                "type": "minmax",
+                "scale": self._store(transformer.scale_),
+                "min": self._store(transformer.min_),
+                "clip": bool(transformer.clip),
+                "feature_range": list(transformer.feature_range)
+            }
+        if isinstance(transformer, SimpleImputer):
+            if transformer.add_indicator:
+                raise ValueError("SimpleImputer(add_indicator=True) не поддерживается")
+            if not (isinstance(transformer.missing_values, float) and np.isnan(transformer.missing_values)):
+                raise ValueError("Поддерживается только SimpleImputer(missing_values=np.nan)")
+            statistics = transformer.statistics_
+            numeric = transformer.strategy in ("mean", "median") or statistics.dtype.kind in "fiu"
+            if numeric and np.isnan(statistics.astype(float)).any():
+                raise ValueError("SimpleImputer отбросил полностью пустые столбцы — не поддерживается")
+            return {"type": "impute", "numeric": bool(numeric), "fill": self._plain(statistics)}
+        if isinstance(transformer, OneHotEncoder):
+            if any(infrequent is not None for infrequent in getattr(transformer, "infrequent_categories_", [])):
+                raise ValueError("OneHotEncoder с редкими категориями (min_frequency/max_categories) не поддерживается")
+            if transformer.handle_unknown not in ("ignore", "error"):
+                raise ValueError(f"OneHotEncoder(handle_unknown={transformer.handle_unknown!r}) не поддерживается")
+            drop_idx = transformer.drop_idx_
+            return {
+                "type": "onehot",
+                "categories": [self._plain(categories) for categories in transformer.categories_],
+                "drop": [None] * len(transformer.categories_) if drop_idx is None else [
+                    None if index is None else int(index) for index in drop_idx
+                ],
+                "handle_unknown": transformer.handle_unknown
+            }
+        if isinstance(transformer, OrdinalEncoder):
+            unknown_value = transformer.unknown_value if transformer.handle_unknown == "use_encoded_value" else None
+            return {
+                "type": "ordinal",
+                "categories": [self._plain(categories) for categories in transformer.categories_],
+                "handle_unknown": "error" if unknown_value is None else "use_encoded_value",
+                "unknown_value": None if unknown_value is None else float(unknown_value)
+            }
+        raise ValueError(f"Преобразование {type(transformer).__name__} не поддерживается")
+
+    def _plain(self, values) -> list:
+        # NaN (пропуск как отдельная категория) json пишет литералом NaN и читает обратно как float
+        return np.asarray(values, dtype=object).tolist()
+
+    def export_autoencoder(self, model) -> list:
+        layers = []
+        for layer in model.layers:
+            kind = type(layer).__name__
+            config = layer.get_config()
+            if kind in ("InputLayer", "Dropout", "GaussianNoise", "GaussianDropout"):
+                continue
+            if kind == "Dense":
+                weights = layer.get_weights()
+                layers.append({
+                    "type": "dense",
+                    "kernel": self._store(weights[0].astype(np.float32)),
+                    "bias": self._store(weights[1].astype(np.float32)) if config["use_bias"] else None,
+                    "activation": self._activation(config["activation"])
+                })
+            elif kind == "Activation":
+                layers.append({"type": "activation", "activation": self._activation(config["activation"])})
+            elif kind == "BatchNormalization":
+                # На инференсе BatchNorm — покомпонентное аффинное преобразование
+                weights = iter(layer.get_weights())
+                gamma = next(weights) if config["scale"] else 1.0
+                beta = next(weights) if config["center"] else 0.0
+                mean, variance = next(weights), next(weights)
+                scale = gamma / np.sqrt(variance + config["epsilon"])
+                layers.append({
+                    "type": "affine",
+                    "scale": self._store(np.asarray(scale, dtype=np.float32)),
+                    "shift": self._store(np.asarray(beta - mean * scale, dtype=np.float32)),
+                    "activation": "linear"
+                })
+            else:
+                raise ValueError(f"Слой {kind} не поддерживается")
+        return layers
+
+    def _activation(self, activation) -> str:
+        from scoring_engine import NumpyAutoencoder
+
+        if activation not in NumpyAutoencoder.ACTIVATIONS:
+            raise ValueError(f"Активация {activation} не поддерживается")
+        return activation
+
+    def save(self, path: str, spec: dict):
+        np.savez(path, spec=np.array(json.dumps(spec, ensure_ascii=False)), **self.arrays)
+
+
+def accepted_rows(path: str, preprocessor, data):
+    # Синтетика может содержать категории, которых препроцессор не видел при обучении.
+    # При handle_unknown="error" такие строки отбрасываются, но NumPy-препроцессор обязан отвергнуть их так же
+    from scoring_engine import load_scoring_model
+
+    try:
+        preprocessor.transform(data)
+        return data
+    except ValueError:
+        pass
+
+    numpy_preprocessor, _ = load_scoring_model(path)
+    accepted = []
+    for i in range(len(data)):
+        row = data.iloc[[i]]
+        try:
+            preprocessor.transform(row)
+            accepted.append(i)
+            continue
+        except ValueError:
+            pass
+        try:
+            numpy_preprocessor.transform(row)
+        except ValueError:
+            continue
+        raise AssertionError(f"NumPy-препроцессор принял строку, которую отверг sklearn: {row.iloc[0].to_dict()}")
+    return data.iloc[accepted]
+
+
+def verify(path: str, preprocessor, model, data, rtol: float, atol: float) -> float:
+    # Сверка с исходными sklearn + Keras
+    from scoring_engine import load_scoring_model
+
+    numpy_preprocessor, numpy_autoencoder = load_scoring_model(path)
+    expected = preprocessor.transform(data)
+    expected = expected.toarray() if hasattr(expected, "toarray") else np.asarray(expected, dtype=float)
+    actual = numpy_preprocessor.transform(data)
+    np.testing.assert_allclose(actual, expected, rtol=rtol, atol=atol, err_msg="Расхождение препроцессора")
+
+    expected_mse = np.mean(np.power(expected - model.predict(expected, verbose=0), 2), axis=1)
+    actual_mse = np.mean(np.power(actual - numpy_autoencoder.predict(actual), 2), axis=1)
+    np.testing.assert_allclose(actual_mse, expected_mse, rtol=rtol, atol=atol, err_msg="Расхождение ошибок реконструкции")
+    # Пропуски, которые препроцессор не заполняет, дают NaN в обеих реализациях — assert_allclose их сравнил выше
+    return float(np.nanmax(np.abs(actual_mse - expected_mse)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Выгрузка препроцессора и автоэнкодера в NumPy-артефакт без TensorFlow")
+    parser.add_argument("--preprocessor", default="preprocessor.joblib")
+    parser.add_argument("--model", default="model.h5")
+    parser.add_argument("--output", default=os.getenv("SCORING_MODEL_PATH", "scoring_model.npz"))
+    parser.add_argument("--no-check", action="store_true", help="не сверять результат с Keras на синтетических анкетах")
+    parser.add_argument("--synthetic-rows", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verify", action="store_true", help="дополнительно сверить результат с Keras на анкетах из базы")
+    parser.add_argument("--rows", type=int, default=1000, help="сколько последних анкет брать для сверки")
+    parser.add_argument("--rtol", type=float, default=1e-4)
+    parser.add_argument("--atol", type=float, default=1e-6)
+    args = parser.parse_args()
+
+    from joblib import load
+    from tensorflow.keras.models import load_model
+
+    preprocessor = load(args.preprocessor)
+    model = load_model(args.model)
+
+    exporter = Exporter()
+    spec = {"version": 1, **exporter.export_preprocessor(preprocessor), "layers": exporter.export_autoencoder(model)}
+    exporter.save(args.output, spec)
+    print(f"Сохранено: {args.output} ({len(exporter.arrays)} массивов, {len(spec['layers'])} слоёв)")
+
+    if args.no_check and not args.verify:
+        return
+
+    # Сверка идёт через ту же предобработку, что и в боте. Если она не прошла, артефакт удаляется,
+    # и бот продолжает считать через Keras вместо того, чтобы молча выдавать другие оценки
+    from bench_preprocess import make_dataset
+    from data_processing import DataProcessor
+
+    processor = DataProcessor()
+    verified = False
+    try:
+        if not args.no_check:
+            data = processor._preprocess_data(make_dataset(args.synthetic_rows, args.seed))
+            data = accepted_rows(args.output, preprocessor, data)
+            if data.empty:
+                raise AssertionError("Препроцессор отверг все синтетические анкеты")
+            max_error = verify(args.output, preprocessor, model, data, args.rtol, args.atol)
+            print(f"Сверка на {len(data)} синтетических анкетах пройдена, максимальное расхождение ошибки {max_error:.2e}")
+
+        if args.verify:
+            data = processor.store.load_recent_responses(args.rows)
+            if data.empty:
+                raise AssertionError("В базе нет анкет для сверки")
+            data = processor._preprocess_data(data)
+            max_error = verify(args.output, preprocessor, model, data, args.rtol, args.atol)
+            print(f"Сверка на {len(data)} анкетах пройдена, максимальное расхождение ошибки {max_error:.2e}")
+        verified = True
+    except (AssertionError, ValueError) as e:
+        # ValueError — например, неизвестная категория в реальной анкете при handle_unknown="error"
+        sys.exit(f"Сверка не пройдена, {args.output} удалён: {e}")
+    finally:
+        processor.close()
+        # Непроверенный артефакт бот подхватил бы сам — при любом сбое сверки он удаляется
+        if not verified and os.path.exists(args.output):
+            os.remove(args.output)
+
+
+if __name__ == "__main__":
+    main()
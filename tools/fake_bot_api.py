@@ -0,0 +1,145 @@
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from collections import deque
+from aiohttp import web
+
+# Локальная замена Bot API для нагрузочных тестов: бот подключается к ней через TELEGRAM_API_URL,
+# забирает обновления getUpdates и «отправляет» сообщения, которые складываются в очередь чата.
+# Обновления подкладывает сам тест через push()
+
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "LoadTest", "username": "load_test_bot"}
+REPLY_METHODS = ("sendMessage", "sendDocument", "editMessageText")
+
+
+class FakeBotAPI:
+    def __init__(self):
+        self.updates = deque()
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.delivered = {}
+        self.outbox = {}
+        self.calls = {}
+        self._changed = asyncio.Condition()
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    async def start(self, host: str, port: int) -> web.AppRunner:
+        runner = web.AppRunner(self.app())
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+    def _chat(self, chat_id: int) -> asyncio.Queue:
+        return self.outbox.setdefault(chat_id, asyncio.Queue())
+
+    async def push(self, chat_id: int, text: str, reply_to_text: str = None) -> int:
+        message = {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"student{chat_id}"},
+            "text": text
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        if reply_to_text is not None:
+            message["reply_to_message"] = {
+                "message_id": next(self.message_ids),
+                "date": int(time.time()),
+                "chat": message["chat"],
+                "from": BOT_USER,
+                "text": reply_to_text
+            }
+        return await self.push_message(message)
+
+    async def push_message(self, message: dict) -> int:
+        # Готовое сообщение в формате Bot API, например из записи tools/replay.py
+        update_id = next(self.update_ids)
+        self._chat(message["chat"]["id"])
+        async with self._changed:
+            self.updates.append({"update_id": update_id, "message": message})
+            self._changed.notify_all()
+        return update_id
+
+    async def wait_reply(self, chat_id: int, predicate, timeout: float) -> tuple:
+        # Возвращает (время, текст) первого подходящего сообщения бота; прочие пропускаются
+        queue = self._chat(chat_id)
+        deadline = time.monotonic() + timeout
+        while True:
+            sent_at, text = await asyncio.wait_for(queue.get(), max(0.0, deadline - time.monotonic()))
+            if predicate(text):
+                return sent_at, text
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post()) if request.can_read_body else {}
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+        if method == "getUpdates":
+            result = await self._get_updates(params)
+        elif method == "getMe":
+            result = BOT_USER
+        elif method in REPLY_METHODS:
+            chat_id = int(params["chat_id"])
+            text = params.get("text") or params.get("caption") or ""
+            self._chat(chat_id).put_nowait((time.monotonic(), text))
+            result = {
+                "message_id": int(params.get("message_id") or next(self.message_ids)),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": text
+            }
+            if method == "sendDocument":
+                del result["text"]
+                result["document"] = {"file_id": "load-test", "file_unique_id": "load-test"}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, params: dict) -> list:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        async with self._changed:
+            while self.updates and self.updates[0]["update_id"] < offset:
+                self.updates.popleft()
+            if not self.updates and timeout:
+                try:
+                    await asyncio.wait_for(self._changed.wait_for(lambda: self.updates), timeout)
+                except asyncio.TimeoutError:
+                    return []
+            batch = list(itertools.islice(self.updates, limit))
+        now = time.monotonic()
+        for update in batch:
+            self.delivered.setdefault(update["update_id"], now)
+        return batch
+
+
+async def serve(host: str, port: int):
+    api = FakeBotAPI()
+    runner = await api.start(host, port)
+    print(f"Фиктивный Bot API: http://{host}:{port} (TELEGRAM_API_URL), Ctrl+C — выход")
+    try:
+        while True:
+            await asyncio.sleep(10)
+            print(json.dumps(api.calls, ensure_ascii=False))
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальная замена Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,88 @@
+import argparse
+import asyncio
+import itertools
+import random
+import time
+import aiohttp
+import numpy as np
+
+# Имитация Telegram для BOT_MODE=webhook: шлёт обновления на локальный вебхук с заданной
+# частотой и печатает коды ответов и задержку приёма. Ответы бота уходят в настоящий Bot API
+# (или в TELEGRAM_API_URL), поэтому для нагрузки без сети бот лучше запускать с фиктивным токеном
+
+CHAT_TEXTS = [
+    "Не могу уснуть перед контрольной, что делать?",
+    "У меня стресс перед экзаменом",
+    "Поссорился с другом и не знаю, как помириться"
+]
+SURVEY_TEXTS = ["8000", "45", "72", "7.5", "Хорошо", "23:30", "7:00", "7", "нет", "15", "Женский", "6"]
+
+
+def make_update(update_id: int, user_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "text": text
+        }
+    }
+
+
+async def post(session, url: str, secret: str, update: dict, results: list):
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    started = time.perf_counter()
+    try:
+        async with session.post(url, json=update, headers=headers) as response:
+            status = response.status
+    except aiohttp.ClientError as e:
+        status = type(e).__name__
+    results.append((status, time.perf_counter() - started))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Фиктивный клиент Telegram для проверки вебхука")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", default=None)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=200, help="обновлений в секунду")
+    parser.add_argument("--chat-share", type=float, default=0.5, help="доля свободного текста")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    update_ids = itertools.count(1)
+    results = []
+    tasks = []
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        # Каждый пользователь сначала нажимает /start, дальше — ответы на опрос вперемешку с вопросами модели
+        for user_id in range(1, args.users + 1):
+            tasks.append(asyncio.create_task(
+                post(session, args.url, args.secret, make_update(next(update_ids), user_id, "/start"), results)
+            ))
+        for i in range(args.updates):
+            user_id = rng.randint(1, args.users)
+            text = rng.choice(CHAT_TEXTS) if rng.random() < args.chat_share else rng.choice(SURVEY_TEXTS)
+            tasks.append(asyncio.create_task(
+                post(session, args.url, args.secret, make_update(next(update_ids), user_id, text), results)
+            ))
+            await asyncio.sleep(max(0.0, started + (i + 1) / args.rate - time.perf_counter()))
+        await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    statuses = {}
+    for status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    latencies = np.array([latency for _, latency in results]) * 1000
+    print(f"Отправлено {len(results)} обновлений за {elapsed:.1f} с ({len(results) / elapsed:.0f}/с)")
+    print(f"Коды ответов: {statuses}")
+    print(f"Задержка приёма, мс: p50 {np.percentile(latencies, 50):.1f}, "
+          f"p95 {np.percentile(latencies, 95):.1f}, max {latencies.max():.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
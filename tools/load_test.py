@@ -0,0 +1,204 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_bot_api import FakeBotAPI
+
+# Нагрузочный тест без Telegram: бот запускается отдельным процессом против tools/fake_bot_api.py,
+# N учеников проходят /start, согласие, опрос из SurveyManager.questions и свободный чат.
+# Задержка шага — от выдачи обновления боту в getUpdates до его ответа в этот чат
+
+TOKEN = "123456:LOADTEST"
+ADMIN_CHAT_ID = 1
+ADMIN_PASSWORD = "load-test"
+CHAT_TEXTS = [
+    "Не могу уснуть перед контрольной, что делать?",
+    "У меня стресс перед экзаменом",
+    "Поссорился с другом и не знаю, как помириться",
+    "Как перестать волноваться перед ответом у доски?"
+]
+
+
+class StubChatModel:
+    # Заглушка вместо ChatModel: фиксированная задержка вместо генерации
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    async def generate_response(self, prompt: str, user_id: int, on_partial=None) -> str:
+        await asyncio.sleep(self.delay)
+        return "Понимаю. Попробуй сделать несколько глубоких вдохов и составить план на завтра."
+
+    def close(self):
+        pass
+
+
+def run_bot(chat: str, chat_delay: float):
+    import main
+
+    class LoadTestBot(main.MentalHealthBot):
+        def _load_chat_model(self):
+            if chat == "stub":
+                return StubChatModel(chat_delay)
+            return super()._load_chat_model()
+
+    asyncio.run(LoadTestBot().run())
+
+
+def answer_for(question: dict, rng: random.Random) -> str:
+    if question["type"] == "int":
+        return str(rng.randint(question["min"], question["max"]))
+    if question["type"] == "float":
+        return f"{rng.uniform(question['min'], question['max']):.1f}"
+    if question["type"] == "category":
+        return rng.choice(question["options"])
+    if question["type"] == "time":
+        return f"{rng.randint(0, 23)}:{rng.randint(0, 59):02d}"
+    return rng.choice(["нет", "контрольная по математике"])
+
+
+class LoadTest:
+    def __init__(self, api: FakeBotAPI, questions: list, args):
+        self.api = api
+        self.questions = questions
+        self.args = args
+        self.latencies = {}
+        self.errors = {}
+
+    async def step(self, kind: str, chat_id: int, text: str, expect, reply_to_text: str = None) -> str:
+        update_id = await self.api.push(chat_id, text, reply_to_text)
+        try:
+            sent_at, reply = await self.api.wait_reply(chat_id, expect, self.args.timeout)
+        except asyncio.TimeoutError:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+            raise
+        self.latencies.setdefault(kind, []).append(sent_at - self.api.delivered[update_id])
+        return reply
+
+    async def enroll(self, chat_id: int):
+        await self.step("start", chat_id, "/start", lambda text: "согласие" in text)
+        await self.step("consent", chat_id, "Согласен", lambda text: text.startswith("✅"))
+
+    async def run_survey(self):
+        await self.step("admin", ADMIN_CHAT_ID, "/admin", lambda text: "пароль администратора" in text)
+        await self.step("admin", ADMIN_CHAT_ID, ADMIN_PASSWORD, lambda text: text.startswith("✅"),
+                        reply_to_text="🔒 Введите пароль администратора:")
+        await self.api.push(ADMIN_CHAT_ID, "/run_survey")
+
+    async def student(self, chat_id: int, rng: random.Random):
+        await self.api.wait_reply(chat_id, lambda text: text.startswith("(1/"), self.args.timeout)
+        for number, question in enumerate(self.questions, start=1):
+            last = number == len(self.questions)
+            expected = "📊" if last else f"({number + 1}/"
+            await self.step("survey_answer", chat_id, answer_for(question, rng),
+                            lambda text, expected=expected: text.startswith(expected))
+        for _ in range(self.args.chat_messages):
+            await asyncio.sleep(rng.uniform(0, self.args.think_time))
+            await self.step("chat", chat_id, rng.choice(CHAT_TEXTS), lambda text: True)
+
+    async def run(self) -> float:
+        students = [1000 + i for i in range(self.args.students)]
+        started = time.monotonic()
+        await asyncio.gather(*(self.enroll(chat_id) for chat_id in students), return_exceptions=True)
+        flows = [
+            asyncio.create_task(self.student(chat_id, random.Random(self.args.seed + chat_id)))
+            for chat_id in students
+        ]
+        await self.run_survey()
+        await asyncio.gather(*flows, return_exceptions=True)
+        return time.monotonic() - started
+
+
+def process_memory_mb(pid: int) -> dict:
+    memory = {}
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith(("VmRSS:", "VmHWM:")):
+                name, value = line.split(":")
+                memory["rss_mb" if name == "VmRSS" else "peak_rss_mb"] = round(int(value.split()[0]) / 1024, 1)
+    return memory
+
+
+async def main_async(args):
+    workdir = tempfile.mkdtemp(prefix="load_test_")
+    api = FakeBotAPI()
+    runner = await api.start("127.0.0.1", args.api_port)
+
+    env = {
+        **os.environ,
+        "BOT_TOKEN": TOKEN,
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{args.api_port}",
+        "ADMIN_PASSWORD": ADMIN_PASSWORD,
+        "DB_PATH": os.path.join(workdir, "bot.sqlite3"),
+        "LOG_FILE": os.path.join(workdir, "bot.log"),
+        "LOG_LEVEL": args.log_level,
+        "CHAT_STREAMING": "0",
+        "METRICS_PORT": "0",
+        "BOT_MODE": "polling",
+        "BROADCAST_RATE": str(args.broadcast_rate),
+        "TZ": os.getenv("TZ", "Europe/Moscow")
+    }
+    bot = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--bot", "--chat", args.chat, "--chat-delay", str(args.chat_delay)],
+        cwd=workdir, env=env, stderr=open(os.path.join(workdir, "stderr.log"), "w")
+    )
+    try:
+        from survey_module import SurveyManager
+
+        questions = SurveyManager(None, None, None).questions
+        test = LoadTest(api, questions, args)
+        elapsed = await test.run()
+        memory = process_memory_mb(bot.pid)
+    finally:
+        bot.send_signal(signal.SIGINT)
+        try:
+            bot.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            bot.kill()
+        await runner.cleanup()
+
+    handled = sum(len(values) for values in test.latencies.values())
+    print(f"Учеников: {args.students}, чат: {args.chat}, рабочий каталог: {workdir}")
+    print(f"Обработано шагов: {handled} за {elapsed:.1f} с — {handled / elapsed:.1f} обновлений/с")
+    print(f"{'шаг':>14} {'кол-во':>7} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'таймауты':>9}")
+    for kind, values in sorted(test.latencies.items()):
+        values = np.array(values) * 1000
+        print(f"{kind:>14} {len(values):>7} {np.percentile(values, 50):>9.1f} {np.percentile(values, 95):>9.1f} "
+              f"{np.percentile(values, 99):>9.1f} {test.errors.get(kind, 0):>9}")
+    print(f"Память бота: {memory}")
+    print(f"Вызовы Bot API: {json.dumps(api.calls, ensure_ascii=False)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота против фиктивного Bot API")
+    parser.add_argument("--students", type=int, default=50)
+    parser.add_argument("--chat-messages", type=int, default=3, help="сообщений в чат после опроса")
+    parser.add_argument("--think-time", type=float, default=2.0, help="пауза ученика перед сообщением, с")
+    parser.add_argument("--chat", choices=["stub", "real"], default="stub",
+                        help="stub — заглушка, real — ChatModel (маленькую модель задать через CHAT_MODEL_NAME)")
+    parser.add_argument("--chat-delay", type=float, default=0.5, help="задержка заглушки, с")
+    parser.add_argument("--broadcast-rate", type=float, default=30)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--log-level", default="INFO")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--bot", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.bot:
+        run_bot(args.chat, args.chat_delay)
+    else:
+        asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
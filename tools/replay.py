@@ -0,0 +1,211 @@
+import argparse
+import asyncio
+import cProfile
+import json
+import os
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_bot_api import FakeBotAPI
+from load_test import TOKEN, process_memory_mb, run_bot
+
+# Воспроизведение записи RECORD_UPDATES_PATH (update_recorder.py) против tools/fake_bot_api.py:
+# бот запускается отдельным процессом, сообщения выдаются в getUpdates с исходными интервалами,
+# ускоренными в --speed раз (0 — без пауз). Профиль бота — cProfile (.pstats) или py-spy (speedscope)
+
+HANDLER_SAMPLE = re.compile(r'^bot_handler_seconds_(sum|count)\{handler="([^"]+)"\} (\S+)$')
+
+
+def load_recording(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return sorted(records, key=lambda record: record["t"])
+
+
+def seed_users(db_path: str, records: list):
+    # Рассылка опроса из записи (/run_survey) дойдёт только до зарегистрированных учеников
+    from survey_storage import SurveyStore
+
+    store = SurveyStore(db_path)
+    for chat_id in {record["update"]["message"]["chat"]["id"] for record in records}:
+        store.add_user(chat_id)
+    store.close()
+
+
+def run_profiled_bot(chat: str, chat_delay: float, profile_path: str):
+    if not profile_path:
+        run_bot(chat, chat_delay)
+        return
+    # Профилируется поток event loop; генерация в пуле потоков видна только как ожидание
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        run_bot(chat, chat_delay)
+    finally:
+        profiler.disable()
+        profiler.dump_stats(profile_path)
+
+
+async def handler_seconds(port: int) -> dict:
+    from aiohttp import ClientSession
+
+    async with ClientSession() as session:
+        async with session.get(f"http://127.0.0.1:{port}/metrics") as response:
+            text = await response.text()
+    totals = {}
+    for line in text.splitlines():
+        match = HANDLER_SAMPLE.match(line)
+        if match:
+            kind, handler, value = match.groups()
+            totals.setdefault(handler, {})[kind] = float(value)
+    return totals
+
+
+async def feed(api: FakeBotAPI, records: list, speed: float) -> float:
+    started = time.monotonic()
+    first = records[0]["t"]
+    for record in records:
+        if speed:
+            delay = started + (record["t"] - first) / speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        message = dict(record["update"]["message"])
+        message["message_id"] = next(api.message_ids)
+        message["date"] = int(time.time())
+        await api.push_message(message)
+    return time.monotonic() - started
+
+
+async def wait_idle(api: FakeBotAPI, pushed: int, idle: float, timeout: float):
+    # Конец воспроизведения — все обновления забраны ботом и вызовы Bot API стихли на idle секунд
+    deadline = time.monotonic() + timeout
+    last_calls, quiet_since = None, time.monotonic()
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.2)
+        calls = sum(count for method, count in api.calls.items() if method != "getUpdates")
+        if calls != last_calls:
+            last_calls, quiet_since = calls, time.monotonic()
+        elif len(api.delivered) >= pushed and time.monotonic() - quiet_since >= idle:
+            return True
+    return False
+
+
+async def main_async(args):
+    records = load_recording(args.recording)
+    records = [record for record in records if "message" in record["update"]]
+    if not records:
+        sys.exit("В записи нет сообщений")
+
+    from update_recorder import PASSWORD_PLACEHOLDER
+
+    workdir = tempfile.mkdtemp(prefix="replay_")
+    db_path = os.path.join(workdir, "bot.sqlite3")
+    if args.seed_users:
+        seed_users(db_path, records)
+
+    api = FakeBotAPI()
+    runner = await api.start("127.0.0.1", args.api_port)
+    env = {
+        **os.environ,
+        "BOT_TOKEN": TOKEN,
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{args.api_port}",
+        "ADMIN_PASSWORD": PASSWORD_PLACEHOLDER,
+        "DB_PATH": db_path,
+        "LOG_FILE": os.path.join(workdir, "bot.log"),
+        "LOG_LEVEL": args.log_level,
+        "CHAT_STREAMING": os.getenv("CHAT_STREAMING", "0"),
+        "METRICS_PORT": str(args.metrics_port),
+        "BOT_MODE": "polling",
+        "TZ": os.getenv("TZ", "Europe/Moscow")
+    }
+    env.pop("RECORD_UPDATES_PATH", None)
+    profile_path = None
+    command = [sys.executable, os.path.abspath(__file__), "--bot", "--chat", args.chat,
+               "--chat-delay", str(args.chat_delay)]
+    if args.profiler == "cprofile":
+        profile_path = os.path.abspath(args.profile_out or os.path.join(workdir, "replay.pstats"))
+        command += ["--profile-out", profile_path]
+    bot = subprocess.Popen(command, cwd=workdir, env=env, stderr=open(os.path.join(workdir, "stderr.log"), "w"))
+
+    spy = None
+    if args.profiler == "py-spy":
+        if shutil.which("py-spy") is None:
+            sys.exit("py-spy не найден в PATH")
+        profile_path = os.path.abspath(args.profile_out or os.path.join(workdir, "replay.speedscope.json"))
+        spy = subprocess.Popen(["py-spy", "record", "--pid", str(bot.pid), "--format", "speedscope",
+                                "--rate", str(args.rate), "--output", profile_path])
+    try:
+        fed = await feed(api, records, args.speed)
+        finished = await wait_idle(api, len(records), args.idle, args.timeout)
+        elapsed = time.monotonic() - min(api.delivered.values(), default=time.monotonic())
+        memory = process_memory_mb(bot.pid)
+        replayed = await handler_seconds(args.metrics_port) if args.metrics_port else {}
+    finally:
+        if spy is not None:
+            spy.send_signal(signal.SIGINT)
+            spy.wait(timeout=60)
+        bot.send_signal(signal.SIGINT)
+        try:
+            bot.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            bot.kill()
+        await runner.cleanup()
+
+    span = records[-1]["t"] - records[0]["t"]
+    print(f"Запись: {args.recording}, сообщений: {len(records)}, длительность записи {span:.1f} с")
+    print(f"Выдано за {fed:.1f} с (скорость {args.speed or 'максимальная'}), обработано за {elapsed:.1f} с"
+          f"{'' if finished else ' — бот не успел обработать всё до таймаута'}")
+    print(f"Рабочий каталог: {workdir}")
+    if replayed:
+        print(f"{'обработчик':>28} {'кол-во':>7} {'запись, мс':>11} {'повтор, мс':>11}")
+        for handler in sorted({record["handler"] for record in records} | set(replayed)):
+            recorded = [record["seconds"] for record in records if record["handler"] == handler]
+            mean_recorded = f"{np.mean(recorded) * 1000:.1f}" if recorded else "—"
+            sample = replayed.get(handler, {})
+            mean_replayed = f"{sample['sum'] / sample['count'] * 1000:.1f}" if sample.get("count") else "—"
+            print(f"{handler:>28} {len(recorded):>7} {mean_recorded:>11} {mean_replayed:>11}")
+    print(f"Память бота: {memory}")
+    print(f"Вызовы Bot API: {json.dumps(api.calls, ensure_ascii=False)}")
+    if profile_path:
+        viewer = "python -m pstats" if args.profiler == "cprofile" else "https://www.speedscope.app"
+        print(f"Профиль: {profile_path} (открыть: {viewer})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение записанных обновлений против фиктивного Bot API")
+    parser.add_argument("recording", nargs="?", help="JSONL из RECORD_UPDATES_PATH")
+    parser.add_argument("--speed", type=float, default=1.0, help="ускорение относительно записи, 0 — без пауз")
+    parser.add_argument("--profiler", choices=["none", "cprofile", "py-spy"], default="cprofile")
+    parser.add_argument("--profile-out", help="файл профиля; по умолчанию в рабочем каталоге")
+    parser.add_argument("--rate", type=int, default=100, help="частота выборок py-spy, Гц")
+    parser.add_argument("--chat", choices=["stub", "real"], default="stub",
+                        help="stub — заглушка, real — ChatModel (маленькую модель задать через CHAT_MODEL_NAME)")
+    parser.add_argument("--chat-delay", type=float, default=0.5, help="задержка заглушки, с")
+    parser.add_argument("--no-seed-users", dest="seed_users", action="store_false",
+                        help="не регистрировать чаты из записи как учеников")
+    parser.add_argument("--idle", type=float, default=3.0, help="тишина в Bot API, после которой повтор окончен, с")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--metrics-port", type=int, default=9103, help="порт /metrics бота, 0 — без сравнения")
+    parser.add_argument("--log-level", default="INFO")
+    parser.add_argument("--bot", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.bot:
+        run_profiled_bot(args.chat, args.chat_delay, args.profile_out)
+    elif not args.recording:
+        parser.error("не указан файл записи")
+    else:
+        asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Обработчики, чей текст — свободная речь ученика: в записи он заменяется заглушкой той же длины
+REDACTED_HANDLERS = ("_free_dialog_handler",)
+# Ответы анкеты (здоровье, сон, настроение) заменяются значением того же типа, согласие — кнопкой
+SURVEY_HANDLERS = ("_survey_answer_handler",)
+CONSENT_HANDLERS = ("_consent_handler",)
+CONSENT_OPTIONS = ("Согласен",)
+ADMIN_HANDLERS = ("handle_admin_command",)
+PASSWORD_PLACEHOLDER = "recorded-admin-password"
+
+
+class UpdateRecorder:
+    # Внутренний middleware aiogram: пишет каждое обработанное сообщение в JSONL (одна строка —
+    # время прихода от начала записи, обработчик, длительность и само обновление) для tools/replay.py.
+    # Идентификаторы пользователей и чатов хешируются с солью, имена удаляются, свободный текст
+    # чата, ответы анкеты и пароль администратора заменяются. Запись в файл идёт из отдельного потока.
+    # answer_placeholder(номер вопроса, ответ) — замена ответа анкеты, см. SurveyManager.placeholder_answer
+    def __init__(self, path: str, salt: str = None, redact_chat: bool = None, answer_placeholder=None):
+        self.path = path
+        self.answer_placeholder = answer_placeholder
+        self.salt = salt or os.getenv("RECORD_SALT") or os.urandom(16).hex()
+        self.redact_chat = redact_chat if redact_chat is not None else os.getenv("RECORD_REDACT_CHAT", "1") == "1"
+        self.started = time.monotonic()
+        self.recorded = 0
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="update-recorder", daemon=True)
+        self._writer.start()
+        logger.info(f"Запись обновлений в {self.path}")
+
+    async def __call__(self, handler, event, data: dict):
+        arrived = time.monotonic()
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        # Номер вопроса читается до обработчика: после ответа анкета уже переходит к следующему
+        question = None
+        if name in SURVEY_HANDLERS and data.get("state") is not None:
+            question = (await data["state"].get_data()).get("current_question")
+        try:
+            return await handler(event, data)
+        finally:
+            update = data.get("event_update")
+            if update is not None:
+                self._queue.put((arrived - self.started, name, time.monotonic() - arrived, update, question))
+
+    def _hash_id(self, value: int) -> int:
+        digest = hashlib.blake2b(f"{self.salt}:{value}".encode(), digest_size=5).digest()
+        return int.from_bytes(digest, "big") or 1
+
+    def _anonymize(self, value, key: str = None):
+        if isinstance(value, dict):
+            # Чат и пользователь сводятся к хешированному id: имена, username и язык не пишутся
+            if key in ("chat", "sender_chat"):
+                return {"id": self._hash_id(value["id"]), "type": value["type"]}
+            if key in ("from", "user"):
+                return {"id": self._hash_id(value["id"]), "is_bot": value["is_bot"], "first_name": "user"}
+            return {name: self._anonymize(item, name) for name, item in value.items()}
+        if isinstance(value, list):
+            return [self._anonymize(item) for item in value]
+        return value
+
+    def _redact(self, update: dict, handler: str, question: int = None):
+        message = update.get("message")
+        if not message or "text" not in message:
+            return
+        text = message["text"]
+        if handler in ADMIN_HANDLERS and not text.startswith("/"):
+            message["text"] = PASSWORD_PLACEHOLDER
+        elif not self.redact_chat:
+            return
+        elif handler in REDACTED_HANDLERS:
+            # Длина сохраняется: от неё зависят токенизация и время генерации
+            message["text"] = "x" * len(text)
+            message.pop("entities", None)
+        elif handler in SURVEY_HANDLERS:
+            if question is not None and self.answer_placeholder is not None:
+                message["text"] = self.answer_placeholder(question, text)
+            else:
+                message["text"] = "x" * len(text)
+            message.pop("entities", None)
+        elif handler in CONSENT_HANDLERS and text not in CONSENT_OPTIONS:
+            message["text"] = "x" * len(text)
+            message.pop("entities", None)
+
+    def _record(self, offset: float, handler: str, seconds: float, update, question: int = None) -> str:
+        payload = self._anonymize(update.model_dump(mode="json", exclude_none=True, by_alias=True))
+        self._redact(payload, handler, question)
+        return json.dumps(
+            {"t": round(offset, 4), "handler": handler, "seconds": round(seconds, 4), "update": payload},
+            ensure_ascii=False,
+            separators=(",", ":")
+        )
+
+    def close(self):
+        self._queue.put(None)
+        self._writer.join(timeout=5)
+
+    def _write_loop(self):
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                try:
+                    f.write(self._record(*item) + "\n")
+                    self.recorded += 1
+                except Exception as e:
+                    logger.error(f"Ошибка записи обновления: {str(e)}")
+                if self._queue.empty():
+                    f.flush()
@@ -0,0 +1,181 @@
+import asyncio
+import hmac
+import logging
+import os
+import signal
+from collections import deque
+from aiogram import types
+from aiohttp import web
+from dotenv import load_dotenv
+from metrics import WEBHOOK_QUEUE
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookServer:
+    # Приём обновлений Telegram через aiohttp. Запрос только ставит обновление в очередь и сразу
+    # получает 200, обработку ведёт пул воркеров. Очередей две: срочная (опрос, согласие, админка,
+    # команды) и чат с моделью. Срочные разбираются первыми, а чату отдаётся не больше chat_workers
+    # воркеров, чтобы долгая генерация не занимала весь пул
+    def __init__(self, bot, dp, is_priority, host: str = None, port: int = None, path: str = None,
+                 workers: int = None, chat_workers: int = None, queue_size: int = None, drain_timeout: float = None):
+        self.bot = bot
+        self.dp = dp
+        self.is_priority = is_priority
+        self.host = host or os.getenv("WEBHOOK_HOST", "127.0.0.1")
+        self.port = port or int(os.getenv("WEBHOOK_PORT", "8080"))
+        self.path = path or os.getenv("WEBHOOK_PATH", "/webhook")
+        self.url = os.getenv("WEBHOOK_URL")
+        self.secret = os.getenv("WEBHOOK_SECRET")
+        self.workers = workers or int(os.getenv("WEBHOOK_WORKERS", "16"))
+        self.chat_workers = min(self.workers, chat_workers or int(os.getenv("WEBHOOK_CHAT_WORKERS", "12")))
+        self.queue_size = queue_size or int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+        self.drain_timeout = drain_timeout or float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))
+
+        self.priority = deque()
+        self.chat = deque()
+        self.busy = 0
+        self.chat_busy = 0
+        self.accepting = True
+        self._changed = asyncio.Condition()
+        self._chat_locks = {}
+        self._tasks = []
+        self._rejects = set()
+        WEBHOOK_QUEUE.set_function(lambda: {("priority",): len(self.priority), ("chat",): len(self.chat)})
+
+    def _app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret and not hmac.compare_digest(
+            request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), self.secret
+        ):
+            return web.Response(status=401)
+        if not self.accepting:
+            # Telegram повторит обновление, когда бот поднимется снова
+            return web.Response(status=503)
+
+        try:
+            update = types.Update.model_validate(await request.json(), context={"bot": self.bot})
+        except ValueError as e:
+            # Повтор того же тела ничего не изменит — подтверждаем, чтобы Telegram не зациклился
+            logger.error("Некорректное обновление: %s", e)
+            return web.Response()
+        priority = await self.is_priority(update)
+        queue = self.priority if priority else self.chat
+        if len(queue) >= self.queue_size:
+            if priority:
+                # Ответ не 2xx — Telegram придержит обновление и пришлёт его позже
+                logger.warning("Срочная очередь переполнена, обновление %s отклонено", update.update_id)
+                return web.Response(status=503)
+            logger.warning("Очередь чата переполнена, обновление %s пропущено", update.update_id)
+            task = asyncio.create_task(self._reject(update))
+            self._rejects.add(task)
+            task.add_done_callback(self._rejects.discard)
+            return web.Response()
+
+        async with self._changed:
+            queue.append(update)
+            self._changed.notify()
+        return web.Response()
+
+    async def _reject(self, update: types.Update):
+        if update.message is None:
+            return
+        try:
+            await self.bot.send_message(update.message.chat.id, "⏳ Сейчас много обращений, напишите чуть позже.")
+        except Exception as e:
+            logger.error("Не удалось ответить на пропущенное обновление: %s", e)
+
+    def _ready(self) -> bool:
+        return bool(self.priority) or (bool(self.chat) and self.chat_busy < self.chat_workers)
+
+    async def _worker(self):
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(self._ready)
+                priority = bool(self.priority)
+                update = self.priority.popleft() if priority else self.chat.popleft()
+                self.busy += 1
+                if not priority:
+                    self.chat_busy += 1
+            try:
+                if priority:
+                    await self._feed_in_order(update)
+                else:
+                    await self.dp.feed_update(self.bot, update)
+            except Exception as e:
+                logger.error("Ошибка обработки обновления %s: %s", update.update_id, e, exc_info=True)
+            finally:
+                async with self._changed:
+                    self.busy -= 1
+                    if not priority:
+                        self.chat_busy -= 1
+                    self._changed.notify_all()
+
+    async def _feed_in_order(self, update: types.Update):
+        # Ответы одного пользователя на опрос меняют одно FSM-состояние — обрабатываются по порядку
+        message = update.message
+        if message is None:
+            await self.dp.feed_update(self.bot, update)
+            return
+        chat_id = message.chat.id
+        entry = self._chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self.dp.feed_update(self.bot, update)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chat_locks[chat_id]
+
+    def _idle(self) -> bool:
+        return not self.priority and not self.chat and self.busy == 0
+
+    async def _drain(self):
+        self.accepting = False
+        logger.info(f"Остановка вебхука: в очереди {len(self.priority) + len(self.chat)}, в работе {self.busy}")
+        try:
+            async with self._changed:
+                await asyncio.wait_for(self._changed.wait_for(self._idle), self.drain_timeout)
+            logger.info("Все обновления обработаны")
+        except asyncio.TimeoutError:
+            logger.warning(f"За {self.drain_timeout} с не дождались: в очереди {len(self.priority) + len(self.chat)}, "
+                           f"в работе {self.busy}")
+
+    async def run(self):
+        if self.url:
+            await self.bot.set_webhook(
+                url=self.url.rstrip("/") + self.path,
+                secret_token=self.secret,
+                allowed_updates=self.dp.resolve_used_update_types(),
+                max_connections=int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+            )
+            logger.info(f"Вебхук установлен: {self.url}")
+
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        runner = web.AppRunner(self._app())
+        await runner.setup()
+        await web.TCPSite(runner, self.host, self.port).start()
+        logger.info(f"Вебхук слушает {self.host}:{self.port}{self.path}, воркеров {self.workers}")
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:
+                pass
+        try:
+            await stop.wait()
+        finally:
+            await self._drain()
+            await runner.cleanup()
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)